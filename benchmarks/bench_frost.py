@@ -0,0 +1,139 @@
+"""Benchmark of FrostSource against a local stand-in server with recorded responses
+
+Compares a new connection per request (as requests.get does), the pooled session, concurrent batch
+loading, and the response cache.
+With --parse, compares FrostSource.parse with the original parser on synthetic responses instead.
+
+Example:
+    python benchmarks/bench_frost.py test/files/frost --latency 0.05
+    python benchmarks/bench_frost.py --parse -n 1000 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import requests
+
+import titantuner
+import titantuner.source
+import titantuner.source.standin
+
+
+def parse_lines(data):
+    """ The original observation-by-observation parser, used as a reference """
+    values = list()
+    lats = list()
+    lons = list()
+    elevs = list()
+    units = None
+    for tseries in data["data"]["tseries"]:
+        units = tseries["header"]["extra"]["element"]["unit"]
+        lat = float(tseries["header"]["extra"]["station"]["location"][0]["value"]["latitude"])
+        lon = float(tseries["header"]["extra"]["station"]["location"][0]["value"]["longitude"])
+        for observation in tseries["observations"]:
+            reference_time = observation["time"]
+            date = int(reference_time[0:4] + reference_time[5:7] + reference_time[8:10])
+            hour = int(reference_time[11:13])
+            minute = int(reference_time[14:16])
+            second = int(reference_time[17:19])
+            value = observation["body"]["value"]
+            if "kvcorrqc1" in observation["body"]:
+                value = observation["body"]["kvcorrqc1"]
+            elif "kvcheckfailed" in observation["body"]:
+                continue
+            if value in ["-32766", "-32767"]:
+                continue
+            unixtime = titantuner.date_to_unixtime(date) + hour * 3600 + minute * 60 + second
+            if value == "":
+                value = np.nan
+            value = float(value)
+            if not np.isnan(value):
+                values += [value]
+                lats += [lat]
+                lons += [lon]
+                elevs += [0]
+    return values, lats, lons, elevs, units
+
+
+def create_response(num_stations, num_hours, seed=0):
+    """Returns a synthetic frost response with observations for num_hours for num_stations"""
+    rng = np.random.default_rng(seed)
+    tseries = list()
+    for s in range(num_stations):
+        observations = list()
+        for h in range(num_hours):
+            body = {"value": "%.1f" % rng.normal(10, 5)}
+            if rng.uniform() < 0.05:
+                body["kvcorrqc1"] = "%.1f" % rng.normal(10, 5)
+            elif rng.uniform() < 0.05:
+                body["kvcheckfailed"] = "1"
+            observations += [{"time": "2023-09-24T%02d:00:00Z" % h, "body": body}]
+        location = {"value": {"latitude": "%.4f" % rng.uniform(58, 71), "longitude": "%.4f" % rng.uniform(4, 31)}}
+        tseries += [{"header": {"id": {"stationid": s}, "extra": {"element": {"unit": "degC"}, "station": {"location": [location]}}},
+                     "observations": observations}]
+    return {"data": {"tseries": tseries}}
+
+
+def benchmark_parse(sizes, num_hours):
+    print("%10s %12s %12s %12s %8s" % ("stations", "observations", "loop [s]", "batch [s]", "speedup"))
+    for num in sizes:
+        data = create_response(num, num_hours)
+        s_time = time.time()
+        expected = parse_lines(data)
+        time_loop = time.time() - s_time
+        s_time = time.time()
+        actual = titantuner.source.FrostSource.parse(data)
+        time_batch = time.time() - s_time
+        for e, a in zip(expected[0:4], actual[0:4]):
+            np.testing.assert_array_equal(e, a)
+        print("%10d %12d %12.4f %12.4f %8.1f" % (num, num * num_hours, time_loop, time_batch, time_loop / time_batch))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks loading data from frost')
+    parser.add_argument('directory', nargs='?', help="Directory with recorded frost responses")
+    parser.add_argument('-e', default="air_temperature", help="Element to request", dest="element")
+    parser.add_argument('-n', type=int, nargs='+', default=[20], help="Number of loads, or of stations with --parse", dest="num")
+    parser.add_argument('--latency', type=float, default=0.05, help="Latency of the stand-in server [s]")
+    parser.add_argument('--parse', action="store_true", help="Benchmark parsing instead of fetching")
+    parser.add_argument('--hours', type=int, default=24, help="Hours of observations per station with --parse")
+    args = parser.parse_args()
+
+    if args.parse:
+        benchmark_parse(args.num, args.hours)
+        return
+    if args.directory is None:
+        parser.error("directory is required unless --parse is used")
+    num = args.num[0]
+
+    unixtime = titantuner.date_to_unixtime(20230924, 12)
+    with titantuner.source.standin.FrostStandIn(args.directory, latency=args.latency) as standin, tempfile.TemporaryDirectory() as tempdir:
+        source = titantuner.source.FrostSource("id", standin.url)
+        parameters = source.get_parameters(args.element, unixtime)
+
+        s_time = time.time()
+        for i in range(num):
+            requests.get(standin.url, parameters, timeout=30).json()
+        print("%-20s %8.4f s/load" % ("new connection", (time.time() - s_time) / num))
+
+        s_time = time.time()
+        for i in range(num):
+            source.load(args.element, unixtime)
+        print("%-20s %8.4f s/load" % ("pooled session", (time.time() - s_time) / num))
+
+        unixtimes = [unixtime + h * 3600 for h in range(num)]
+        s_time = time.time()
+        source.load_batch([args.element], unixtimes, max_concurrency=8)
+        print("%-20s %8.4f s/load" % ("batch", (time.time() - s_time) / num))
+
+        source.cache = titantuner.cache.DiskCache(tempdir, 10**8, ".json")
+        source.load(args.element, unixtime)
+        s_time = time.time()
+        for i in range(num):
+            source.load(args.element, unixtime)
+        print("%-20s %8.4f s/load" % ("response cache", (time.time() - s_time) / num))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark of the peak memory (RSS) of the server process for a large dataset and several sessions
+
+Each configuration runs in a new process, which loads a synthetic dataset, opens a number of sessions
+(Apps) on it and applies a test in each of them, as when several users test the same dataset. The peak
+RSS is reported after loading the dataset and after the sessions, with the observations stored in double
+and in single precision (--float32). As in the server, the sessions share a result cache, so the test only
+runs in the first session (-r 0 runs it in each of them).
+
+Example:
+    python benchmarks/bench_memory.py -n 100000 1000000 -s 1 4
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import numpy as np
+from bokeh.document import Document
+
+import titantuner
+import titantuner.app
+import titantuner.engine
+import titantuner.source
+
+import bench_tiled
+
+
+def get_peak_rss() -> float:
+    """Returns the peak resident set size of this process [MB]"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+class BufferSource(titantuner.source.Source):
+    """A source with a single dataset, read from a saved buffer"""
+    def __init__(self, filename):
+        self.filename = filename
+
+    @property
+    def keys(self) -> list:
+        return ["synthetic"]
+
+    @property
+    def key_label(self) -> str:
+        return "Dataset"
+
+    def load(self, key):
+        # np.load allocates the buffer and nothing else, so the peak RSS is not raised by temporary arrays
+        return titantuner.dataset.Dataset.from_buffer(key, np.load(self.filename), 0, "ta")
+
+
+def measure(filename, num_sessions, test, result_cache_size, queue):
+    """Puts the peak RSS after loading the dataset, and after opening the sessions, in queue [MB]"""
+    source = titantuner.source.CachedSource(BufferSource(filename), 10**12)
+    results = titantuner.engine.ResultCache(int(result_cache_size * 1024**2)) if result_cache_size > 0 else None
+    apps = list()
+    with contextlib.redirect_stdout(io.StringIO()):
+        source.load("synthetic")
+        loaded = get_peak_rss()
+        for s in range(num_sessions):
+            app = titantuner.app.App(source, Document(), results=results)
+            app.set_ui(test)
+            app.apply_test()
+            apps += [app]
+    queue.put((loaded, get_peak_rss()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the peak memory of the server process')
+    parser.add_argument('-n', type=int, nargs='+', default=[1000000], help="Numbers of stations", dest="sizes")
+    parser.add_argument('-s', type=int, nargs='+', default=[1, 4], help="Numbers of sessions", dest="sessions")
+    parser.add_argument('-t', default="sctdual", help="Test to apply in each session", dest="test")
+    parser.add_argument('-r', type=float, default=256, help="Memory of the result cache shared by the sessions in MB (0 disables it)", dest="result_cache_size")
+    args = parser.parse_args()
+
+    # A new process for each measurement, since the peak RSS of a process can not be reset
+    context = multiprocessing.get_context("spawn")
+    print("%10s %10s %10s %14s %14s %16s" % ("stations", "dtype", "sessions", "dataset [MB]", "peak [MB]", "per session [MB]"))
+    with tempfile.TemporaryDirectory() as tempdir:
+        for num in args.sizes:
+            dataset = bench_tiled.create_dataset(num)
+            for dtype in [np.float64, np.float32]:
+                filename = os.path.join(tempdir, "buffer.npy")
+                np.save(filename, dataset.buffer.astype(dtype))
+                for num_sessions in args.sessions:
+                    queue = context.Queue()
+                    process = context.Process(target=measure, args=(filename, num_sessions, args.test, args.result_cache_size, queue))
+                    process.start()
+                    loaded, peak = queue.get()
+                    process.join()
+                    print("%10d %10s %10d %14.1f %14.1f %16.1f" % (num, np.dtype(dtype).name, num_sessions,
+                          dataset.buffer.astype(dtype).nbytes / 1024**2, peak, (peak - loaded) / num_sessions))
+                    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark of TitanSource.parse_titan_file against the original line-by-line parser, and of loading
+files through the column cache
+
+Example:
+    python benchmarks/bench_parse.py -n 1000 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+import titantuner
+import titantuner.source
+
+
+def parse_titan_file_lines(filename, latrange=None, lonrange=None):
+    """ The original line-by-line parser, used as a reference """
+    lats = list()
+    lons = list()
+    elevs = list()
+    values = list()
+    with open(filename, 'r') as file:
+        header = file.readline().strip().split(';')
+        Ilat = header.index('lat')
+        Ilon = header.index('lon')
+        Ielev = header.index('elev')
+        Ivalue = header.index('value')
+        for line in file:
+            words = line.strip().split(';')
+            lat = float(words[Ilat])
+            if latrange is not None and (lat < latrange[0] or lat > latrange[1]):
+                continue
+            lon = float(words[Ilon])
+            if lonrange is not None and (lon < lonrange[0] or lon > lonrange[1]):
+                continue
+            elev = -999
+            if words[Ielev] != "NA":
+                elev = float(words[Ielev])
+            try:
+                value = float(words[Ivalue])
+                lats += [lat]
+                lons += [lon]
+                elevs += [elev]
+                values += [value]
+            except Exception as e:
+                pass
+    return np.array(lats), np.array(lons), np.array(elevs), np.array(values)
+
+
+def write_titan_file(filename, num, seed=0):
+    """Writes a file with num synthetic stations, in the format produced by titan.R"""
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(58, 71, num)
+    lons = rng.uniform(4, 31, num)
+    elevs = np.char.mod("%.0f", rng.uniform(0, 1500, num))
+    elevs[::100] = "NA"
+    values = rng.normal(10, 5, num)
+    prids = rng.integers(1, 8, num)
+    dqcs = rng.integers(0, 3, num)
+    with open(filename, 'w') as file:
+        file.write("lat;lon;elev;value;prid;dqc\n")
+        for row in zip(lats, lons, elevs, values, prids, dqcs):
+            file.write("%.4f;%.4f;%s;%.1f;%d;%d\n" % row)
+
+
+def timeit(func, *args, repeat=3):
+    """Returns the fastest of repeat calls to func [s]"""
+    timings = list()
+    for r in range(repeat):
+        s_time = time.time()
+        func(*args)
+        timings += [time.time() - s_time]
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the parser for titan files')
+    parser.add_argument('-n', type=int, nargs='+', default=[1000, 10000, 100000], help='Number of stations', dest='sizes')
+    parser.add_argument('-r', type=int, default=3, help='Number of repetitions', dest='repeat')
+    args = parser.parse_args()
+
+    print("%10s %12s %12s %8s %12s" % ("stations", "lines [s]", "bulk [s]", "speedup", "cached [s]"))
+    with tempfile.TemporaryDirectory() as tempdir:
+        cache = titantuner.cache.DiskCache(os.path.join(tempdir, "cache"), 10**10, ".npy")
+        for num in args.sizes:
+            filename = os.path.join(tempdir, "obs_ta_%d.txt" % num)
+            write_titan_file(filename, num)
+            expected = parse_titan_file_lines(filename)
+            actual = titantuner.source.TitanSource.parse_titan_file(filename)
+            for e, a in zip(expected, actual):
+                np.testing.assert_array_equal(e, a)
+
+            time_lines = timeit(parse_titan_file_lines, filename, repeat=args.repeat)
+            time_bulk = timeit(titantuner.source.TitanSource.parse_titan_file, filename, repeat=args.repeat)
+
+            source = titantuner.source.TitanSource([filename], cache)
+            source.load(os.path.basename(filename))
+            time_cached = timeit(source.load, os.path.basename(filename), repeat=args.repeat)
+            print("%10d %12.4f %12.4f %8.1f %12.4f" % (num, time_lines, time_bulk, time_lines / time_bulk, time_cached))
+
+
+if __name__ == "__main__":
+    main()
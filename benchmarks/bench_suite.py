@@ -0,0 +1,277 @@
+"""Benchmark suite for parsing, QC tests and rendering on synthetic station sets, without a browser
+
+Runs each case for each number of stations and stores the fastest time in a JSON file. With --compare,
+the results are compared with those of a previous run (e.g. of the last release), and cases that have
+become slower are reported.
+
+Cases:
+    parse_titan_file   TitanSource.parse_titan_file on a synthetic titan file
+    frost_parse        FrostSource.parse on the recorded frost response, repeated to the number of stations
+    points             Building titanlib.Points
+    engine.<test>      titantuner.engine.run with the default parameters of the app (Points reused)
+    apply.<test>       App.apply_test, the whole path behind the "Apply test" button
+    app_setup          Creating the App for a dataset (initial labels, figure and widgets)
+    add_labels         App.add_labels with all labels shown
+    plot_config        App.plot_config after the first map: recomputing the colors and labels of the stations
+                       and patching the sources of the existing figure
+    render             Serializing the whole document, as sent to a new browser session (also reports its
+                       size). The root is already set, so App.set_root only checks that the layout is unchanged
+    view               App.update_view for the whole dataset, e.g. after zooming out
+    zoom               Zooming in to the central 10 % of the map, and serializing the changes sent to the
+                       browser (also reports their size)
+    autotune_cost      One evaluation of the cost function optimised by the autotune script
+
+Example:
+    python benchmarks/bench_suite.py -n 1000 10000 100000 1000000 -o results.json
+    python benchmarks/bench_suite.py -n 1000 10000 --cases "engine.*" --compare results.json
+"""
+import argparse
+import contextlib
+import datetime
+import fnmatch
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+import titanlib
+import bokeh.protocol
+from bokeh.document import Document
+from bokeh.document.events import DocumentPatchedEvent
+
+import titantuner
+import titantuner.source
+
+import bench_frost
+import bench_parse
+import bench_tiled
+
+tests = ["sct", "sctres", "sctdual", "fgt", "isolation", "buddy", "buddy_event"]
+
+cases = ["parse_titan_file", "frost_parse", "points"] + [f"engine.{test}" for test in tests] + \
+        [f"apply.{test}" for test in tests] + ["app_setup", "add_labels", "plot_config", "render", "view", "zoom", "autotune_cost"]
+
+# The frost response recorded for the tests
+recorded_frost_response = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test", "files", "frost", "air_temperature.json")
+
+
+class SyntheticSource(titantuner.source.Source):
+    """A source with a single dataset, for creating an App without data files"""
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    @property
+    def keys(self) -> list:
+        return [self.dataset.name]
+
+    @property
+    def key_label(self) -> str:
+        return "Dataset"
+
+    def load(self, key):
+        return self.dataset
+
+
+def scale_response(data, num_observations):
+    """Returns the frost response data, with its time series repeated to get at least num_observations"""
+    tseries = data["data"]["tseries"]
+    num = sum(len(t["observations"]) for t in tseries)
+    copies = int(np.ceil(num_observations / max(num, 1)))
+    return {"data": {"tseries": tseries * copies}}
+
+
+def timeit(func, repeat):
+    """Returns the fastest of repeat calls to func [s]"""
+    timings = list()
+    for r in range(repeat):
+        s_time = time.perf_counter()
+        func()
+        timings += [time.perf_counter() - s_time]
+    return min(timings)
+
+
+def create_app(dataset):
+    """Returns an App showing dataset, with the output of the app discarded"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return titantuner.app.App(SyntheticSource(dataset), Document())
+
+
+def quiet(func):
+    """Returns func, with its output discarded"""
+    def wrapper():
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+    return wrapper
+
+
+def get_patch_size(doc, func) -> int:
+    """Calls func, and returns the size of the message sending the changes of doc to the browser [bytes]"""
+    events = list()
+    doc.on_change(events.append)
+    try:
+        func()
+    finally:
+        doc.remove_on_change(events.append)
+    events = [event for event in events if isinstance(event, DocumentPatchedEvent)]
+    message = bokeh.protocol.Protocol().create("PATCH-DOC", events)
+    return len(message.header_json) + len(message.metadata_json) + len(message.content_json) + \
+        sum(len(buffer) for _, buffer in message.buffers)
+
+
+def set_view(app, fraction):
+    """Zooms the map of app to the central fraction of the dataset in each direction (None zooms out)"""
+    for r, (start, end) in [(app.p.x_range, app.get_index().xrange), (app.p.y_range, app.get_index().yrange)]:
+        if fraction is None:
+            r.update(start=None, end=None)
+        else:
+            center = (start + end) / 2
+            r.update(start=center - (end - start) * fraction / 2, end=center + (end - start) * fraction / 2)
+    app.range_settled()
+
+
+def get_autotune_cost(dataset):
+    """Returns the cost function of the autotune script, on dataset with 10 % seeded errors"""
+    random.seed(0)
+    points = titanlib.Points(dataset.lats, dataset.lons, dataset.elevs)
+    values = np.array(dataset.values)
+    errors = titantuner.autotune.gen_errors(values, len(values) // 10, titantuner.autotune.gen_error_temperature)
+    seeded_values = titantuner.autotune.seed_errors(values, errors, titantuner.autotune.temperature_errorfunc)
+    return titantuner.autotune.gen_optimiseable(points, errors, seeded_values)
+
+
+def run_case(case, num, repeat, tempdir):
+    """Returns the time of a case for num stations [s], and a dict with other results (stages, bytes), if any"""
+    dataset = bench_tiled.create_dataset(num)
+    details = dict()
+    if case == "parse_titan_file":
+        filename = os.path.join(tempdir, "obs_ta_%d.txt" % num)
+        if not os.path.exists(filename):
+            bench_parse.write_titan_file(filename, num)
+        seconds = timeit(lambda: titantuner.source.TitanSource.parse_titan_file(filename), repeat)
+    elif case == "frost_parse":
+        with open(recorded_frost_response) as file:
+            data = scale_response(json.load(file), num)
+        seconds = timeit(lambda: titantuner.source.FrostSource.parse(data), repeat)
+    elif case == "points":
+        seconds = timeit(lambda: titanlib.Points(dataset.lats, dataset.lons, dataset.elevs), repeat)
+    elif case.startswith("engine."):
+        test = case.split(".")[1]
+        app = create_app(dataset)
+        app.set_ui(test)
+        params = app.get_params()
+        titantuner.engine.run(test, dataset, params)
+        seconds = timeit(lambda: titantuner.engine.run(test, dataset, params), repeat)
+    elif case.startswith("apply."):
+        app = create_app(dataset)
+        app.set_ui(case.split(".")[1])
+        titantuner.metrics.registry = titantuner.metrics.Registry()
+        seconds = timeit(quiet(app.apply_test), repeat)
+        # The stages of the fastest run are not kept, so report the median of the runs instead
+        details["stages"] = {name[len("apply."):]: histogram.percentile(50) for name, histogram in titantuner.metrics.registry.histograms.items()
+                             if name.startswith("apply.")}
+    elif case == "app_setup":
+        seconds = timeit(lambda: create_app(dataset), repeat)
+    elif case == "add_labels":
+        app = create_app(dataset)
+        app.set_ui("sct")
+        app.ui["labels"].active = list(range(len(app.ui["labels"].labels)))
+        Is = np.arange(num)
+        sct = np.zeros(num)
+        seconds = timeit(lambda: app.add_labels(Is, Is, dataset.values, sct), repeat)
+    elif case == "plot_config":
+        app = create_app(dataset)
+        seconds = timeit(lambda: app.plot_config(first_map=False), repeat)
+    elif case == "render":
+        app = create_app(dataset)
+        seconds = timeit(lambda: (app.set_root(app.p), app.doc.to_json_string()), repeat)
+        details["bytes"] = len(app.doc.to_json_string())
+    elif case == "view":
+        app = create_app(dataset)
+        seconds = timeit(app.update_view, repeat)
+    elif case == "zoom":
+        app = create_app(dataset)
+        timings = list()
+        for r in range(repeat):
+            set_view(app, None)
+            s_time = time.perf_counter()
+            details["bytes"] = get_patch_size(app.doc, lambda: set_view(app, 0.1))
+            timings += [time.perf_counter() - s_time]
+        seconds = min(timings)
+    elif case == "autotune_cost":
+        cost = get_autotune_cost(dataset)
+        seconds = timeit(quiet(lambda: cost((10000, 3, 1.0))), repeat)
+    else:
+        raise ValueError(f"Unknown case {case}")
+    return seconds, details
+
+
+def get_environment():
+    return {"titantuner": titantuner.VERSION,
+            "titanlib": titanlib.version(),
+            "numpy": np.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds")}
+
+
+def compare(results, baseline, threshold):
+    """Prints the cases that are more than threshold times slower than in baseline, and returns their number"""
+    previous = {(r["case"], r["size"]): r["seconds"] for r in baseline["results"]}
+    print(f"\nCompared with {baseline['environment']['titantuner']} ({baseline['environment']['date']}):")
+    print("%-22s %10s %12s %12s %8s" % ("case", "stations", "before [s]", "now [s]", "ratio"))
+    num_slower = 0
+    for r in results:
+        before = previous.get((r["case"], r["size"]))
+        if before is None:
+            continue
+        ratio = r["seconds"] / before
+        slower = ratio > threshold
+        num_slower += slower
+        print("%-22s %10d %12.4f %12.4f %8.2f%s" % (r["case"], r["size"], before, r["seconds"], ratio, "  SLOWER" if slower else ""))
+    return num_slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the benchmark suite')
+    parser.add_argument('-n', type=int, nargs='+', default=[1000, 10000, 100000], help="Numbers of stations", dest="sizes")
+    parser.add_argument('-r', type=int, default=3, help="Number of repetitions of each case", dest="repeat")
+    parser.add_argument('-o', help="Write the results to this JSON file", dest="output")
+    parser.add_argument('--cases', nargs='+', default=["*"], help="Only run cases matching these patterns, e.g. 'engine.*'")
+    parser.add_argument('--compare', help="Compare with the results in this JSON file")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Report cases that are this many times slower than in --compare")
+    args = parser.parse_args()
+
+    selected = [case for case in cases if any(fnmatch.fnmatch(case, pattern) for pattern in args.cases)]
+    if len(selected) == 0:
+        parser.error(f"No cases match {args.cases}. Available cases: {', '.join(cases)}")
+
+    results = list()
+    print("%-22s %10s %12s %12s" % ("case", "stations", "time [s]", "size [kB]"))
+    with tempfile.TemporaryDirectory() as tempdir:
+        for case in selected:
+            for num in args.sizes:
+                seconds, details = run_case(case, num, args.repeat, tempdir)
+                result = {"case": case, "size": num, "seconds": seconds}
+                result.update(details)
+                results += [result]
+                size = "%12.1f" % (details["bytes"] / 1000) if "bytes" in details else ""
+                print("%-22s %10d %12.4f %s" % (case, num, seconds, size))
+                sys.stdout.flush()
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump({"environment": get_environment(), "repeat": args.repeat, "results": results}, file, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
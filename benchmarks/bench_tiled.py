@@ -0,0 +1,71 @@
+"""Benchmark of running SCT-type tests in tiles on several processes, against a run on the whole dataset
+
+Reports the speedup and how many observations get a different flag when the test runs in tiles.
+
+Example:
+    python benchmarks/bench_tiled.py -n 20000 100000 --tiles 4 --workers 4
+"""
+import argparse
+import time
+import numpy as np
+
+import titantuner
+
+
+# The default parameters of the tests in the app
+PARAMS = {
+    "sct": {"nmin": 5, "nmax": 20, "inner_radius": 4000, "outer_radius": 10000, "niterations": 1,
+            "nminprof": 100, "t2pos": 4, "t2neg": 4, "eps2": 0.5, "dzmin": 30, "dhmin": 10000, "dz": 200},
+    "sctdual": {"nmin": 5, "nmax": 100, "inner_radius": 4000, "outer_radius": 10000, "niterations": 1,
+                "t_event": 0.1, "t_condition": 1, "t_test": 0.1, "dhmin": 5000, "dhmax": 50000, "kth": 3, "dz": 10000},
+}
+
+
+def create_dataset(num_stations, seed=0):
+    """Returns a synthetic temperature dataset over southern Norway, with 1 % gross errors"""
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(58, 64, num_stations)
+    lons = rng.uniform(5, 12, num_stations)
+    elevs = rng.uniform(0, 1500, num_stations)
+    values = 15 - 0.0065 * elevs + rng.normal(0, 1, num_stations)
+    Ierror = rng.choice(num_stations, num_stations // 100, replace=False)
+    values[Ierror] += rng.choice([-10, 10], len(Ierror))
+    return titantuner.dataset.Dataset("synthetic", lats, lons, elevs, values, 0, "ta")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks tiled execution of SCT-type tests')
+    parser.add_argument('-n', type=int, nargs='+', default=[20000], help="Number of stations", dest="num")
+    parser.add_argument('-t', default="sct", choices=list(PARAMS.keys()), help="Test to run", dest="test")
+    parser.add_argument('--tiles', type=int, default=4, help="Number of tiles in each direction", dest="num_tiles")
+    parser.add_argument('--workers', type=int, default=4, help="Number of worker processes")
+    args = parser.parse_args()
+
+    params = PARAMS[args.test]
+    executor = titantuner.engine.create_executor(args.workers)
+    # Start the workers, so that their startup time is not measured
+    list(executor.map(abs, range(args.workers)))
+
+    print("%10s %12s %12s %8s %14s %12s" % ("stations", "whole [s]", "tiled [s]", "speedup", "disagreements", "max sct diff"))
+    for num in args.num:
+        dataset = create_dataset(num)
+        s_time = time.time()
+        expected = titantuner.engine.run(args.test, dataset, params)
+        time_whole = time.time() - s_time
+
+        s_time = time.time()
+        actual = titantuner.engine.run_tiled(args.test, dataset, params, executor, args.num_tiles)
+        time_tiled = time.time() - s_time
+
+        disagreements = np.sum(expected.flags != actual.flags)
+        if expected.sct is not None:
+            max_sct_diff = "%12.4f" % np.nanmax(np.abs(expected.sct - actual.sct))
+        else:
+            max_sct_diff = "%12s" % "-"
+        print("%10d %12.3f %12.3f %8.1f %7d (%.2f%%) %s" % (num, time_whole, time_tiled, time_whole / time_tiled,
+              disagreements, 100.0 * disagreements / num, max_sct_diff))
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
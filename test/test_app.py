@@ -0,0 +1,52 @@
+from __future__ import print_function
+import unittest
+import numpy as np
+from bokeh.document import Document
+
+import titantuner
+import titantuner.app
+
+
+class Test(unittest.TestCase):
+    def test_format_values(self):
+        values = [12.34, -0.3, 2.5, 3.5, np.nan, 12.34, 0.45, 0.15, -0.0, 0.0]
+        for decimals in [0, 1]:
+            # The same texts as formatting each value
+            expected = [f'{value:.{decimals}f}' for value in values]
+            self.assertEqual(list(titantuner.app.format_values(values, decimals)), expected)
+        self.assertEqual(list(titantuner.app.format_values(values, 1)[-4:]), ["0.5", "0.1", "-0.0", "0.0"])
+        self.assertEqual(len(titantuner.app.format_values([], 1)), 0)
+
+    def test_displayed_values(self):
+        values = [0.34, 1.6, 0]
+        self.assertEqual(list(titantuner.app.displayed_values("rr", values)), ["0.3", "2", "0"])
+        self.assertEqual(list(titantuner.app.displayed_values("ta", values)), ["0", "2", "0"])
+
+    def test_displayed_elevations(self):
+        elevs = [-0.5, -1.5, 0.4, 100.9, -999]
+        self.assertEqual(list(titantuner.app.displayed_elevations(elevs)), ["%d" % elev for elev in elevs])
+        self.assertEqual(list(titantuner.app.displayed_elevations(elevs)), ["0", "-1", "0", "100", "-999"])
+
+    def test_join_labels(self):
+        parts = [np.array(["1", "2"], dtype=object), np.array(["a", "b"], dtype=object)]
+        self.assertEqual(list(titantuner.app.join_labels(parts, 2)), ["1\na", "2\nb"])
+        self.assertEqual(list(titantuner.app.join_labels([], 2)), ["", ""])
+
+    def test_flag_columns(self):
+        source = titantuner.source.TitanSource([titantuner.source.TitanSource.get_default_data_dir()])
+        app = titantuner.app.App(source, Document())
+        # The flags of every test applied to the dataset are kept, also when the tests are not combined
+        for test in ["sct", "buddy"]:
+            app.set_ui(test)
+            app.apply_test()
+        self.assertEqual(app.combine_test, "single")
+        self.assertEqual(app.flag_columns.names, ["sct", "buddy"])
+
+        # They are discarded when the selection of observations changes
+        app.ui["latrange"].value = (60, 90)
+        app.apply_test()
+        self.assertEqual(app.flag_columns.names, ["buddy"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+from __future__ import print_function
+import unittest
+import os
+import tempfile
+import time
+
+import titantuner
+
+
+class Test(unittest.TestCase):
+    def test_lookup_and_store(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            cache = titantuner.cache.DiskCache(tempdir, 1000)
+            self.assertIsNone(cache.lookup("key"))
+            filename = cache.store("key", lambda file: file.write(b"abc"))
+            self.assertEqual(cache.lookup("key"), filename)
+            with open(filename, "rb") as file:
+                self.assertEqual(file.read(), b"abc")
+            self.assertEqual(cache.size, 3)
+
+    def test_evict_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            cache = titantuner.cache.DiskCache(tempdir, 250)
+            for key in ["a", "b"]:
+                cache.store(key, lambda file: file.write(b"x" * 100))
+                time.sleep(0.01)
+            # Reading "a" makes "b" the least recently used entry
+            cache.lookup("a")
+            time.sleep(0.01)
+            cache.store("c", lambda file: file.write(b"x" * 100))
+            self.assertIsNotNone(cache.lookup("a"))
+            self.assertIsNone(cache.lookup("b"))
+            self.assertIsNotNone(cache.lookup("c"))
+            self.assertEqual(cache.size, 200)
+
+    def test_memory_cache(self):
+        cache = titantuner.cache.MemoryCache(10, len)
+        cache.put("a", "x" * 4)
+        cache.put("b", "x" * 4)
+        self.assertEqual(cache.get("a"), "xxxx")
+        # "b" is the least recently used value
+        cache.put("c", "x" * 4)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "xxxx")
+        self.assertEqual(cache.size, 8)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        # Values larger than the cache are not stored
+        cache.put("d", "x" * 11)
+        self.assertNotIn("d", cache)
+        self.assertEqual(len(cache), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+from __future__ import print_function
+import unittest
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import numpy as np
+
+import titantuner
+
+
+class Test(unittest.TestCase):
+    def test_buffer(self):
+        dataset = titantuner.dataset.Dataset("test", [60, 61, 62], [10, 11, 12], [0, 100, 200], [1, 2, 3], 0, "ta")
+        self.assertEqual(dataset.buffer.shape, (4, 3))
+        self.assertEqual(len(dataset), 3)
+        np.testing.assert_array_equal(dataset.elevs, [0, 100, 200])
+        self.assertTrue(np.shares_memory(dataset.values, dataset.buffer))
+        self.assertEqual(dataset.nbytes, 4 * 3 * 8)
+
+        dataset = titantuner.dataset.Dataset("Invalid", [], [], [], [], 0, "")
+        self.assertEqual(len(dataset), 0)
+
+        with self.assertRaises(ValueError):
+            titantuner.dataset.Dataset.from_buffer("test", np.zeros([3, 2]), 0, "ta")
+
+    def test_subset(self):
+        dataset = titantuner.dataset.Dataset("test", [60, 61, 62], [10, 11, 12], [0, 100, 200], [1, 2, 3], 0, "ta", times=[5, 6, 7])
+        subset = dataset.subset(slice(1, 3))
+        self.assertTrue(np.shares_memory(subset.buffer, dataset.buffer))
+        np.testing.assert_array_equal(subset.lats, [61, 62])
+        np.testing.assert_array_equal(subset.index, [1, 2])
+
+        subset = dataset.subset([2, 0])
+        np.testing.assert_array_equal(subset.values, [3, 1])
+        np.testing.assert_array_equal(subset.times, [7, 5])
+
+        subset = dataset.subset(np.array([True, False, True]))
+        np.testing.assert_array_equal(subset.lons, [10, 12])
+        np.testing.assert_array_equal(subset.index, [0, 2])
+
+    def test_derived(self):
+        dataset = titantuner.dataset.Dataset("test", [0, 60], [0, 10], [0, 100], [1, 2], 0, "ta")
+        np.testing.assert_array_almost_equal(dataset.x, [0, 1113194.9], 1)
+        np.testing.assert_array_almost_equal(dataset.y, [0, 8399737.9], 1)
+        self.assertIs(dataset.x, dataset.x)
+        self.assertEqual(dataset.nbytes, dataset.buffer.nbytes + dataset.x.nbytes + dataset.y.nbytes)
+        # The strings of object arrays are counted once for each distinct object
+        nbytes = dataset.nbytes
+        texts = dataset.derived("texts", lambda d: np.array(["label"] * 2, dtype=object))
+        self.assertEqual(dataset.nbytes, nbytes + texts.nbytes + sys.getsizeof("label"))
+        self.assertFalse(dataset.x.flags.writeable)
+        self.assertEqual(dataset.bounds, ((0, 60), (0, 10)))
+        self.assertIsNone(titantuner.dataset.Dataset("Invalid", [], [], [], [], 0, "").bounds)
+
+        calls = list()
+        compute = lambda d: calls.append(1) or np.sum(d.values)
+        self.assertEqual(dataset.derived("sum", compute), 3)
+        self.assertEqual(dataset.derived("sum", compute), 3)
+        self.assertEqual(len(calls), 1)
+
+        # Derived values are computed again when the observations change
+        fingerprint = dataset.fingerprint
+        dataset.buffer = dataset.buffer * 2
+        self.assertEqual(dataset.derived("sum", compute), 6)
+        self.assertNotEqual(dataset.fingerprint, fingerprint)
+        dataset.values[0] = 0
+        dataset.clear_derived()
+        self.assertEqual(dataset.derived("sum", compute), 4)
+
+    def test_pickle(self):
+        dataset = titantuner.dataset.Dataset("test", [60, 61], [10, 11], [0, 100], [1, 2], 0, "ta")
+        dataset.x
+        fingerprint = dataset.fingerprint
+        copy = pickle.loads(pickle.dumps(dataset))
+        self.assertEqual(copy._derived, {"fingerprint": fingerprint})
+        np.testing.assert_array_equal(copy.buffer, dataset.buffer)
+        np.testing.assert_array_equal(copy.x, dataset.x)
+
+    def test_astype(self):
+        dataset = titantuner.dataset.Dataset("test", [60.1], [10.2], [0], [1.5], 0, "ta")
+        self.assertIs(dataset.astype(np.float64), dataset)
+        single = dataset.astype(np.float32)
+        self.assertEqual(single.values.dtype, np.float32)
+        self.assertEqual(single.nbytes, dataset.nbytes // 2)
+
+    def test_load_memory_mapped(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        with tempfile.TemporaryDirectory() as tempdir:
+            shutil.copy(f"{dir}files/titan/obs_ta_na.txt", tempdir)
+            cache = titantuner.cache.DiskCache(f"{tempdir}/cache", 10**6, ".npy")
+            source = titantuner.source.TitanSource([tempdir], cache)
+            source.load("obs_ta_na.txt")
+            # The second load uses the (read-only) memory map of the cache file without copying it
+            dataset = source.load("obs_ta_na.txt")
+            self.assertFalse(dataset.buffer.flags.owndata)
+            self.assertFalse(dataset.buffer.flags.writeable)
+            np.testing.assert_array_equal(dataset.lats, [60.1, 61.2, 63.4])
+            np.testing.assert_array_equal(dataset.elevs, [100, -999, 400])
+
+        source = titantuner.source.TitanSource([f"{dir}files/titan/*.txt"])
+        source = titantuner.source.CachedSource(source, 10**6, dtype=np.float32)
+        self.assertEqual(source.load("obs_ta_na.txt").values.dtype, np.float32)
+
+
+if __name__ == "__main__":
+    unittest.main()
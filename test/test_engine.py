@@ -0,0 +1,170 @@
+from __future__ import print_function
+import unittest
+import concurrent.futures
+import tempfile
+import numpy as np
+import titanlib
+
+import titantuner
+
+
+def get_dataset():
+    # A 5x5 grid of stations 1 km apart, with one outlier in the middle
+    lats, lons = np.meshgrid(60 + np.arange(5) * 0.009, 10 + np.arange(5) * 0.018)
+    values = np.ones(25)
+    values[12] = 20
+    return titantuner.dataset.Dataset("test", lats.flatten(), lons.flatten(), np.zeros(25), values, 0, "ta")
+
+
+class Test(unittest.TestCase):
+    def test_buddy(self):
+        params = {"distance": 5000, "num": 5, "threshold": 2, "elev_range": 300, "elev_gradient": 0,
+                  "min_std": 1, "num_iterations": 1}
+        result = titantuner.engine.run("buddy", get_dataset(), params)
+        self.assertEqual(list(np.where(result.flags == 1)[0]), [12])
+        self.assertIsNone(result.sct)
+        self.assertGreaterEqual(result.time, 0)
+
+        # Only test a subset
+        result = titantuner.engine.run("buddy", get_dataset(), params, index=[0, 1, 2])
+        np.testing.assert_array_equal(result.flags, [0, 0, 0])
+
+    def test_isolation(self):
+        dataset = get_dataset()
+        result = titantuner.engine.run("isolation", dataset, {"num": 5, "radius": 0.5})
+        np.testing.assert_array_equal(result.flags, np.ones(25))
+        result = titantuner.engine.run("isolation", dataset, {"num": 5, "radius": 5})
+        np.testing.assert_array_equal(result.flags, np.zeros(25))
+
+    def test_executor(self):
+        executor = titantuner.engine.create_executor(1)
+        try:
+            future = executor.submit(titantuner.engine.run, "isolation", get_dataset(), {"num": 5, "radius": 0.5})
+            np.testing.assert_array_equal(future.result().flags, np.ones(25))
+        finally:
+            executor.shutdown()
+
+    def test_result_cache(self):
+        dataset = get_dataset()
+        params = {"num": 5, "radius": 0.5}
+        key = titantuner.engine.ResultCache.get_key("isolation", dataset, params, [0, 1])
+        self.assertEqual(key, titantuner.engine.ResultCache.get_key("isolation", get_dataset(), dict(params), [0, 1]))
+        self.assertNotEqual(key, titantuner.engine.ResultCache.get_key("isolation", dataset, {"num": 5, "radius": 1}, [0, 1]))
+        self.assertNotEqual(key, titantuner.engine.ResultCache.get_key("isolation", dataset, params, [0, 2]))
+        # Results of another version of titantuner or titanlib are not reused
+        self.assertIn(titantuner.engine.CACHE_VERSION, key)
+        self.assertIn(titanlib.__version__, key)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            cache = titantuner.engine.ResultCache(10**6, titantuner.cache.DiskCache(tempdir, 10**6, ".npz"))
+            self.assertIsNone(cache.get(key))
+            result = titantuner.engine.run("isolation", dataset, params, [0, 1])
+            cache.put(key, result)
+            self.assertIs(cache.get(key), result)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            # Results on disk survive a restart
+            cache = titantuner.engine.ResultCache(10**6, titantuner.cache.DiskCache(tempdir, 10**6, ".npz"))
+            cached = cache.get(key)
+            np.testing.assert_array_equal(cached.flags, result.flags)
+            self.assertIsNone(cached.sct)
+            self.assertEqual(cached.time, result.time)
+            self.assertFalse(cached.flags.flags.writeable)
+            self.assertFalse(cached.values.flags.writeable)
+
+    def test_points_reused(self):
+        dataset = get_dataset()
+        points = titantuner.engine.get_points(dataset.subset([0, 1, 2]))
+        self.assertIs(titantuner.engine.get_points(dataset.subset([0, 1, 2])), points)
+        self.assertIsNot(titantuner.engine.get_points(dataset.subset([0, 1, 3])), points)
+
+    def test_tiles(self):
+        dataset = get_dataset()
+        tiles = titantuner.engine.get_tiles(dataset, 2, 1500)
+        self.assertEqual(len(tiles), 4)
+        # Each observation is in the interior of exactly one tile
+        interior = np.concatenate([Itile[interior] for Itile, interior in tiles])
+        np.testing.assert_array_equal(np.sort(interior), np.arange(25))
+        # The border includes the neighbouring stations, which are 1 km apart
+        for Itile, interior in tiles:
+            self.assertGreater(len(Itile), np.sum(interior))
+
+    def test_tiles_high_latitude(self):
+        # Two stations 9.5 km apart at 71N, 0.5 km west and 9 km east of the edge between the tiles (18E),
+        # in a dataset covering Norway. At 71N, 1 degree of longitude is 36.2 km.
+        lats = [58, 58, 71, 71, 71, 71]
+        lons = [5, 31, 5, 31, 18 - 0.5 / 36.2, 18 + 9 / 36.2]
+        dataset = titantuner.dataset.Dataset("test", lats, lons, [0] * 6, [0] * 6, 0, "ta")
+        tiles = titantuner.engine.get_tiles(dataset, 2, 10000)
+        for Itile, interior in tiles:
+            if 4 in Itile[interior]:
+                self.assertIn(5, Itile)
+            if 5 in Itile[interior]:
+                self.assertIn(4, Itile)
+
+    def test_run_tiled(self):
+        params = {"nmin": 3, "nmax": 20, "inner_radius": 2000, "outer_radius": 3000, "niterations": 1,
+                  "nminprof": 100, "t2pos": 4, "t2neg": 4, "eps2": 0.5, "dzmin": 30, "dhmin": 10000, "dz": 200}
+        dataset = get_dataset()
+        expected = titantuner.engine.run("sct", dataset, params)
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            result = titantuner.engine.run_tiled("sct", dataset, params, executor, 2)
+            with self.assertRaises(ValueError):
+                titantuner.engine.run_tiled("isolation", dataset, {"num": 5, "radius": 1}, executor, 2)
+            runs = titantuner.engine.submit_sweep(executor, "sct", dataset, params, "t2pos", [4, 100], 2)
+            sweep = [future.result() for _, future in runs]
+        np.testing.assert_array_equal(result.flags, expected.flags)
+        self.assertEqual(result.flags[12], 1)
+        self.assertEqual(len(result.sct), 25)
+        np.testing.assert_array_equal(sweep[0].flags, result.flags)
+
+    def test_sweep_values(self):
+        self.assertEqual(titantuner.engine.get_sweep_values(5, 25, 10), [5, 15, 25])
+        self.assertEqual(titantuner.engine.get_sweep_values(0.1, 0.35, 0.1), [0.1, 0.2, 0.3])
+        with self.assertRaises(ValueError):
+            titantuner.engine.get_sweep_values(1, 0, 1)
+        with self.assertRaises(ValueError):
+            titantuner.engine.get_sweep_values(0, 100, 1, max_values=50)
+
+    def test_sweep(self):
+        executor = titantuner.engine.create_executor(2)
+        try:
+            runs = titantuner.engine.submit_sweep(executor, "isolation", get_dataset(), {"num": 5, "radius": 1},
+                                                  "radius", [0.5, 5])
+            self.assertEqual([params for params, _ in runs], [{"num": 5, "radius": 0.5}, {"num": 5, "radius": 5}])
+            summaries = [titantuner.engine.summarize(future.result()) for _, future in runs]
+        finally:
+            executor.shutdown()
+        self.assertEqual(summaries[0][0], 100)
+        self.assertTrue(np.isnan(summaries[0][1]))
+        self.assertEqual(summaries[1][0], 0)
+        self.assertAlmostEqual(summaries[1][1], 44 / 25)
+
+    def test_unknown_test(self):
+        with self.assertRaises(ValueError):
+            titantuner.engine.run("unknown", get_dataset(), dict())
+
+    def test_register(self):
+        @titantuner.engine.register("test_all_flagged")
+        def all_flagged(points, values, params):
+            return titantuner.engine.Result(np.full(len(values), params["flag"]), values)
+        try:
+            result = titantuner.engine.run("test_all_flagged", get_dataset(), {"flag": -999})
+            # Flags other than 0 and 1 count as not flagged
+            np.testing.assert_array_equal(result.flags, np.zeros(25))
+        finally:
+            titantuner.engine.tests.pop("test_all_flagged")
+
+    def test_transform(self):
+        values = np.array([0, 1, np.e])
+        np.testing.assert_array_equal(titantuner.engine.transform(values, {"BoxCoxPower": -1}), values)
+        np.testing.assert_allclose(titantuner.engine.transform(values, {"BoxCoxPower": 0, "BoxCoxScaling": 0}),
+                                   [np.log(0.0001), 0, 1])
+
+        values_min, values_max = titantuner.engine.get_value_range(np.array([1., 5.]), {"a_delta": 2, "a_fact": 1}, "a_delta", "a_fact")
+        np.testing.assert_array_equal(values_min, [-1, 3])
+        np.testing.assert_array_equal(values_max, [3, 7])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+from __future__ import print_function
+import unittest
+import numpy as np
+
+import titantuner
+
+
+class Test(unittest.TestCase):
+    def test_evaluate(self):
+        columns = {"sct": np.array([1, 1, 0, 0], bool), "buddy": np.array([1, 0, 1, 0], bool),
+                   "isolation": np.array([0, 1, 0, 0], bool)}
+        evaluate = titantuner.flags.evaluate
+        np.testing.assert_array_equal(evaluate("sct", columns), [1, 1, 0, 0])
+        np.testing.assert_array_equal(evaluate("sct | buddy", columns), [1, 1, 1, 0])
+        np.testing.assert_array_equal(evaluate("sct & buddy", columns), [1, 0, 0, 0])
+        np.testing.assert_array_equal(evaluate("~sct", columns), [0, 0, 1, 1])
+        np.testing.assert_array_equal(evaluate("(sct | buddy) & ~isolation", columns), [1, 0, 1, 0])
+        # & binds tighter than |
+        np.testing.assert_array_equal(evaluate("isolation | sct & buddy", columns), [1, 1, 0, 0])
+        np.testing.assert_array_equal(evaluate("~~(sct)", columns), [1, 1, 0, 0])
+
+        # The result does not share memory with the columns
+        evaluate("sct", columns)[:] = False
+        np.testing.assert_array_equal(columns["sct"], [1, 1, 0, 0])
+
+    def test_evaluate_invalid(self):
+        columns = {"sct": np.array([1, 0], bool)}
+        for expression in ["", "sct &", "(sct", "sct)", "sct sct", "unknown", "sct + sct", "__import__('os')", "sct or sct"]:
+            with self.assertRaises(ValueError, msg=expression):
+                titantuner.flags.evaluate(expression, columns)
+
+    def test_table(self):
+        table = titantuner.flags.FlagTable(4)
+        self.assertEqual(table.add("sct", [1, 0, 0, 1]), "sct")
+        # Only observations 1 and 2 were tested
+        self.assertEqual(table.add("sct", [1, 1], [1, 2]), "sct_2")
+        self.assertEqual(table.names, ["sct", "sct_2"])
+        np.testing.assert_array_equal(table.columns["sct_2"], [0, 1, 1, 0])
+        np.testing.assert_array_equal(table.evaluate("sct & ~sct_2"), [1, 0, 0, 1])
+
+        copy = table.copy()
+        copy.add("buddy", [0, 0, 0, 0])
+        self.assertEqual(len(table), 2)
+        self.assertEqual(len(copy), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
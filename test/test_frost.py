@@ -0,0 +1,101 @@
+from __future__ import print_function
+import unittest
+import json
+import os
+import tempfile
+import time
+import numpy as np
+
+import titantuner
+import titantuner.source.standin
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        self.standin = titantuner.source.standin.FrostStandIn(f"{dir}files/frost").start()
+        # 2023-09-24T12Z
+        self.unixtime = titantuner.date_to_unixtime(20230924, 12)
+
+    def tearDown(self):
+        self.standin.stop()
+
+    def test_load(self):
+        source = titantuner.source.FrostSource("id", self.standin.url)
+        dataset = source.load("air_temperature", self.unixtime)
+        np.testing.assert_array_almost_equal(dataset.values, [14.6, 15.1, 12.3])
+        np.testing.assert_array_almost_equal(dataset.lats, [59.9423, 59.9423, 60.383])
+        self.assertEqual(dataset.unixtime, self.unixtime)
+
+    def test_parse(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        with open(f"{dir}files/frost/air_temperature.json") as file:
+            data = json.load(file)
+        values, lats, lons, elevs, units, times = titantuner.source.FrostSource.parse(data)
+        np.testing.assert_array_almost_equal(values, [14.6, 15.1, 12.3])
+        np.testing.assert_array_almost_equal(lons, [10.72, 10.72, 5.3327])
+        np.testing.assert_array_equal(elevs, [0, 0, 0])
+        np.testing.assert_array_equal(times, [self.unixtime, self.unixtime + 3600, self.unixtime])
+        self.assertEqual(units, "degC")
+
+        values, lats, lons, elevs, units, times = titantuner.source.FrostSource.parse({"data": {"tseries": []}})
+        self.assertEqual(len(values), 0)
+        self.assertIsNone(units)
+
+    def test_load_batch(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        with titantuner.source.standin.FrostStandIn(f"{dir}files/frost", latency=0.2) as standin:
+            source = titantuner.source.FrostSource("id", standin.url)
+            unixtimes = [self.unixtime + h * 3600 for h in range(6)]
+            s_time = time.time()
+            datasets = source.load_batch(["air_temperature"], unixtimes, max_concurrency=6)
+            # The requests are sent at the same time, rather than one after the other
+            self.assertLess(time.time() - s_time, 1.0)
+            self.assertEqual(standin.num_requests, 6)
+        dataset = datasets["air_temperature"]
+        self.assertEqual(len(dataset.values), 6 * 3)
+        self.assertEqual(dataset.unixtime, self.unixtime)
+        self.assertEqual(len(dataset.times), len(dataset.values))
+        self.assertEqual(source.load_batch(["air_temperature"], []), dict())
+
+    def test_load_batch_retry(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        with titantuner.source.standin.FrostStandIn(f"{dir}files/frost", failures=2) as standin:
+            source = titantuner.source.FrostSource("id", standin.url)
+            datasets = source.load_batch(["air_temperature"], [self.unixtime], retries=2, backoff=0.01)
+            self.assertEqual(len(datasets["air_temperature"].values), 3)
+            self.assertEqual(standin.num_requests, 3)
+
+        # Missing recordings (404) are not retried
+        with self.assertRaises(Exception):
+            source = titantuner.source.FrostSource("id", self.standin.url)
+            source.load_batch(["max(wind_speed PT1H)"], [self.unixtime], backoff=0.01)
+        self.assertEqual(self.standin.num_requests, 1)
+
+    def test_missing_recording(self):
+        source = titantuner.source.FrostSource("id", self.standin.url)
+        with self.assertRaises(Exception):
+            source.load("max(wind_speed PT1H)", self.unixtime)
+
+    def test_response_cache(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            cache = titantuner.cache.DiskCache(tempdir, 10**6, ".json")
+            source = titantuner.source.FrostSource("id", self.standin.url, cache)
+            for i in range(3):
+                dataset = source.load("air_temperature", self.unixtime)
+                self.assertEqual(len(dataset.values), 3)
+            self.assertEqual(self.standin.num_requests, 1)
+
+            # Expired responses are fetched again
+            source.ttl = 0
+            source.load("air_temperature", self.unixtime)
+            self.assertEqual(self.standin.num_requests, 2)
+
+            # Other time windows are not served from the cache
+            source.ttl = 3600
+            source.load("air_temperature", self.unixtime + 3600)
+            self.assertEqual(self.standin.num_requests, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
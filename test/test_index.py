@@ -0,0 +1,56 @@
+from __future__ import print_function
+import unittest
+import os
+import tempfile
+import time
+
+import titantuner
+
+
+class Test(unittest.TestCase):
+    def touch(self, filename):
+        with open(filename, "w") as file:
+            file.write("lat;lon;elev;value\n")
+
+    def test_refresh_directory(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.touch(f"{tempdir}/b.txt")
+            os.mkdir(f"{tempdir}/subdir")
+            index = titantuner.source.FileIndex([tempdir])
+            self.assertEqual(index.names, {"b.txt": f"{tempdir}/b.txt"})
+            self.assertFalse(index.refresh())
+
+            version = index.version
+            self.touch(f"{tempdir}/a.txt")
+            os.remove(f"{tempdir}/b.txt")
+            # Make sure the modification time of the directory changes
+            os.utime(tempdir, ns=(0, time.time_ns() + 10**9))
+            self.assertTrue(index.refresh())
+            self.assertEqual(index.names, {"a.txt": f"{tempdir}/a.txt"})
+            self.assertEqual(index.version, version + 1)
+
+    def test_refresh_pattern(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.touch(f"{tempdir}/a.txt")
+            self.touch(f"{tempdir}/b.csv")
+            index = titantuner.source.FileIndex([f"{tempdir}/*.txt"])
+            self.assertEqual(list(index.names.keys()), ["a.txt"])
+            self.touch(f"{tempdir}/c.txt")
+            os.utime(tempdir, ns=(0, time.time_ns() + 10**9))
+            self.assertTrue(index.refresh())
+            self.assertEqual(list(index.names.keys()), ["a.txt", "c.txt"])
+
+    def test_source_keys(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.touch(f"{tempdir}/obs_ta_1.txt")
+            source = titantuner.source.TitanSource([tempdir])
+            self.assertEqual(source.keys, ["obs_ta_1.txt"])
+            self.touch(f"{tempdir}/obs_ta_0.txt")
+            os.utime(tempdir, ns=(0, time.time_ns() + 10**9))
+            source.index.refresh()
+            self.assertEqual(source.keys, ["obs_ta_0.txt", "obs_ta_1.txt"])
+            self.assertEqual(source.keys_version, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+from __future__ import print_function
+import unittest
+import numpy as np
+
+import titantuner
+
+
+class Test(unittest.TestCase):
+    def test_query(self):
+        np.random.seed(0)
+        x = np.random.rand(1000) * 100
+        y = np.random.rand(1000) * 50
+        x[0] = np.nan
+        index = titantuner.lod.GridIndex(x, y, 16)
+        for xrange, yrange in [((10, 20), (5, 45)), ((-10, 200), (-10, 100)), ((200, 300), (0, 50)), ((50, 50), (0, 50))]:
+            expected = np.flatnonzero((x >= xrange[0]) & (x <= xrange[1]) & (y >= yrange[0]) & (y <= yrange[1]))
+            np.testing.assert_array_equal(index.query(xrange, yrange), expected)
+
+    def test_empty(self):
+        index = titantuner.lod.GridIndex([], [])
+        self.assertEqual(len(index.query((0, 1), (0, 1))), 0)
+
+    def test_aggregate(self):
+        x = np.array([0.5, 1.5, 1.6, 3.5])
+        y = np.array([0.5, 0.5, 0.6, 3.5])
+        flagged = np.array([True, False, True, False])
+        cells, size = titantuner.lod.aggregate(x, y, flagged, (0, 4), (0, 4), num_cells=4)
+        self.assertEqual(size, 1)
+        np.testing.assert_array_equal(cells["x"], [0.5, 1.5, 3.5])
+        np.testing.assert_array_equal(cells["y"], [0.5, 0.5, 3.5])
+        np.testing.assert_array_equal(cells["count"], [1, 2, 1])
+        np.testing.assert_array_equal(cells["rate"], [1, 0.5, 0])
+        # Cells are aligned on multiples of their size
+        cells, size = titantuner.lod.aggregate(x, y, flagged, (0.2, 4.2), (0.2, 4.2), num_cells=4)
+        np.testing.assert_array_equal(cells["x"], [0.5, 1.5, 3.5])
+
+
+if __name__ == "__main__":
+    unittest.main()
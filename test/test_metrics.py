@@ -0,0 +1,66 @@
+from __future__ import print_function
+import unittest
+import time
+import numpy as np
+import tornado.testing
+import tornado.web
+
+import titantuner
+
+
+class Test(unittest.TestCase):
+    def test_nested_stages(self):
+        timings = titantuner.metrics.Timings()
+        with timings:
+            with titantuner.metrics.stage("outer"):
+                time.sleep(0.01)
+                with titantuner.metrics.stage("inner"):
+                    time.sleep(0.05)
+        self.assertEqual(set(timings.stages.keys()), {"outer", "inner"})
+        # The outer stage does not include the inner one
+        self.assertLess(timings.stages["outer"], 0.05)
+        self.assertGreaterEqual(timings.stages["inner"], 0.05)
+        self.assertGreaterEqual(timings.total, 0.06)
+        self.assertIsNone(titantuner.metrics.current())
+
+    def test_no_current_timings(self):
+        @titantuner.metrics.timed("stage")
+        def function():
+            return 1
+        self.assertEqual(function(), 1)
+
+    def test_run_timings(self):
+        dataset = titantuner.dataset.Dataset("test", [60, 60.01], [10, 10.01], [0, 0], [1, 2], 0, "ta")
+        result = titantuner.engine.run("isolation", dataset, {"num": 1, "radius": 5}, [0, 1])
+        self.assertEqual(list(result.timings.keys()), ["subset", "points", "titanlib"])
+
+    def test_registry(self):
+        registry = titantuner.metrics.Registry(max_samples=10)
+        registry.increment("tests_run")
+        for seconds in range(1, 21):
+            registry.record("apply", seconds, {"titanlib": seconds / 2})
+        # Percentiles are computed from the 10 most recent observations
+        self.assertEqual(registry.histograms["apply"].percentile(0), 11)
+        self.assertEqual(registry.histograms["apply"].count, 20)
+        text = registry.render()
+        self.assertIn("titantuner_tests_run_total 1\n", text)
+        self.assertIn('titantuner_apply_seconds{quantile="0.5"} 15.5\n', text)
+        self.assertIn("titantuner_apply_seconds_count 20\n", text)
+        self.assertIn("titantuner_apply_titanlib_seconds_sum 105\n", text)
+        self.assertTrue(np.isnan(titantuner.metrics.Histogram().percentile(95)))
+
+
+class TestHandler(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        self.registry = titantuner.metrics.Registry()
+        self.registry.increment("sessions")
+        return tornado.web.Application([("/metrics", titantuner.metrics.MetricsHandler, {"registry": self.registry})])
+
+    def test_get(self):
+        response = self.fetch("/metrics")
+        self.assertEqual(response.code, 200)
+        self.assertIn(b"titantuner_sessions_total 1", response.body)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+from __future__ import print_function
+import unittest
+import concurrent.futures
+import os
+import time
+
+import titantuner
+
+
+class Test(unittest.TestCase):
+    def get_source(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        source = titantuner.source.TitanSource([f"{dir}files/titan/*.txt"])
+        return titantuner.source.CachedSource(source, 10**6, num_prefetch=1)
+
+    def test_neighbours(self):
+        source = self.get_source()
+        prefetcher = source.prefetcher()
+        self.assertEqual(source.keys, ["obs_rr_invalid.txt", "obs_ta_empty.txt", "obs_ta_na.txt"])
+        self.assertEqual(prefetcher.get_neighbours(0), [("obs_ta_empty.txt",)])
+        self.assertEqual(prefetcher.get_neighbours(1), [("obs_ta_na.txt",), ("obs_rr_invalid.txt",)])
+
+    def test_prefetch(self):
+        source = self.get_source()
+        prefetcher = source.prefetcher()
+        prefetcher.prefetch(1)
+        concurrent.futures.wait(list(prefetcher.futures.values()))
+        self.assertTrue(source.is_cached("obs_ta_na.txt"))
+        self.assertTrue(source.is_cached("obs_rr_invalid.txt"))
+        source.load("obs_ta_na.txt")
+        self.assertEqual(source.cache.hits, 1)
+
+    def test_cancel_on_jump(self):
+        source = self.get_source()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # Keep the only worker busy, so that the prefetches stay in the queue
+        blocker = executor.submit(time.sleep, 0.2)
+        prefetcher = titantuner.source.Prefetcher(source, executor, 1)
+        prefetcher.prefetch(0)
+        future = prefetcher.futures[("obs_ta_empty.txt",)]
+        prefetcher.prefetch(1)
+        self.assertTrue(future.cancelled())
+        self.assertEqual(list(prefetcher.futures.keys()), [("obs_ta_na.txt",), ("obs_rr_invalid.txt",)])
+        executor.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,9 @@ from __future__ import print_function
 import unittest
 import collections
 import os
+import shutil
+import tempfile
+import numpy as np
 
 import titantuner
 
@@ -15,6 +18,106 @@ class Test(unittest.TestCase):
         filenames = titantuner.source.TitanSource.get_filenames([f"{dir}files/1/*.txt"])
         self.assertEqual(filenames, [f"{dir}files/1/file2.txt"])
 
+    def test_parse_titan_file(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        lats, lons, elevs, values = titantuner.source.TitanSource.parse_titan_file(f"{dir}files/titan/obs_ta_na.txt")
+        np.testing.assert_array_equal(lats, [60.1, 61.2, 63.4])
+        np.testing.assert_array_equal(lons, [10.2, 11.3, 13.4])
+        np.testing.assert_array_equal(elevs, [100, -999, 400])
+        np.testing.assert_array_equal(values, [1.5, 2.5, -1.0])
+
+        lats, lons, elevs, values = titantuner.source.TitanSource.parse_titan_file(f"{dir}files/titan/obs_ta_na.txt", latrange=[61, 64], lonrange=[0, 12])
+        np.testing.assert_array_equal(lats, [61.2])
+
+    def test_parse_titan_file_invalid_values(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        lats, lons, elevs, values = titantuner.source.TitanSource.parse_titan_file(f"{dir}files/titan/obs_rr_invalid.txt")
+        np.testing.assert_array_equal(lats, [60.1, 63.4])
+        np.testing.assert_array_equal(lons, [10.2, 13.4])
+        np.testing.assert_array_equal(elevs, [-999, -999])
+        np.testing.assert_array_equal(values, [1.5, 4.0])
+
+    def test_parse_titan_file_empty(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        lats, lons, elevs, values = titantuner.source.TitanSource.parse_titan_file(f"{dir}files/titan/obs_ta_empty.txt")
+        self.assertEqual(len(lats), 0)
+        self.assertEqual(len(values), 0)
+
+    def test_load_cached(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        with tempfile.TemporaryDirectory() as tempdir:
+            shutil.copy(f"{dir}files/titan/obs_ta_na.txt", tempdir)
+            cache = titantuner.cache.DiskCache(f"{tempdir}/cache", 10**6, ".npy")
+            source = titantuner.source.TitanSource([f"{tempdir}/*.txt"], cache)
+            for i in range(2):
+                columns = source.read_columns(f"{tempdir}/obs_ta_na.txt")
+                self.assertEqual(list(columns.keys()), ['lat', 'lon', 'elev', 'value', 'prid', 'dqc'])
+                np.testing.assert_array_equal(columns['prid'], [1, 3, 5])
+                dataset = source.load("obs_ta_na.txt")
+                np.testing.assert_array_equal(dataset.elevs, [100, -999, 400])
+            self.assertEqual(len(os.listdir(f"{tempdir}/cache")), 1)
+
+            # Modifying the file invalidates the cache
+            with open(f"{tempdir}/obs_ta_na.txt", "a") as file:
+                file.write("64.5;14.5;500;3.0;3;0\n")
+            dataset = source.load("obs_ta_na.txt")
+            np.testing.assert_array_equal(dataset.values, [1.5, 2.5, -1.0, 3.0])
+
+    def test_cached_source(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        source = titantuner.source.TitanSource([f"{dir}files/titan/*.txt"])
+        source = titantuner.source.CachedSource(source, 10**6)
+        dataset1 = source.load("obs_ta_na.txt")
+        dataset2 = source.load("obs_ta_na.txt")
+        self.assertIs(dataset1, dataset2)
+        self.assertEqual((source.cache.hits, source.cache.misses), (1, 1))
+        with self.assertRaises(ValueError):
+            dataset1.values[0] = 0
+
+        # Derived arrays count towards the size of the cache
+        size = source.cache.size
+        dataset1.x
+        self.assertEqual(source.cache.size, size + dataset1.x.nbytes)
+
+    def test_cached_source_invalidation(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        with tempfile.TemporaryDirectory() as tempdir:
+            shutil.copy(f"{dir}files/titan/obs_ta_na.txt", tempdir)
+            source = titantuner.source.CachedSource(titantuner.source.TitanSource([tempdir]), 10**6)
+            dataset = source.load("obs_ta_na.txt")
+            self.assertIs(source.load("obs_ta_na.txt"), dataset)
+
+            # A rewritten file is loaded again
+            with open(f"{tempdir}/obs_ta_na.txt", "a") as file:
+                file.write("64.5;14.5;500;3.0;3;0\n")
+            self.assertEqual(len(source.load("obs_ta_na.txt")), 4)
+
+            # Datasets older than the ttl of the source are loaded again
+            source.source.ttl = 0
+            self.assertIsNot(source.load("obs_ta_na.txt"), source.load("obs_ta_na.txt"))
+
+    def test_load_predicate(self):
+        dir = os.path.dirname(os.path.realpath(__file__)).rstrip('/') + "/"
+        predicate = titantuner.source.Predicate(latrange=[61, 64], providers=[3, 5], dqcs=[0])
+        with tempfile.TemporaryDirectory() as tempdir:
+            cache = titantuner.cache.DiskCache(tempdir, 10**6, ".npy")
+            for source in [titantuner.source.TitanSource([f"{dir}files/titan/*.txt"]),
+                           titantuner.source.TitanSource([f"{dir}files/titan/*.txt"], cache)]:
+                dataset = source.load("obs_ta_na.txt", predicate)
+                np.testing.assert_array_equal(dataset.lats, [61.2, 63.4])
+                np.testing.assert_array_equal(dataset.values, [2.5, -1.0])
+                # The dataset does not keep the prid and dqc columns in memory
+                self.assertIsNone(dataset.buffer.base)
+
+                # Files without prid and dqc columns are only filtered by location
+                with self.assertWarns(UserWarning):
+                    dataset = source.load("obs_rr_invalid.txt", predicate)
+                np.testing.assert_array_equal(dataset.lats, [63.4])
+
+        source = titantuner.source.TitanSource([f"{dir}files/titan/*.txt"], predicate=titantuner.source.Predicate(providers=[1]))
+        np.testing.assert_array_equal(source.load("obs_ta_na.txt").lats, [60.1])
+        self.assertEqual(titantuner.source.Predicate(providers=[3, 1]), titantuner.source.Predicate(providers=[1, 3]))
+
 
 if __name__ == "__main__":
     unittest.main()
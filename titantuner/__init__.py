@@ -1,5 +1,6 @@
 import calendar
 import datetime
+import importlib
 import numbers
 import os
 import pkgutil
@@ -10,11 +11,11 @@ import numpy as np
 VERSION = "0.1.1"
 
 __all__ = []
-for loader, module_name, is_pkg in pkgutil.walk_packages(__path__):
+for loader, module_name, is_pkg in pkgutil.iter_modules(__path__):
     if module_name != "__main__":
         __all__.append(module_name)
-        _module = loader.find_module(module_name).load_module(module_name)
-        globals()[module_name] = _module
+        # Import under the full name, so that functions can be pickled (e.g. to run in other processes)
+        globals()[module_name] = importlib.import_module(f"{__name__}.{module_name}")
 
 
 def date_to_unixtime(date, hour=0, min=0, sec=0):
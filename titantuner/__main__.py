@@ -34,7 +34,23 @@ def main():
     parser.add_argument('-d', help='Directories or file patterns containing data', dest="directories_or_patterns", nargs='+')
     parser.add_argument('-p', type=int, default=8081, dest="port")
     parser.add_argument('--frostid', help="Load data from frost, using this ID")
+    parser.add_argument('--frost-url', help="Fetch frost data from this url instead (e.g. a FrostStandIn)", dest="frost_url")
     parser.add_argument('--debug', help="Bokeh server in debug mode",  action="store_true")
+    parser.add_argument('--cache-dir', default=titantuner.cache.get_default_cache_dir(), help="Directory for caching parsed data files", dest="cache_dir")
+    parser.add_argument('--cache-size', type=float, default=1024, help="Maximum size of the cache directory in MB (0 disables the cache)", dest="cache_size")
+    parser.add_argument('--latrange', type=float, nargs=2, help="Only load stations within this latitude range")
+    parser.add_argument('--lonrange', type=float, nargs=2, help="Only load stations within this longitude range")
+    parser.add_argument('--providers', type=int, nargs='+', help="Only load stations from these providers (prid)")
+    parser.add_argument('--dqc', type=int, nargs='+', help="Only load observations with these quality flags (dqc)", dest="dqcs")
+    parser.add_argument('--memory-cache-size', type=float, default=1024, help="Maximum memory used for datasets shared between sessions in MB", dest="memory_cache_size")
+    parser.add_argument('--result-cache-size', type=float, default=256, help="Maximum memory used for caching test results in MB (0 disables the cache)", dest="result_cache_size")
+    parser.add_argument('--workers', type=int, default=2, help="Number of processes running tests, shared by all sessions (0 runs tests in the server process)")
+    parser.add_argument('--tiles', type=int, default=1, help="Run SCT-type tests in this many tiles in each direction on the workers", dest="num_tiles")
+    parser.add_argument('--float32', help="Keep datasets in single precision, which halves the memory used", action="store_true")
+    parser.add_argument('--watch', type=float, default=60, help="Check for new data files every this many seconds (0 disables)")
+    parser.add_argument('--max-markers', type=int, default=20000, help="Show the stations in view as markers when there are at most this many, otherwise as cells (0 always shows markers)", dest="max_markers")
+    parser.add_argument('--webgl', help="Draw the map with WebGL, which is faster for many stations", action="store_true")
+    parser.add_argument('--prefetch', type=int, default=2, help="Number of datasets before and after the selected one to load in the background")
     # protection against writing for instance -debug, read as -d ebug
     args = parser.parse_args()
     if args.directories_or_patterns:
@@ -42,13 +58,34 @@ def main():
             validate_path(path)
     run(**vars(args))
 
-def run(directories_or_patterns, port, frostid, debug):
-    app_handle = lambda doc: application(doc, directories_or_patterns, frostid)
+# Fraction of the cache directory used for test results, when they are cached
+RESULT_CACHE_FRACTION = 0.25
+
+def run(directories_or_patterns, port, frostid, debug, frost_url=None, cache_dir=None, cache_size=0, memory_cache_size=1024,
+        latrange=None, lonrange=None, providers=None, dqcs=None, prefetch=0, watch=0, float32=False, workers=0, result_cache_size=0, num_tiles=1, max_markers=20000, webgl=False):
+    if latrange is None and lonrange is None and providers is None and dqcs is None:
+        predicate = None
+    else:
+        predicate = titantuner.source.Predicate(latrange, lonrange, providers, dqcs)
+    # The source's files and the results share the cache directory, within cache_size in total
+    result_fraction = RESULT_CACHE_FRACTION if result_cache_size > 0 else 0
+    # One source is shared by all sessions, so that each dataset is only loaded once per server
+    source = create_source(directories_or_patterns, frostid, cache_dir, cache_size * (1 - result_fraction), predicate, frost_url)
+    dtype = np.float32 if float32 else None
+    source = titantuner.source.CachedSource(source, int(memory_cache_size * 1024**2), prefetch, dtype)
+    if watch > 0:
+        source.watch(watch)
+    # Titanlib holds the GIL while it runs, so tests run in other processes to keep the server responsive
+    executor = titantuner.engine.create_executor(workers) if workers > 0 else None
+    results = create_result_cache(result_cache_size, cache_dir, cache_size * result_fraction)
+    app_handle = lambda doc: application(doc, source, executor, results, num_tiles, max_markers, webgl)
     server = Server(
             app_handle,  # list of Bokeh applications
             port=port,
             allow_websocket_origin=[f"localhost:{port}"],
             debug=debug,
+            # Counters and latency percentiles of the server
+            extra_patterns=[("/metrics", titantuner.metrics.MetricsHandler)],
         )
 
     # start timers and services and immediately return
@@ -58,14 +95,30 @@ def run(directories_or_patterns, port, frostid, debug):
     server.io_loop.start()
     # titantuner.run.main()
 
-def application(doc, directories_or_patterns, frostid=None):
+def create_source(directories_or_patterns, frostid=None, cache_dir=None, cache_size=0, predicate=None, frost_url=None):
+    use_cache = cache_dir is not None and cache_size > 0
     if frostid is not None:
-        source = titantuner.source.FrostSource(frostid)
-    elif directories_or_patterns is None:
-        source = titantuner.source.TitanSource([titantuner.source.TitanSource.get_default_data_dir()])
+        cache = titantuner.cache.DiskCache(os.path.join(cache_dir, "frost"), int(cache_size * 1024**2), ".json") if use_cache else None
+        source = titantuner.source.FrostSource(frostid, frost_url, cache)
+        return source
+
+    cache = titantuner.cache.DiskCache(os.path.join(cache_dir, "columns"), int(cache_size * 1024**2), ".npy") if use_cache else None
+    if directories_or_patterns is None:
+        source = titantuner.source.TitanSource([titantuner.source.TitanSource.get_default_data_dir()], cache, predicate)
     else:
-        source = titantuner.source.TitanSource(directories_or_patterns)
-    application = titantuner.app.App(source, doc)
+        source = titantuner.source.TitanSource(directories_or_patterns, cache, predicate)
+    return source
+
+def create_result_cache(result_cache_size, cache_dir=None, cache_size=0):
+    if result_cache_size <= 0:
+        return None
+    # Results are also stored on disk, so that they survive a restart of the server
+    use_cache = cache_dir is not None and cache_size > 0
+    disk_cache = titantuner.cache.DiskCache(os.path.join(cache_dir, "results"), int(cache_size * 1024**2), ".npz") if use_cache else None
+    return titantuner.engine.ResultCache(int(result_cache_size * 1024**2), disk_cache)
+
+def application(doc, source, executor=None, results=None, num_tiles=1, max_markers=20000, webgl=False):
+    application = titantuner.app.App(source, doc, executor, results, num_tiles, max_markers, webgl)
 
 if __name__ == "__main__":
     main()
@@ -7,144 +7,258 @@ import copy
 from bokeh.io import output_file, show
 from bokeh.layouts import column, row, gridplot
 from bokeh.models import Button, Title, Text, Label, Panel, ColumnDataSource, GMapOptions, BoxZoomTool
-from bokeh.models.widgets import RangeSlider, Slider, PreText, Paragraph, TextInput, Select, RadioButtonGroup, CheckboxButtonGroup, Dropdown, InputWidget
+from bokeh.models.widgets import RangeSlider, Slider, PreText, Paragraph, TextInput, Select, RadioButtonGroup, CheckboxButtonGroup, Dropdown, InputWidget, Toggle
 from bokeh.models.widgets.widget import Widget
 from bokeh.models.renderers import TileRenderer
-from bokeh.palettes import RdYlBu3
+from bokeh.palettes import RdYlBu3, YlOrRd9
 from bokeh.plotting import figure, curdoc, show, output_file
 from bokeh.tile_providers import get_provider, Vendors
 import bokeh.application
 from bokeh.layouts import LayoutDOM
-from bokeh.models import ColorPicker
+from bokeh.models import ColorPicker, DataRange1d, HoverTool, LinearAxis, LinearColorMapper, Legend, LegendItem
 #from bokeh.transform import factor_cmap
 import titantuner
+# Imported explicitly, since its decorators are used while titantuner is being imported
+import titantuner.metrics
 
 displaid_label_buttons = ["Obs", "BoxCoxObs", "Elev", "SCT"]
 
-def apply_BoxCox(values, power):
-    values = np.array(values)
-    values_to_test = copy.deepcopy(values)
-    if power == 0:
-        ix_0 = np.where(values_to_test == 0)[0]
-        values_to_test[ix_0] = 0.0001
-        if len(ix_0)>0:
-            print(f"Warning 0 values replaced by 0.0001.")
-        ix_pos = np.where(values_to_test >= 0)[0]
-        values_to_test[ix_pos] = np.log(values_to_test[ix_pos])
-        if len(ix_pos) != len(values):
-            print(f"Warning, values < 0 not transformed with a box cox transformation. {len(values)-len(ix_pos)} untransformed value(s)")
-    elif power > 0:
-        ix_pos = np.where(values_to_test >= 0)[0]
-        values_to_test[ix_pos] = (pow(values_to_test[ix_pos], power) - 1) / power
-        if len(ix_pos) != len(values):
-            print(f"Warning, negative values not transformed with a box cox transformation. {len(values)-len(ix_pos)} untransformed value(s)")
-    else:
-        raise ValueError(f"StartedBoxCox: Power must be >=0")
-    return values_to_test
-
-def apply_StartedBoxCox(values, power, scaling):
-    values = np.array(values)
-    values_to_test = copy.deepcopy(values)
-    if scaling<=0:
-        raise ValueError(f"StartedBoxCox: scaling must be >0. Is {scaling}")
-    if power == 0:
-        ix_above_thr = np.where(values_to_test>scaling)[0]
-        values_to_test[ix_above_thr] = scaling * (1 + np.log(values_to_test[ix_above_thr]/scaling))
-    elif(power>0):
-        ix0 = np.where(values_to_test == 0)[0]
-        values_to_test[ix0] = 0
-        ix_above_thr = np.where(values_to_test>scaling)[0]
-        values_to_test[ix_above_thr] = scaling * (1 + (((pow(values_to_test[ix_above_thr]/scaling, power)) - 1) / power));
-    else:
-        raise ValueError(f"StartedBoxCox: Power must be >=0")
-    return values_to_test
-
-def apply_PowerTransform(values, power, scaling):
-    if scaling <=0:
-        print(f"Apply box Cox transformation with power {power}")
-        values = apply_BoxCox(values, power)
-    else:
-        print(f"Apply Started box Cox transformation with power {power} and scaling {scaling}")
-        values = apply_StartedBoxCox(values, power, scaling)
-    return(values)
-
-def apply_PowerTransform(values, power, scaling):
-    if scaling <=0:
-        print(f"Apply box Cox transformation with power {power}")
-        values = apply_BoxCox(values, power)
-    else:
-        print(f"Apply Started box Cox transformation with power {power} and scaling {scaling}")
-        values = apply_StartedBoxCox(values, power, scaling)
-    return(values)
-
-
-def displayed_value(variable, value):
-    if variable == "rr" and value < 1 and value > 0:
-        return f'{value:.1f}'
-    else:
-        return f'{value:.0f}'
+def is_same(models: list, other: list) -> bool:
+    """Returns True if both lists contain the same models, in the same order"""
+    return len(models) == len(other) and all(a is b for a, b in zip(models, other))
+
+def format_values(values, decimals: int) -> np.ndarray:
+    """Returns the values with the given number of decimals, as an array of strings
+
+    Each distinct value is only formatted once. The values are compared bit by bit, so that the texts are
+    the same as when formatting each value (e.g. -0 and 0 differ, and nothing is rounded beforehand).
+    """
+    values = np.ascontiguousarray(values, dtype=float)
+    unique, inverse = np.unique(values.view(np.int64), return_inverse=True)
+    texts = np.array([f'{value:.{decimals}f}' for value in unique.view(float)], dtype=object)
+    return texts[inverse.reshape(-1)]
+
+def displayed_values(variable, values) -> np.ndarray:
+    """Returns the values as shown in the labels: precipitation below 1 with one decimal, otherwise none"""
+    values = np.asarray(values, dtype=float)
+    texts = format_values(values, 0)
+    if variable == "rr":
+        Idecimal = np.flatnonzero((values < 1) & (values > 0))
+        texts[Idecimal] = format_values(values[Idecimal], 1)
+    return texts
+
+def displayed_elevations(elevs) -> np.ndarray:
+    """Returns the elevations as shown in the labels: truncated to whole meters"""
+    # Adding 0 turns -0 (e.g. from -0.5) into 0
+    return format_values(np.trunc(np.asarray(elevs, dtype=float)) + 0.0, 0)
+
+def join_labels(parts: list, n: int) -> np.ndarray:
+    """Returns labels of n stations with one line from each array of strings in parts"""
+    if len(parts) == 0:
+        return np.full(n, "", dtype=object)
+    labels = parts[0]
+    for part in parts[1:]:
+        labels = labels + "\n" + part
+    return labels
+
+class TestJob:
+    """A test started from the app, with the observations it runs on"""
+    def __init__(self, test: str, params: dict, Iall_tests: np.ndarray, Is: np.ndarray, reset: bool):
+        """
+        Arguments:
+            test (str): Name of the test in titantuner.engine
+            params (dict): Parameters of the test
+            Iall_tests (np.array): Indices of the selected observations in the dataset
+            Is (np.array): Indices of the tested observations in Iall_tests
+            reset (bool): True if the results of previous tests are discarded
+        """
+        self.test = test
+        self.params = params
+        self.Iall_tests = Iall_tests
+        self.Is = Is
+        self.reset = reset
+        self.future = None
+        self.start_time = time.time()
+        # Key in the result cache
+        self.key = None
+        self.cached = False
+        # Started by live mode, after a parameter changed at event_time
+        self.live = False
+        self.event_time = None
+        # Number of tiles in each direction, if the test runs in tiles
+        self.num_tiles = 1
+        self.timings = titantuner.metrics.Timings()
+        self.submit_time = None
+
+    @property
+    def Itested(self) -> np.ndarray:
+        """Indices of the tested observations in the dataset"""
+        return self.Iall_tests[self.Is]
+
+
+class Sweep:
+    """A sweep of one parameter of a test started from the app, with the results received so far"""
+    def __init__(self, job: TestJob, key: str, values: list):
+        """
+        Arguments:
+            job (TestJob): The test, the other parameters, and the observations of all runs
+            key (str): The swept parameter
+            values (list): The values of the swept parameter
+        """
+        self.job = job
+        self.key = key
+        self.values = values
+        # Value of the parameter -> Result
+        self.results = dict()
+        self.futures = list()
+
+    def lookup(self, job: TestJob):
+        """Returns the result of the sweep for the test, parameters and observations of job, or None"""
+        if job.test != self.job.test or self.key not in job.params:
+            return None
+        params = dict(job.params)
+        params[self.key] = self.job.params[self.key]
+        if params != self.job.params or not np.array_equal(job.Itested, self.job.Itested):
+            return None
+        return self.results.get(job.params[self.key])
+
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+
 
 class App():
-    def __init__(self, source, doc):
+    def __init__(self, source, doc, executor=None, results=None, num_tiles=1, max_markers=20000, webgl=False):
+        """
+        Arguments:
+            source (titantuner.source.Source): Where to load datasets from
+            doc (bokeh.document.Document): The document of the session
+            executor (concurrent.futures.Executor): Where to run tests (see titantuner.engine.create_executor).
+                If None, tests run in the server's event loop.
+            results (titantuner.engine.ResultCache): Where to cache the results of tests. If None, tests
+                always run.
+            num_tiles (int): If more than 1, tests that support it run in num_tiles x num_tiles tiles in
+                parallel on the executor (see titantuner.engine.submit_tiled)
+            max_markers (int): Show the stations in view as markers if there are at most this many, and
+                otherwise as cells with the number of stations and the fraction flagged. If 0, all stations
+                are always shown as markers.
+            webgl (bool): Draw the map with WebGL instead of the canvas
+        """
         self.source = source
         self.doc = doc
+        self.executor = executor
+        self.results = results
+        self.num_tiles = num_tiles
+        self.max_markers = max_markers
+        self.output_backend = "webgl" if webgl else "canvas"
+        self.lod_index = None
+        self.job = None
+        self.progress_callback = None
+        self.live = False
+        self.live_callback = None
+        self.live_event_time = None
+        # State of the app before the test shown in live mode, which is replaced by each live run
+        self.live_state = None
+        self.sweep = None
 
         self.ui = None
+        self.p = None
+        self.root = None
+        titantuner.metrics.registry.increment("sessions")
+        self.prefetcher = self.source.prefetcher()
+        if self.prefetcher is not None:
+            doc.on_session_destroyed(lambda context: self.prefetcher.cancel())
+        doc.on_session_destroyed(lambda context: self.job is not None and self.job.future.cancel())
+        doc.on_session_destroyed(lambda context: self.cancel_sweep())
         date, hour = titantuner.unixtime_to_date(time.time() - 2 * 3600)
         self.datetime = date * 100 + hour
         self.set_dataset(0, self.datetime)
         self.setup_initialize(first_map=True)
+        self.keys_version = self.source.keys_version
+        doc.add_periodic_callback(self.update_keys, 5000)
 
-    def initialize_val_minmax(self, delta_key, Is):
-        values_min = self.data['values'][Is] - self.ui[delta_key].value * np.ones(len(Is))
-        values_max = self.data['values'][Is] + self.ui[delta_key].value * np.ones(len(Is))
-        return values_min, values_max
-
-    def calculate_val_minmax(self, values_min, values_max, delta_key, fact_key, Is, boxcox_power, boxcox_scaling):
-        values_min[np.where(values_min < 0)[0]] = 0
-        values_min_alt = self.data['values'][Is] - self.ui[fact_key].value * np.ones(len(Is)) * self.data['values'][Is]
-        values_min_alt[np.where(values_min_alt < 0)[0]] = 0
-        ix_min = np.where(values_min_alt < values_min)[0]
-        values_min[ix_min] = values_min_alt[ix_min]
-
-        values_max[np.where(values_max < 0)[0]] = 0
-        values_max_alt = self.data['values'][Is] + self.ui[fact_key].value * np.ones(len(Is)) * self.data['values'][Is]
-        values_max_alt[np.where(values_max_alt < 0)[0]] = 0
-        ix_max = np.where(values_max_alt > values_max)[0]
-        values_max[ix_max] = values_max_alt[ix_max]
-        
-        values_min = apply_PowerTransform(values_min, boxcox_power, boxcox_scaling)
-        values_max = apply_PowerTransform(values_max, boxcox_power, boxcox_scaling)
-
-        return values_min, values_max
-
-    def add_labels(self, Is, obs_values, boxcox_values, sct, xx, yy, elevs):
-        selected_labels = [self.ui["labels"].labels[i] for i in self.ui["labels"].active]
-        texts = []
-        for t in range(len(xx)):
-            curr = []
-            if "Obs" in selected_labels:
-                curr += [displayed_value(self.variable, obs_values[t])]
-            if "BoxCoxObs" in selected_labels:
-                # boxcox value for previous tests is not stored
-                if len(boxcox_values)>0: 
-                    curr += ["%.1f" % boxcox_values[t]]
-            if "Elev" in selected_labels:
-                curr += ["%d" % elevs[t]]
-            if "SCT" in selected_labels:
-                if len(sct)>0:
-                # sct for previous tests is not stored
-                    curr += ["%.1f" % sct[t]]
-            texts += ['\n'.join(curr)]
+    def update_keys(self):
+        """Updates the dataset dropdown when files have been added or removed"""
+        if self.source.keys_version == self.keys_version:
+            return
+        self.keys_version = self.source.keys_version
+        keys = self.source.keys
+        self.ui["dataset"].options = self.get_dataset_options()
+        if self.dataset_key in keys:
+            self.dataset_index = keys.index(self.dataset_key)
+        else:
+            print(f"Dataset {self.dataset_key} is no longer available")
+
+    def get_dataset_options(self) -> list:
+        """Returns the options of the dataset dropdown
+
+        If the selected dataset has been removed from the source, it is still loaded and can still be
+        tested, so it stays in the dropdown, marked as removed, until another dataset is selected.
+        """
+        keys = self.source.keys
+        if self.dataset_key in keys:
+            return keys
+        return keys + [(self.dataset_key, f"{self.dataset_key} (removed)")]
+
+    def get_params(self) -> dict:
+        """Returns the parameters of the selected test, as set in the ui"""
+        params = dict()
+        for key, widget in self.ui.items():
+            if isinstance(widget, Slider) and key != "frac":
+                params[key] = widget.value
+            elif isinstance(widget, RadioButtonGroup):
+                params[key] = widget.active
+        return params
+
+    # Labels that only depend on the dataset, and are cached (see get_dataset_labels)
+    dataset_label_buttons = ["Obs", "Elev"]
+
+    @titantuner.metrics.timed("labels")
+    def add_labels(self, Is, Itested, boxcox_values, sct):
+        """Sets the labels of the tested stations
+
+        Arguments:
+            Is (np.array): Indices of the tested stations in self.data
+            Itested (np.array): Indices of the tested stations in the dataset
+            boxcox_values (np.array): Box-Cox transformed values of the tested stations, or empty
+            sct (np.array): SCT of the tested stations, or empty
+        """
+        selected_labels = tuple(self.ui["labels"].labels[i] for i in self.ui["labels"].active)
+        if all(label in self.dataset_label_buttons for label in selected_labels):
+            texts = self.get_dataset_labels(selected_labels)[Itested]
+        else:
+            parts = []
+            for label in selected_labels:
+                if label in self.dataset_label_buttons:
+                    parts += [self.get_dataset_labels((label,))[Itested]]
+                # boxcox value and sct for previous tests are not stored
+                elif label == "BoxCoxObs" and len(boxcox_values) > 0:
+                    parts += [format_values(boxcox_values, 1)]
+                elif label == "SCT" and len(sct) > 0:
+                    parts += [format_values(sct, 1)]
+            texts = join_labels(parts, len(Is))
         self.data['labels'][Is] = texts
 
+    def get_dataset_labels(self, labels: tuple) -> np.ndarray:
+        """Returns the labels of all stations in the dataset, with the given values (see dataset_label_buttons)
+
+        The labels are computed once for each dataset and combination of values, and kept with the dataset
+        (see titantuner.dataset.Dataset.derived), so that they are shared by all sessions.
+        """
+        def compute(dataset):
+            if labels == ("Obs",):
+                return displayed_values(dataset.variable, dataset.values)
+            elif labels == ("Elev",):
+                return displayed_elevations(dataset.elevs)
+            return join_labels([self.get_dataset_labels((label,)) for label in labels], len(dataset))
+        return self.dataset.derived(("labels",) + labels, compute)
+
     def set_ui(self, value):
         self.ui_name = value
         ui = dict()
 
         # Choose dataset/variable
-        dropdown = Select(title=self.source.key_label, background="cyan", options=[("%d" % i, name) for i, name in
-            enumerate(self.source.keys)], value=str(self.dataset_index))
+        dropdown = Select(title=self.source.key_label, background="cyan", options=self.get_dataset_options(), value=self.dataset_key)
         dropdown.on_change("value", self.choose_dataset_handler)
         ui["dataset"] = dropdown
 
@@ -173,12 +287,12 @@ class App():
         if len(self.lats) == 0:
             latrange = [0, 10]
             lonrange = [0, 10]
-        elif len(self.lats) == 1:
-            latrange = [np.floor(np.min(self.lats)) - 1, np.ceil(np.max(self.lats)) + 1]
-            lonrange = [np.floor(np.min(self.lons)) - 1, np.ceil(np.max(self.lons)) + 1]
         else:
-            latrange = [np.floor(np.min(self.lats)), np.ceil(np.max(self.lats))]
-            lonrange = [np.floor(np.min(self.lons)), np.ceil(np.max(self.lons))]
+            # A single station gets a range around it
+            margin = 1 if len(self.lats) == 1 else 0
+            (latmin, latmax), (lonmin, lonmax) = self.dataset.bounds
+            latrange = [np.floor(latmin) - margin, np.ceil(latmax) + margin]
+            lonrange = [np.floor(lonmin) - margin, np.ceil(lonmax) + margin]
 
         ui["latrange"] = RangeSlider(start=latrange[0], end=latrange[1], value=latrange, step=0.1, title="Latitude range")
         ui["lonrange"] = RangeSlider(start=lonrange[0], end=lonrange[1], value=lonrange, step=0.1, title="Longitude range")
@@ -318,7 +432,19 @@ class App():
             ui["labels"] = CheckboxButtonGroup(labels=displaid_label_buttons[0:-1], active=[0])
         # Buddy-event check, end
 
+        live = Toggle(label="Live update", active=self.live)
+        live.on_change("active", self.choose_live_handler)
+        for widget in ui.values():
+            if isinstance(widget, (Slider, RangeSlider)):
+                widget.on_change("value", self.parameter_changed)
+            elif isinstance(widget, RadioButtonGroup):
+                widget.on_change("active", self.parameter_changed)
+        ui["live"] = live
+
         ui["time"] = TextInput(value="None", title="Titanlib request time [s]")
+        ui["timings"] = PreText(text="", width=300)
+        if self.results is not None:
+            ui["cache"] = TextInput(value="None", title="Result cache: hits | misses (hit rate)")
         ui["stations"] = TextInput(value="None", title="Stations: total | removed | new flagged | new unflag.")
         ui["mean"] = TextInput(value="None", title="Average observed [%s]" % self.units)
 
@@ -327,6 +453,9 @@ class App():
                           value= dico_combine_test_code2ui[self.combine_test])
         dropdown.on_change("value", self.choose_combine_test_handler)
         ui["combine_test"] = dropdown
+        expression = TextInput(value=self.flag_expression, title=self.get_expression_title(), placeholder="e.g. (sct | buddy) & ~isolation")
+        expression.on_change("value", self.choose_expression_handler)
+        ui["expression"] = expression
 
         # Options: https://docs.bokeh.org/en/latest/docs/reference/tile_providers.html
         # STAMEN_TERRAIN and STAMEN_TONER Not anymore available
@@ -337,6 +466,7 @@ class App():
         #ui["background"] = dropdown
         self.ui = ui
         self.set_apply_button()
+        self.set_sweep_ui()
         #ph = figure(title="Histogram") # , plot_height=800, plot_width=1200)
         #ui["histogram"] = ph
         self.edges = range(-20, 21)
@@ -348,126 +478,282 @@ class App():
         self.set_root(self.p)
 
     def data_initialize(self):
-        n = len(self.lon2x(self.lons))
-        self.data = {'x': self.lon2x(self.lons),
-                    'y': self.lat2y(self.lats),
+        n = len(self.xx)
+        self.data = {'x': self.xx,
+                    'y': self.yy,
                     'test_code': np.full(n, -99),
                     'flagged_least1': np.full(n, False),
                     'flagged_new': np.full(n, False),
                     'unflagged_new': np.full(n, False),
+                    # True where the flag expression is true (see show_expression)
+                    'expression': np.full(n, False),
                     'values':self.values,
-                    'labels': np.array([displayed_value(self.variable, val) for val in self.values]).astype(str)}
+                    'labels': self.get_dataset_labels(("Obs",)).copy()}
+        self.flag_columns = titantuner.flags.FlagTable(n, np.arange(n))
     
+    @titantuner.metrics.timed("plot")
     def plot_config(self, plot_orange_if_possible=True, first_map=False):
+        """Shows self.data on the map
+
+        The figure is only created for the first map. Afterwards, only the columns of the map that have
+        changed are sent to the browser.
+        """
+        if first_map or self.p is None:
+            self.create_figure()
+        self.update_map(plot_orange_if_possible)
+
+    def create_figure(self):
         # Mercator axes don't seem to work on some systems
         # self.p = figure(title="Titantuner", plot_height=1000, plot_width=1200,
         #         x_axis_type="mercator", y_axis_type="mercator", match_aspect=True)
         # BUG: strech_both does not strech in height, thus adding the height manually
-    
-        if(first_map):
-            self.p = figure(tools="pan,wheel_zoom,save,reset", title="Titantuner", sizing_mode='stretch_both', match_aspect=True, height=1100)
-            self.p.add_tools(BoxZoomTool(match_aspect=True))
-        else:
-            # the figure is recreated to avoid getting a very big figure object
-            # A better alternative would be to modify the existing objects, and update only the source
-            # https://discourse.bokeh.org/t/clearing-plot-or-removing-all-glyphs/6792
-            # here only the zoom is taken from the previous figure
-            my_x_range =  self.p.x_range
-            my_y_range =  self.p.y_range
-            self.p = figure(tools="pan,wheel_zoom,save,reset", title="Titantuner", sizing_mode='stretch_both',
-                            match_aspect=True, height=1100, 
-                            x_range=(my_x_range.start, my_x_range.end), y_range=(my_y_range.start, my_y_range.end) )
-            self.p.add_tools(BoxZoomTool(match_aspect=True))
-
+        self.p = figure(tools="pan,wheel_zoom,save,reset", title="Titantuner", sizing_mode='stretch_both', match_aspect=True, height=1100,
+                        output_backend=self.output_backend)
+        self.p.add_tools(BoxZoomTool(match_aspect=True))
         self.p.title.text_font_size = "25px"
-        self.p.title.align = "center"            
+        self.p.title.align = "center"
 
         tile_provider = get_provider(Vendors.CARTODBPOSITRON)
         self.p.add_tile(tile_provider)
 
-        if self.combine_test != "chain" and self.number_tests>0:
-            flag_to_plot = [-99, self.number_tests ] # -1
-        else:
-            flag_to_plot = np.sort(np.unique(self.data['test_code']))
-        for test in flag_to_plot:
-            Itest = np.where(self.data["test_code"]==test)[0]
-            if test != -99:
-                color = self.colors[np.mod(test, len(self.colors))]
-                #if (self.number_tests >0 and self.combine_test == "chain"):
-                #if test != self.number_tests:
-                if self.combine_test == "chain" or self.combine_test == "single":
-                    test_name = self.dico_test_code2type[test]
-                else:
-                    test_name = self.dico_test_code2type[test] + " combined to previous"
-                if self.combine_test != "chain":
-                    test_in_legend = test_name
-                else:
-                    test_in_legend = f"{test} ({test_name})"
-                if(len(Itest)>0):
-                    legend_txt = f'Flagged by test {test_in_legend}'
-                else:
-                    legend_txt = f'No value flagged by test {test_in_legend})'
-            else:
-                color = "lightgray"
-                legend_txt = 'OK / Not tested'
-            self.p.scatter('x', 'y', source={'x': self.data['x'][Itest],
-                                             'y': self.data['y'][Itest]
-                                            },
+        # Only the stations in view are sent to the browser, as markers or cells (see update_view). The
+        # ranges of the map are computed from the corners of the dataset instead of the stations shown.
+        self.bounds_source = ColumnDataSource({"x": [], "y": []})
+        bounds = self.p.scatter('x', 'y', source=self.bounds_source, alpha=0)
+        self.p.x_range.renderers = [bounds]
+        self.p.y_range.renderers = [bounds]
+        self.view_callback = None
+        self.cell_source = ColumnDataSource({"x": [], "y": [], "count": [], "flagged": [], "rate": []})
+        self.cells = self.p.rect('x', 'y', width=1, height=1, source=self.cell_source,
+            fill_color={'field': 'rate', 'transform': LinearColorMapper(palette=list(reversed(YlOrRd9)), low=0, high=1)},
+            fill_alpha=0.6,
+            line_color=None
+        )
+        self.p.add_tools(HoverTool(renderers=[self.cells], tooltips=[("Stations", "@count"), ("Flagged", "@flagged (@rate{0.0 %})")]))
+        # The markers are colored by the browser, so that changing a color does not resend the data
+        self.map_source = ColumnDataSource({"x": [], "y": [], "color": [], "changed": []})
+        self.label_source = ColumnDataSource({"x": [], "y": [], "labels": []})
+        self.color_mapper = LinearColorMapper(palette=["lightgray"], low=-0.5, high=0.5)
+        self.markers = self.p.scatter('x', 'y', source=self.map_source,
             fill_alpha=0.9, size=16,
             marker='circle',
             line_width = 1,
-            color=color,
-            legend_label=legend_txt,
+            fill_color={'field': 'color', 'transform': self.color_mapper},
             line_color="darkblue"
         )
-        # # Note: if doing the plots of markers + orange lines in one command, 
-        # some legend and overlay properties are difficult to set up 
-        # if using the code below, 'test_code' data has to be str (data['test_code'].astype(str))
-        # https://docs.bokeh.org/en/2.4.3/docs/user_guide/data.html
-        #            self.p.scatter('x', 'y', source=self.data,
-        #    legend_group="test_code",
-        #    fill_alpha=0.9, size=12,
-        #    marker='circle',
-        #    line_width = 0,
-        #    color=factor_cmap('test_code', self.colors, test_code_uniq, nan_color='lightgray'),
-        #    line_color =factor_cmap('flagged_least1', line_color, flagged_least1_uniq)
-        #)
-        
-        if self.old_flags is not None and self.combine_test != "chain" and plot_orange_if_possible==True :
-            flagged_change_plot = self.p.scatter([], [],
-                    size=17,
-                    marker='circle',
-                    line_color = 'orange',
-                    color=None,
-                    line_width = 2,
-                    legend_label="flag changed by last test"
-                    )
-            Ichange = np.where( (self.data['unflagged_new'] | self.data['flagged_new']))
-            flagged_change_plot.data_source.data = {"x": self.data['x'][Ichange] , "y": self.data['y'][Ichange]}
-
-            # flagged_least1_plot = self.p.scatter([], [],
-            # fill_alpha=0, size=13,
-            # marker='circle',
-            # line_color = "red",
-            # line_width = 2,
-            # legend_label="flagged at least once"
-            # )
-            #Ileast1 = np.where( self.data['flagged_least1'])
-            #flagged_least1_plot.data_source.data = {"x": self.data['x'][Ileast1] , "y": self.data['y'][Ileast1]}
-
-        marker_labels = self.p.text('x', 'y',
+        # Stations whose flag was changed by the last combined test
+        self.changed_markers = self.p.scatter('x', 'y', source=self.map_source,
+            size=17,
+            marker='circle',
+            line_color = 'orange',
+            fill_color=None,
+            line_width = 2,
+            line_alpha='changed'
+        )
+        self.marker_labels = self.p.text('x', 'y',
                         font_size="9pt",
                         text_font_style = 'bold',
                         text_color="#000000",
                         text_align="center",
                         text_baseline="middle",
                         text='labels',
-                        source=self.data
+                        source=self.label_source
                      )
+        for r in [self.p.x_range, self.p.y_range]:
+            r.on_change("start", self.range_changed)
+            r.on_change("end", self.range_changed)
+        # The legend shows markers without data, since changing the legend would otherwise resend the
+        # data of the markers it refers to
+        self.legend = Legend(items=[], location="top_left", title="Test type")
+        self.p.add_layout(self.legend)
+        self.legend_markers = list()
+        self.legend_codes = list()
+        ok_item = LegendItem(label='OK / Not tested', renderers=[self.p.scatter([], [], size=16, marker='circle', color="lightgray", line_color="darkblue")])
+        changed_renderer = self.p.scatter([], [], size=17, marker='circle', line_color='orange', fill_color=None, line_width=2)
+        self.changed_item = LegendItem(label="flag changed by last test", renderers=[changed_renderer], visible=False)
+        self.legend.items = [ok_item, self.changed_item]
+        self.add_legend_items(8)
+
+    def add_legend_items(self, num: int):
+        """Adds num legend items for tests, which are hidden until they are used"""
+        items = list()
+        for i in range(num):
+            renderer = self.p.scatter([], [], size=16, marker='circle', line_color="darkblue", fill_alpha=0.9)
+            self.legend_markers += [renderer]
+            self.legend_codes += [None]
+            items += [LegendItem(label="", renderers=[renderer], visible=False)]
+        self.legend.items = self.legend.items[:-1] + items + self.legend.items[-1:]
+
+    def update_palette(self):
+        """Sets the colors of the markers: not flagged, then the color of each test code"""
+        palette = ["lightgray"] + [self.colors[np.mod(test, len(self.colors))] for test in range(self.number_tests + 1)]
+        self.color_mapper.palette = palette
+        self.color_mapper.high = len(palette) - 0.5
+        for renderer, test in zip(self.legend_markers, self.legend_codes):
+            if test is not None:
+                renderer.glyph.fill_color = palette[1 + test]
+
+    def update_map(self, plot_orange_if_possible=True):
+        test_code = self.data['test_code']
+        # The columns are sent as binary arrays, in the smallest types that hold them
+        dtype = np.int8 if self.number_tests < 126 else np.int16
+        if self.combine_test == "expression":
+            # The stations for which the expression is true, in the color of the first test
+            flag_to_plot = [0]
+            color = self.data['expression'].astype(dtype)
+        else:
+            if self.combine_test != "chain" and self.number_tests>0:
+                flag_to_plot = [self.number_tests] # -1
+            else:
+                flag_to_plot = [test for test in np.unique(test_code) if test != -99]
+            # Index of each station's color in the palette (see update_palette). Stations flagged by tests
+            # that are not shown are gray.
+            shown = np.isin(test_code, flag_to_plot)
+            color = np.where(shown, 1 + test_code, 0).astype(dtype)
+        show_orange = self.old_flags is not None and self.combine_test != "chain" and plot_orange_if_possible==True
+        if show_orange:
+            changed = (self.data['unflagged_new'] | self.data['flagged_new']).astype(np.int8)
+        else:
+            changed = np.zeros(len(test_code), np.int8)
 
-        if(self.p.legend):
-            self.p.legend.location = "top_left"
-            self.p.legend.title = "Test type"
+        self.map_columns = {"x": self.data['x'].astype(np.float32), "y": self.data['y'].astype(np.float32), "color": color, "changed": changed}
+        self.update_view()
+
+        labels = list()
+        for test in flag_to_plot:
+            #if (self.number_tests >0 and self.combine_test == "chain"):
+            #if test != self.number_tests:
+            if self.combine_test == "expression":
+                test_name = f"expression {self.shown_expression}"
+            elif self.combine_test in ["chain", "single"]:
+                test_name = self.dico_test_code2type[test]
+            else:
+                test_name = self.dico_test_code2type[test] + " combined to previous"
+            if self.combine_test != "chain":
+                test_in_legend = test_name
+            else:
+                test_in_legend = f"{test} ({test_name})"
+            if np.any(color == 1 + test):
+                labels += [f'Flagged by test {test_in_legend}']
+            else:
+                labels += [f'No value flagged by test {test_in_legend})']
+        if len(labels) > len(self.legend_markers):
+            self.add_legend_items(len(labels) - len(self.legend_markers))
+        items = self.legend.items[1:-1]
+        for i, item in enumerate(items):
+            if i < len(labels):
+                item.label = labels[i]
+                self.legend_codes[i] = flag_to_plot[i]
+            else:
+                self.legend_codes[i] = None
+            item.visible = i < len(labels)
+        self.changed_item.visible = show_orange
+        self.update_palette()
+
+    # Columns with changes in less than this fraction of the stations are sent as patches
+    PATCH_FRACTION = 0.1
+
+    def update_columns(self, columns: dict):
+        """Sends the columns of the map that have changed to the browser"""
+        data = self.map_source.data
+        n = len(columns["x"])
+        if len(data["x"]) != n:
+            self.map_source.data = columns
+            return
+        updates = dict()
+        patches = dict()
+        for name, values in columns.items():
+            Ichanged = np.flatnonzero(np.asarray(data[name]) != values)
+            if len(Ichanged) == 0:
+                continue
+            elif len(Ichanged) < self.PATCH_FRACTION * n:
+                patches[name] = [(int(i), values[i].item() if isinstance(values[i], np.generic) else values[i]) for i in Ichanged]
+            else:
+                updates[name] = values
+        if len(patches) > 0:
+            self.map_source.patch(patches)
+        if len(updates) > 0:
+            self.map_source.data.update(updates)
+
+    # Labels are shown when at most this many stations are in view
+    MAX_LABELS = 2000
+    # Time after the map was moved until the stations in view are updated [ms]
+    VIEW_DELAY = 200
+    # Number of cells along the map when there are too many stations in view (see titantuner.lod.aggregate)
+    NUM_CELLS = 64
+
+    def get_index(self):
+        """Returns the spatial index of the stations in self.data, which is rebuilt when they change"""
+        x, y = self.data['x'], self.data['y']
+        if self.lod_index is None or not np.array_equal(self.lod_index.x, x, equal_nan=True) or \
+                not np.array_equal(self.lod_index.y, y, equal_nan=True):
+            self.lod_index = titantuner.lod.GridIndex(x, y)
+        return self.lod_index
+
+    def get_view(self) -> tuple:
+        """Returns the x and y ranges shown on the map"""
+        index = self.get_index()
+        view = list()
+        for r, default in [(self.p.x_range, index.xrange), (self.p.y_range, index.yrange)]:
+            # The ranges are not known until the browser has shown the map and sent them
+            if r.start is not None and r.end is not None and np.isfinite(r.start) and np.isfinite(r.end):
+                view += [(min(r.start, r.end), max(r.start, r.end))]
+            else:
+                view += [default]
+        return tuple(view)
+
+    @titantuner.metrics.timed("view")
+    def update_view(self):
+        """Sends the stations in view to the browser
+
+        Up to max_markers stations are shown as markers. Beyond that, the stations are counted in cells,
+        colored by the fraction of flagged stations, and markers are shown once the map is zoomed in.
+        """
+        index = self.get_index()
+        xrange, yrange = self.get_view()
+        Iview = index.query(xrange, yrange)
+        n = len(self.data['x'])
+        show_cells = self.max_markers > 0 and n > self.max_markers and len(Iview) > self.max_markers
+        if self.max_markers == 0 or n <= self.max_markers:
+            Imarkers = slice(None)
+        elif show_cells:
+            Imarkers = Iview[:0]
+        else:
+            Imarkers = Iview
+        self.update_columns({name: values[Imarkers] for name, values in self.map_columns.items()})
+
+        bounds = {"x": list(index.xrange), "y": list(index.yrange)}
+        if self.bounds_source.data != bounds:
+            self.bounds_source.data = bounds
+        if show_cells:
+            flagged = self.map_columns["color"][Iview] > 0
+            cells, size = titantuner.lod.aggregate(self.data['x'][Iview], self.data['y'][Iview], flagged, xrange, yrange, self.NUM_CELLS)
+            self.cells.glyph.update(width=size, height=size)
+            self.cell_source.data = cells
+        elif len(self.cell_source.data["x"]) > 0:
+            self.cell_source.data = {name: [] for name in self.cell_source.data}
+        self.update_labels(Iview)
+
+    def update_labels(self, Iview: np.ndarray):
+        """Sends the labels of the stations in view to the browser, if there are at most MAX_LABELS"""
+        I = Iview if len(Iview) <= self.MAX_LABELS else Iview[:0]
+        x = self.map_columns["x"][I]
+        y = self.map_columns["y"][I]
+        labels = self.data['labels'][I]
+        data = self.label_source.data
+        if len(data["labels"]) == len(I) and np.array_equal(data["x"], x) and np.array_equal(data["y"], y) and \
+                np.array_equal(data["labels"], labels):
+            return
+        self.label_source.data = {"x": x, "y": y, "labels": labels}
+
+    def range_changed(self, attr, old, new):
+        """Updates the stations in view once the map has been moved, at most once every VIEW_DELAY"""
+        if self.view_callback is None:
+            self.view_callback = self.doc.add_timeout_callback(self.range_settled, self.VIEW_DELAY)
+
+    def range_settled(self):
+        self.view_callback = None
+        self.update_view()
 
     def color_picker_initialize(self):
         picker = ColorPicker(title="Color of flagged points", color="red", aspect_ratio=2)
@@ -477,26 +763,39 @@ class App():
     def setup_initialize(self, first_map=True):
         self.number_tests = 0
         self.marker_color = "red"
+        self.keep_color_marker = False
         self.colors = ["red", "green", "cyan", "magenta", "blue", "gold", "brown"]
         self.old_flags = None
         self.dico_test_code2type = {0: None}
         self.data_initialize()
         self.combine_test = "single"
+        self.live_state = None
+        self.flag_expression = getattr(self, "flag_expression", "")
+        # The expression shown on the map, if any
+        self.shown_expression = None
         self.plot_config(plot_orange_if_possible=False, first_map=first_map)
         self.color_picker_initialize()
         self.set_ui("sctdual")
         self.set_root(self.p)
       
 
+    @titantuner.metrics.timed("render")
     def set_root(self, p):
+        """Shows the map and the widgets, only sending those that are not shown yet to the browser"""
         self.panel = [v for v in self.ui.values() if v if isinstance(v, LayoutDOM)]
-        c1 = column(self.panel) 
-        # NOTE: Not sure why column(self.panel, self.picker) does not work!
-        c0 = column(self.p, self.picker)
-        c0.sizing_mode = "stretch_both"
-        root = row(c0, c1)
-        self.doc.clear()
-        self.doc.add_root(root)
+        if self.root is None:
+            self.panel_column = column(self.panel)
+            # NOTE: Not sure why column(self.panel, self.picker) does not work!
+            self.map_column = column(self.p, self.picker)
+            self.map_column.sizing_mode = "stretch_both"
+            self.root = row(self.map_column, self.panel_column)
+            self.doc.clear()
+            self.doc.add_root(self.root)
+            return
+        if not is_same(self.map_column.children, [self.p, self.picker]):
+            self.map_column.children = [self.p, self.picker]
+        if not is_same(self.panel_column.children, self.panel):
+            self.panel_column.children = self.panel
 
     def reset_root(self):
         return
@@ -507,12 +806,15 @@ class App():
         curdoc().add_root(root)
 
     def choose_dataset_handler(self, attr, old, new):
+        if new not in self.source.keys:
+            # The dataset has been removed (see get_dataset_options)
+            return
         # if the previous dataset is empty, map is not yet shown
         if (self.values is None or len(self.values)==0):
             first_map=True
         else:
             first_map=False
-        self.set_dataset(int(new), self.datetime)
+        self.set_dataset(self.source.keys.index(new), self.datetime)
         self.setup_initialize(first_map=first_map)
         #self.data_initialize()
         #self.plot_config(plot_orange_if_possible=False, first_map=True)
@@ -533,9 +835,6 @@ class App():
     def set_marker_color(self, attr, old, new):
         #  change the initial color for the picker without changing the color of the last plotted markers
         # self.keep_color_marker = True # Forcing not triggering the content of the on_change function linked to the picker
-        # NOTE Ideally the picker should only change the color, not refresh all the points,
-        # (only change the color glyph of the right glyph, but to do so one need to store/find back the name/id of the glyph) 
-        # FIXME
         # in practice the GUI behavior is not the same if called
         # after using "first new test" (change color for next flagged values)
         #  or after "combine" (change color for the last flagged point)
@@ -545,23 +844,128 @@ class App():
                 self.colors[self.number_tests-1] = new
             else:
                 self.colors.append(new)
-            self.plot_config(plot_orange_if_possible=True)
-            self.set_root(self.p)
+            # Only the colors are sent to the browser
+            self.update_palette()
 
 
 
     def choose_test_handler(self, attr, old, new):
+        # Keep the result of the previous test shown in live mode
+        self.live_state = None
         name = new
         self.set_ui(name)
         self.panel = list(self.ui.values())
     
     def choose_combine_test_handler(self, attr, old, new):
         self.combine_test = dico_combine_test_ui2code[new]
+        if self.combine_test == "expression" and len(self.flag_columns) > 0:
+            self.show_expression()
+
+    def choose_expression_handler(self, attr, old, new):
+        self.flag_expression = new
+        if self.combine_test == "expression" and len(self.flag_columns) > 0:
+            self.show_expression()
+
+    def get_expression_title(self) -> str:
+        names = self.flag_columns.names
+        if len(names) == 0:
+            return "Flag expression (no tests applied yet)"
+        return "Flag expression (tests: %s)" % ", ".join(names)
+
+    def show_expression(self):
+        """Shows the observations flagged by the flag expression, without running any test"""
+        expression = self.flag_expression.strip()
+        if expression == "":
+            # Flagged by any test
+            expression = " | ".join(self.flag_columns.names)
+        try:
+            flagged = self.flag_columns.evaluate(expression)
+        except ValueError as e:
+            self.ui["stations"].value = f"Invalid expression: {e}"
+            return
+        n = len(flagged)
+        num_flagged = np.sum(flagged)
+        # The flags of the tests are left as they are, so that the other combinations can still use them
+        self.data['expression'] = flagged
+        self.shown_expression = expression
+        self.ui["stations"].value = "%d | %d (%.2f %%) | NA | NA" % (n, num_flagged, 100.0 * num_flagged / max(n, 1))
+        if num_flagged < n:
+            self.ui["mean"].value = "%.1f" % (np.nanmean(self.data['values'][~flagged]))
+        else:
+            self.ui["mean"].value = "No valid value left"
+        self.plot_config(plot_orange_if_possible=False, first_map=False)
+        self.set_root(self.p)
 
     def button_apply_click(self, attr):
+        if self.live_state is not None:
+            # Apply the test in place of the one shown in live mode
+            self.set_state(self.live_state)
+            self.live_state = None
         self.ui["apply_button"].button_type = "warning"
         self.ui["apply_button"].label = "Busy"
-        self.doc.add_next_tick_callback(self.apply_test)
+        if self.executor is None:
+            self.doc.add_next_tick_callback(self.apply_test)
+        else:
+            self.start_test()
+
+    def button_cancel_click(self, attr):
+        self.cancel_test()
+        self.ui["time"].value = "Cancelled"
+        self.set_apply_button()
+
+    def choose_live_handler(self, attr, old, new):
+        self.live = new
+        if not new:
+            # Keep the result shown in live mode
+            self.live_state = None
+
+    # Time to wait for more parameter changes before a live run [ms]
+    LIVE_DELAY = 300
+
+    def parameter_changed(self, attr, old, new):
+        """Runs the test when a parameter changes in live mode, once the parameters stop changing"""
+        if not self.live:
+            return
+        # The time until the map is updated is measured from the last change
+        self.live_event_time = time.time()
+        if self.live_callback is not None:
+            self.doc.remove_timeout_callback(self.live_callback)
+        self.live_callback = self.doc.add_timeout_callback(self.live_apply, self.LIVE_DELAY)
+
+    def live_apply(self):
+        self.live_callback = None
+        # Each live run replaces the previous one, rather than being combined with it
+        if self.live_state is None:
+            self.live_state = self.get_state()
+        else:
+            self.set_state(self.live_state)
+        self.ui["apply_button"].button_type = "warning"
+        self.ui["apply_button"].label = "Busy"
+        if self.executor is None:
+            self.apply_test(live=True)
+        else:
+            self.start_test(live=True)
+
+    def get_state(self) -> dict:
+        """Returns a copy of the results of the tests applied so far"""
+        return {"data": {key: np.copy(value) for key, value in self.data.items()},
+                "number_tests": self.number_tests,
+                "old_flags": self.old_flags,
+                "old_Is": getattr(self, "old_Is", None),
+                "dico_test_code2type": dict(self.dico_test_code2type),
+                "combine_test": self.combine_test,
+                "flag_columns": self.flag_columns.copy(),
+                "shown_expression": self.shown_expression}
+
+    def set_state(self, state: dict):
+        self.data = {key: np.copy(value) for key, value in state["data"].items()}
+        self.number_tests = state["number_tests"]
+        self.old_flags = state["old_flags"]
+        self.old_Is = state["old_Is"]
+        self.dico_test_code2type = dict(state["dico_test_code2type"])
+        self.combine_test = state["combine_test"]
+        self.flag_columns = state["flag_columns"].copy()
+        self.shown_expression = state["shown_expression"]
 
     def set_apply_button(self):
         label_button = "Apply test"
@@ -573,48 +977,337 @@ class App():
         else:
             self.ui[button_ui_name].label = label_button
             self.ui[button_ui_name].button_type = "success"
+        if self.executor is not None:
+            if "cancel_button" not in self.ui:
+                button = Button(button_type="danger", label="Cancel")
+                button.on_click(self.button_cancel_click)
+                self.ui["cancel_button"] = button
+            self.ui["cancel_button"].disabled = True
+            self.ui["combine_test"].disabled = False
+
+    # Maximum number of values in a sweep
+    MAX_SWEEP_VALUES = 50
+
+    def set_sweep_ui(self):
+        """Adds the widgets for running the test for a range of values of one parameter"""
+        self.cancel_sweep()
+        keys = [key for key, widget in self.ui.items() if isinstance(widget, Slider) and key != "frac"]
+        dropdown = Select(title="Sweep parameter", options=keys, value=keys[0])
+        dropdown.on_change("value", self.choose_sweep_parameter_handler)
+        self.ui["sweep_parameter"] = dropdown
+        self.ui["sweep_range"] = TextInput(title="Sweep values: start, end, step", value=self.get_sweep_range(keys[0]))
+        button = Button(button_type="primary", label="Sweep")
+        button.on_click(self.button_sweep_click)
+        self.ui["sweep_button"] = button
+
+        self.sweep_source = ColumnDataSource({"value": [], "flagged": [], "mean": []})
+        plot = figure(title="Sweep", tools="tap", height=300, width=350, x_axis_label=keys[0], y_axis_label="Flagged [%]")
+        flagged = [plot.line("value", "flagged", source=self.sweep_source, color="red"),
+                   plot.circle("value", "flagged", source=self.sweep_source, color="red", size=8)]
+        plot.yaxis.axis_label_text_color = "red"
+        # The average of the retained values, like the "Average observed" field, on a separate axis
+        plot.extra_y_ranges = {"mean": DataRange1d()}
+        mean = [plot.line("value", "mean", source=self.sweep_source, color="navy", y_range_name="mean"),
+                plot.circle("value", "mean", source=self.sweep_source, color="navy", size=8, y_range_name="mean")]
+        plot.add_layout(LinearAxis(y_range_name="mean", axis_label="Average retained [%s]" % self.units,
+                                   axis_label_text_color="navy"), "right")
+        plot.y_range.renderers = flagged
+        plot.extra_y_ranges["mean"].renderers = mean
+        # Clicking on a point shows its result on the map
+        self.sweep_source.selected.on_change("indices", self.choose_sweep_point_handler)
+        self.ui["sweep_plot"] = plot
+
+    def get_sweep_range(self, key: str) -> str:
+        """Returns the default sweep of a parameter: about 10 steps over its slider"""
+        slider = self.ui[key]
+        step = max(1, round((slider.end - slider.start) / 10 / slider.step)) * slider.step
+        return "%g, %g, %g" % (slider.start, slider.end, step)
+
+    def choose_sweep_parameter_handler(self, attr, old, new):
+        self.ui["sweep_range"].value = self.get_sweep_range(new)
+
+    def button_sweep_click(self, attr):
+        """Runs the test for each value of the sweep, in parallel on the executor"""
+        plot = self.ui["sweep_plot"]
+        key = self.ui["sweep_parameter"].value
+        try:
+            start, end, step = [float(value) for value in self.ui["sweep_range"].value.split(",")]
+            values = titantuner.engine.get_sweep_values(start, end, step, self.MAX_SWEEP_VALUES)
+        except ValueError as e:
+            plot.title.text = f"Invalid sweep: {e}"
+            return
+        job = self.create_job()
+        if len(job.Is) == 0:
+            plot.title.text = "No stations to test"
+            return
+        self.cancel_sweep()
+        sweep = Sweep(job, key, values)
+        self.sweep = sweep
+        plot.xaxis.axis_label = key
+        self.sweep_source.selected.indices = []
+
+        # Values run before come from the result cache
+        missing = list()
+        for value in values:
+            params = dict(job.params)
+            params[key] = value
+            result = None
+            if self.results is not None:
+                result = self.results.get(titantuner.engine.ResultCache.get_key(job.test, self.dataset, params, job.Itested, job.num_tiles))
+            if result is None:
+                missing += [value]
+            else:
+                sweep.results[value] = result
+        self.show_sweep(sweep)
 
-    def apply_test(self):
-        if self.combine_test == "single":
-            self.number_tests = 0
-
-        self.dico_test_code2type[self.number_tests] = self.ui_type
-        if (self.number_tests >0 and self.combine_test == "chain"):
-            # change the initial color for the picker without changing the color of the last plotted markers
-            self.keep_color_marker = True # Forcing not triggering the content of the on_change function linked to the picker
-            self.picker.color = self.colors[np.mod(self.number_tests, len(self.colors))]
-        self.keep_color_marker = False
-
-        print(f"Number of test combined: {self.number_tests} "\
-              f"combination chosen: {dico_combine_test_code2ui[self.combine_test]}, test type: {self.ui_type}, color {self.marker_color}")
+        # Only send the tested observations to the workers
+        dataset = self.dataset.subset(job.Itested)
+        if self.executor is None:
+            self.doc.add_next_tick_callback(lambda: self.run_sweep(sweep, dataset, missing))
+            return
+        # The values are run like a test with the same parameters would be, so that they share its results
+        for params, future in titantuner.engine.submit_sweep(self.executor, job.test, dataset, job.params, key, missing, job.num_tiles):
+            sweep.futures += [future]
+            future.add_done_callback(lambda future, params=params:
+                                     self.doc.add_next_tick_callback(lambda: self.on_sweep_run_done(sweep, params, future)))
+
+    def run_sweep(self, sweep: Sweep, dataset, values: list):
+        """Runs the sweep in the server process, one value per tick so that the plot shows the progress"""
+        if sweep is not self.sweep or len(values) == 0:
+            return
+        params = dict(sweep.job.params)
+        params[sweep.key] = values[0]
+        self.add_sweep_result(sweep, params, titantuner.engine.run(sweep.job.test, dataset, params))
+        self.doc.add_next_tick_callback(lambda: self.run_sweep(sweep, dataset, values[1:]))
 
-        s_time = time.time()
+    def on_sweep_run_done(self, sweep: Sweep, params: dict, future):
+        if sweep is not self.sweep or future.cancelled():
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Test {sweep.job.test} with {sweep.key}={params[sweep.key]} failed: {e}")
+            return
+        self.add_sweep_result(sweep, params, result)
+
+    def add_sweep_result(self, sweep: Sweep, params: dict, result):
+        sweep.results[params[sweep.key]] = result
+        titantuner.metrics.registry.record("sweep", sum(result.timings.values()), result.timings)
+        if self.results is not None:
+            key = titantuner.engine.ResultCache.get_key(sweep.job.test, self.dataset, params, sweep.job.Itested, sweep.job.num_tiles)
+            self.results.put(key, result)
+        self.show_sweep(sweep)
+
+    def show_sweep(self, sweep: Sweep):
+        values = sorted(sweep.results.keys())
+        summaries = [titantuner.engine.summarize(sweep.results[value]) for value in values]
+        self.sweep_source.data = {"value": values,
+                                  "flagged": [flagged for flagged, _ in summaries],
+                                  "mean": [mean for _, mean in summaries]}
+        plot = self.ui["sweep_plot"]
+        if len(values) < len(sweep.values):
+            plot.title.text = "Sweep of %s: %d of %d done (%.0f s)" % (sweep.key, len(values), len(sweep.values), time.time() - sweep.job.start_time)
+        else:
+            plot.title.text = "Sweep of %s: click on a value to show it" % sweep.key
 
+    def choose_sweep_point_handler(self, attr, old, new):
+        """Shows the result of the selected value of the sweep on the map"""
+        if len(new) == 0 or self.sweep is None:
+            return
+        value = self.sweep_source.data["value"][new[0]]
+        # Setting the slider would otherwise start a live run
+        live = self.live
+        self.live = False
+        self.ui[self.sweep.key].value = value
+        self.live = live
+        # The result is found by lookup_result, unless the selection has changed since the sweep
+        self.button_apply_click(None)
+
+    def cancel_sweep(self):
+        if self.sweep is not None:
+            self.sweep.cancel()
+            self.sweep = None
+
+    def apply_test(self, live=False):
+        """Runs the selected test and shows the result"""
+        job = self.create_job(live)
+        with job.timings:
+            result = None
+            if len(job.Is) > 0:
+                result = self.lookup_result(job)
+                if result is None:
+                    result = titantuner.engine.run(job.test, self.dataset, job.params, job.Itested)
+                    job.timings.add(result.timings)
+                    self.store_result(job, result)
+            self.finish_test(job, result)
+
+    def start_test(self, live=False):
+        """Runs the selected test in a worker process, and shows the result when it is done
+
+        A test that is already running is cancelled.
+        """
+        self.cancel_test()
+        job = self.create_job(live)
+        with job.timings:
+            if len(job.Is) == 0:
+                self.finish_test(job, None)
+                return
+            result = self.lookup_result(job)
+            if result is not None:
+                self.finish_test(job, result)
+                return
+
+            # Only send the tested observations to the worker
+            with job.timings.stage("submit"):
+                if job.num_tiles > 1:
+                    job.future = titantuner.engine.submit_tiled(self.executor, job.test, self.dataset.subset(job.Itested), job.params, job.num_tiles)
+                else:
+                    job.future = self.executor.submit(titantuner.engine.run, job.test, self.dataset.subset(job.Itested), job.params)
+        job.submit_time = time.time()
+        self.job = job
+        # The callback is called in another thread, and the document may only be modified by its own
+        # event loop
+        job.future.add_done_callback(lambda future: self.doc.add_next_tick_callback(lambda: self.on_job_done(job)))
+        self.ui["cancel_button"].disabled = False
+        # The combination cannot change while the test runs, since the tested observations depend on it
+        self.ui["combine_test"].disabled = True
+        self.progress_callback = self.doc.add_periodic_callback(self.show_progress, 500)
+
+    def show_progress(self):
+        if self.job is not None:
+            self.ui["time"].value = "Running (%.0f s)" % (time.time() - self.job.start_time)
+
+    def on_job_done(self, job):
+        if job is not self.job:
+            # The job has been cancelled or replaced by a newer one
+            return
+        self.stop_progress()
+        try:
+            result = job.future.result()
+        except Exception as e:
+            print(f"Test {job.test} failed: {e}")
+            titantuner.metrics.registry.increment("tests_failed")
+            self.ui["time"].value = "Failed"
+            self.set_apply_button()
+            return
+        # Time spent waiting for a worker and sending the data, in addition to the stages of the run
+        job.timings.add(result.timings)
+        job.timings.add({"workers": max(0, time.time() - job.submit_time - sum(result.timings.values()))})
+        with job.timings:
+            self.store_result(job, result)
+            self.finish_test(job, result)
+
+    def lookup_result(self, job: TestJob):
+        """Returns the cached result of job, or None if it has to run"""
+        if self.sweep is not None:
+            # E.g. a point of the sweep plot was clicked
+            result = self.sweep.lookup(job)
+            if result is not None:
+                job.cached = True
+                return result
+        if self.results is None:
+            return None
+        with titantuner.metrics.stage("cache"):
+            job.key = titantuner.engine.ResultCache.get_key(job.test, self.dataset, job.params, job.Itested, job.num_tiles)
+            result = self.results.get(job.key)
+        job.cached = result is not None
+        self.ui["cache"].value = "%d | %d (%.0f %%)" % (self.results.hits, self.results.misses, 100 * self.results.hit_rate)
+        return result
+
+    def store_result(self, job: TestJob, result):
+        if self.results is not None:
+            with titantuner.metrics.stage("cache"):
+                self.results.put(job.key, result)
+
+    def cancel_test(self):
+        """Cancels the running test, if any
+
+        Titanlib cannot be interrupted, so a test that has already started runs to completion in its
+        worker, but its result is dropped.
+        """
+        if self.job is None:
+            return
+        self.job.future.cancel()
+        titantuner.metrics.registry.increment("tests_cancelled")
+        self.stop_progress()
+
+    def stop_progress(self):
+        self.job = None
+        if self.progress_callback is not None:
+            self.doc.remove_periodic_callback(self.progress_callback)
+            self.progress_callback = None
+
+    def create_job(self, live=False):
+        """Returns the selected test, parameters and observations, without changing the state of the app"""
         self.last_latrange = self.ui["latrange"].value
         self.last_lonrange = self.ui["lonrange"].value
-        yy = self.lat2y(self.lats)
-        xx = self.lon2x(self.lons)
-        if(not len(xx)>0):
+        if len(self.lats) == 0:
             self.set_apply_button()
             raise ValueError("Please select a valid dataset!")
-        values_to_test = self.values
 
-        frac = self.ui["frac"].value
-        if len(self.lats) == 0:
-            Ifrac = []
+        timings = titantuner.metrics.Timings()
+        with timings:
+            Iall_tests = self.get_selection(tuple(self.ui["latrange"].value), tuple(self.ui["lonrange"].value), self.ui["frac"].value)
+
+        number_tests = 0 if self.combine_test == "single" else self.number_tests
+        # The data is reinitialized by the first test, and when the selection of stations has changed
+        reset = number_tests == 0 or len(Iall_tests) != len(self.data['x'])
+        if reset or self.combine_test == "expression":
+            Is = np.array(range(len(Iall_tests)))
+        elif self.combine_test == "chain":
+            Is = np.where(self.data['test_code']==-99)[0]
+            # DEBUG # print(f"start, chained on indexes", Is)
+        else:
+            Is = self.old_Is
+        job = TestJob(self.ui_type, self.get_params(), Iall_tests, Is, reset)
+        job.timings = timings
+        job.live = live
+        if self.executor is not None and job.test in titantuner.engine.tiled_tests:
+            job.num_tiles = self.num_tiles
+        if live and self.live_event_time is not None:
+            job.event_time = self.live_event_time
         else:
+            job.event_time = job.start_time
+        return job
+
+    @titantuner.metrics.timed("selection")
+    def get_selection(self, latrange: tuple, lonrange: tuple, frac: float) -> np.ndarray:
+        """Returns the indices of the observations within latrange and lonrange, in a random fraction (in %)
+        of the dataset. The selection is computed once for each set of arguments."""
+        key = (latrange, lonrange, frac)
+        Iall_tests = self.selections.get(key)
+        if Iall_tests is None:
             if frac == 100:
                 Ifrac = np.array(range(len(self.lats)))
             else:
                 np.random.seed(0)
                 Ifrac = np.random.randint(0, len(self.lats), int(frac / 100 * len(self.lats)))
 
-        # if self.latrange is not None and self.lonrange is not None:
+            Icoord = np.where((self.lats > latrange[0]) & (self.lats < latrange[1]) & (self.lons > lonrange[0]) & (self.lons < lonrange[1]))[0]
+            Iall_tests = np.intersect1d(Ifrac, Icoord)
+            self.selections.put(key, Iall_tests)
+        return Iall_tests
 
-        Icoord = np.where((self.lats > self.ui["latrange"].value[0]) & (self.lats < self.ui["latrange"].value[1]) & (self.lons > self.ui["lonrange"].value[0]) & (self.lons < self.ui["lonrange"].value[1]))[0]
-        Iall_tests = np.intersect1d(Ifrac, Icoord)
-        if self.number_tests == 0 or len(Iall_tests) != len(self.data['x']):
-            if len(Iall_tests) != len(self.data['x']) and self.combine_test != "single":
+    def finish_test(self, job, result):
+        """Combines the result of a test with the previous ones, and shows it"""
+        if self.combine_test == "single":
+            self.number_tests = 0
+
+        self.dico_test_code2type[self.number_tests] = job.test
+        if (self.number_tests >0 and self.combine_test == "chain"):
+            # change the initial color for the picker without changing the color of the last plotted markers
+            self.keep_color_marker = True # Forcing not triggering the content of the on_change function linked to the picker
+            self.picker.color = self.colors[np.mod(self.number_tests, len(self.colors))]
+        self.keep_color_marker = False
+
+        print(f"Number of test combined: {self.number_tests} "\
+              f"combination chosen: {dico_combine_test_code2ui[self.combine_test]}, test type: {job.test}, color {self.marker_color}")
+
+        yy = self.yy
+        xx = self.xx
+        Iall_tests = job.Iall_tests
+        if job.reset:
+            if len(Iall_tests) != len(self.data['x']) and self.combine_test not in ["single", "expression"]:
                 print("Warning: can't combine with previous tests as the lat/lon selection or the fraction of data is not similar to those used in the previous tests")
                 print('Change test type to', {dico_combine_test_code2ui["single"]})
                 self.combine_test = "single"
@@ -627,312 +1320,101 @@ class App():
             self.data['flagged_least1'] = np.full(n_data, False)
             self.data['flagged_new'] = np.full(n_data, False)
             self.data['unflagged_new'] = np.full(n_data, False)
-            self.data['values'] = values_to_test[Iall_tests]
-            self.data['labels'] = values_to_test[Iall_tests].astype(str)
+            self.data['expression'] = np.full(n_data, False)
+            self.data['values'] = self.values[Iall_tests]
+            self.data['labels'] = self.get_dataset_labels(("Obs",))[Iall_tests]
+            # The flags of the previous tests are kept as long as they are for the same observations
+            if not self.flag_columns.has_selection(Iall_tests):
+                self.flag_columns = titantuner.flags.FlagTable(n_data, Iall_tests)
            # self.old_flags = None
 
-        if self.combine_test == "chain":
-            Is = np.where(self.data['test_code']==-99)[0]
-            # DEBUG # print(f"start, chained on indexes", Is)
-        else:
-            if self.number_tests == 0:
-                Is = np.array(range(len(Iall_tests)))
-            else:   
-                Is = self.old_Is
-           # if test combined with the result of all previous tests
-           # Is = np.array(range(len(Iall_tests)))
-            #print(f"start test on indexes", Is)
-
+        Is = job.Is
         if len(Is) == 0:
             self.set_apply_button()
             return
 
-        is_obs_to_check = np.ones(len(Is))
-        yy_Is = yy[Iall_tests][Is]
-        xx_Is = xx[Iall_tests][Is]
-        elevs_Is = self.elevs[Iall_tests][Is]
-        values_to_test_Is = values_to_test[Iall_tests][Is]
-        points = titanlib.Points(self.lats[Iall_tests][Is], self.lons[Iall_tests][Is], elevs_Is)
-
-        #----------------------------------------------------------------------
-        if self.ui_type == "sct":
-            nmin = self.ui["nmin"].value
-            nmax = self.ui["nmax"].value
-            inner_radius = self.ui["inner_radius"].value
-            outer_radius = self.ui["outer_radius"].value
-            niterations = self.ui["niterations"].value
-            nminprof = self.ui["nminprof"].value
-            t2pos = self.ui["t2pos"].value
-            t2neg = self.ui["t2neg"].value
-            eps2 = self.ui["eps2"].value
-            dhmin = self.ui["dhmin"].value
-            dzmin = self.ui["dzmin"].value
-            dz = self.ui["dz"].value
-            if "BoxCoxPower" in self.ui and self.ui["BoxCoxPower"].value >= 0:
-                    values_to_test_Is = apply_PowerTransform(values_to_test_Is, self.ui["BoxCoxPower"].value, self.ui["BoxCoxScaling"].value)
-            # flags = titanlib.range_check(self.values, [new[0]], [new[1]])
-            # flags = titanlib.range_check_climatology(self.lats[Is], self.lons[Is], elevs_Is, self.data['values'][Is], 1577836800, [new[1]], [new[0]])
-
-            flags, sct, rep = titanlib.sct(points, values_to_test_Is, nmin, nmax, inner_radius,
-                    outer_radius, niterations, nminprof,
-                    dzmin, dhmin, dz, t2pos * np.ones(len(Is)), t2neg * np.ones(len(Is)),
-                    eps2 * np.ones(len(Is)))
-
-            sct = np.array(sct)
-            self.add_labels(Is, self.data['values'][Is], values_to_test_Is, sct, xx_Is, yy_Is, elevs_Is)
-
-        #----------------------------------------------------------------------
-        if self.ui_type == "sctres":
-            nmin = self.ui["nmin"].value
-            nmax = self.ui["nmax"].value
-            inner_radius = self.ui["inner_radius"].value
-            outer_radius = self.ui["outer_radius"].value
-            niterations = self.ui["niterations"].value
-            nminprof = self.ui["nminprof"].value
-            t2pos = self.ui["t2pos"].value
-            t2neg = self.ui["t2neg"].value
-            eps2 = self.ui["eps2"].value
-            dhmin = self.ui["dhmin"].value
-            dhmax = self.ui["dhmax"].value
-            kth = self.ui["kth"].value
-            dzmin = self.ui["dzmin"].value
-            dz = self.ui["dz"].value
-
-            values_mina, values_maxa = self.initialize_val_minmax("a_delta", Is)
-            values_minv, values_maxv = self.initialize_val_minmax("v_delta", Is)
-
-            if "BoxCoxPower" in self.ui and self.ui["BoxCoxPower"].value >= 0:
-                boxcox_power = self.ui["BoxCoxPower"].value
-                boxcox_scaling = self.ui["BoxCoxScaling"].value
-                values_to_test_Is = apply_PowerTransform(values_to_test_Is, boxcox_power, boxcox_scaling)
-                values_mina, values_maxa = self.calculate_val_minmax(values_mina, values_maxa, "a_delta", "a_fact", Is, boxcox_power, boxcox_scaling)
-                values_minv, values_maxv = self.calculate_val_minmax(values_minv, values_maxv, "v_delta", "v_fact", Is, boxcox_power, boxcox_scaling)
-                values_to_test_Is = apply_PowerTransform(values_to_test_Is, boxcox_power, boxcox_scaling)
-
-            if self.ui["basic"].active == 0:
-                basic=True
-            elif self.ui["basic"].active == 1:
-                basic=False
-
-            background_values = np.ones(len(Is))
-            debug=False
-
-            if self.ui["background_elab"].active == 0:
-                background_elab=titanlib.VerticalProfile
-            if self.ui["background_elab"].active == 1:
-                background_elab=titanlib.VerticalProfileTheilSen
-            if self.ui["background_elab"].active == 2:
-                background_elab=titanlib.MeanOuterCircle
-            if self.ui["background_elab"].active == 3:
-                background_elab=titanlib.MedianOuterCircle
- 
-            # flags = titanlib.range_check(self.values, [new[0]], [new[1]])
-            # flags = titanlib.range_check_climatology(self.lats[Is], self.lons[Is], elevs_Is, self.data['values'][Is], 1577836800, [new[1]], [new[0]])
-
-            print("SCT res shape", values_to_test_Is.shape, points.get_lats().shape, len(Is), Is,  np.ones(len(Is)).shape)
-            flags, sct = titanlib.sct_resistant(points, values_to_test_Is, 
-                    is_obs_to_check, background_values, background_elab,
-                    nmin, nmax, inner_radius,
-                    outer_radius, niterations, nminprof,
-                    dzmin, dhmin, dhmax, kth, dz,
-                    values_mina, values_maxa, values_minv, values_maxv,
-                    eps2 * np.ones(len(Is)),
-                    t2pos * np.ones(len(Is)), t2neg * np.ones(len(Is)),
-                    debug, basic )
-
-            sct = np.array(sct)
-            self.add_labels(Is, self.data['values'][Is], values_to_test_Is, sct, xx_Is, yy_Is, elevs_Is)
-
-        #----------------------------------------------------------------------
-        if self.ui_type == "sctdual":
-            nmin = self.ui["nmin"].value
-            nmax = self.ui["nmax"].value
-            inner_radius = self.ui["inner_radius"].value
-            outer_radius = self.ui["outer_radius"].value
-            niterations = self.ui["niterations"].value
-            dhmin = self.ui["dhmin"].value
-            dhmax = self.ui["dhmax"].value
-            kth = self.ui["kth"].value
-            dz = self.ui["dz"].value
-            t_event = self.ui["t_event"].value
-            t_test = self.ui["t_test"].value
-
-            if self.ui["t_condition"].active == 0:
-                t_condition=titanlib.Eq
-            if self.ui["t_condition"].active == 1:
-                t_condition=titanlib.Gt
-            if self.ui["t_condition"].active == 2:
-                t_condition=titanlib.Geq
-            if self.ui["t_condition"].active == 3:
-                t_condition=titanlib.Lt
-            if self.ui["t_condition"].active == 4:
-                t_condition=titanlib.Leq
-
-            debug=False
-            if "BoxCoxPower" in self.ui and self.ui["BoxCoxPower"].value >= 0:
-                values_to_test_Is = apply_PowerTransform(values_to_test_Is, self.ui["BoxCoxPower"].value, self.ui["BoxCoxScaling"].value)
-
-            flags = titanlib.sct_dual(points, values_to_test_Is,
-                    is_obs_to_check, t_event* np.ones(len(Is)), t_condition,
-                    nmin, nmax, inner_radius,
-                    outer_radius, niterations,
-                    dhmin, dhmax, kth, dz,
-                    t_test * np.ones(len(Is)),
-                    debug )
-            self.add_labels(Is, self.data['values'][Is], values_to_test_Is, [], xx_Is, yy_Is, elevs_Is)
-
-        #----------------------------------------------------------------------
-        if self.ui_type == "fgt":
-            nmin = self.ui["nmin"].value
-            nmax = self.ui["nmax"].value
-            inner_radius = self.ui["inner_radius"].value
-            outer_radius = self.ui["outer_radius"].value
-            niterations = self.ui["niterations"].value
-            nminprof = self.ui["nminprof"].value
-            tpos = self.ui["tpos"].value
-            tneg = self.ui["tneg"].value
-            dzmin = self.ui["dzmin"].value
-            values_mina, values_maxa = self.initialize_val_minmax("a_delta", Is)
-            values_minv, values_maxv = self.initialize_val_minmax("v_delta", Is)
-            
-            if "BoxCoxPower" in self.ui and self.ui["BoxCoxPower"].value >= 0:
-                boxcox_power = self.ui["BoxCoxPower"].value
-                boxcox_scaling = self.ui["BoxCoxPower"].scaling
-                values_to_test_Is = apply_PowerTransform(values_to_test_Is,  boxcox_power, boxcox_scaling)
-                values_mina, values_maxa = self.calculate_val_minmax(values_mina, values_maxa, "a_delta", "a_fact", Is, boxcox_power, boxcox_scaling)
-                values_minv, values_maxv = self.calculate_val_minmax(values_minv, values_maxv, "v_delta", "v_fact", Is, boxcox_power, boxcox_scaling)
-                values_to_test_Is = apply_PowerTransform(values_to_test_Is, boxcox_power, boxcox_scaling)
-
-            if self.ui["basic"].active == 0:
-                basic=True
-            elif self.ui["basic"].active == 1:
-                basic=False
-
-            background_values = np.ones(len(Is))
-            background_uncertainties = np.ones(len(Is))
-            debug=False
-
-            if self.ui["background_elab"].active == 0:
-                background_elab=titanlib.VerticalProfile
-            if self.ui["background_elab"].active == 1:
-                background_elab=titanlib.VerticalProfileTheilSen
-            if self.ui["background_elab"].active == 2:
-                background_elab=titanlib.MeanOuterCircle
-            if self.ui["background_elab"].active == 3:
-                background_elab=titanlib.MedianOuterCircle
- 
-            flags, sct = titanlib.fgt(points, values_to_test_Is, 
-                    is_obs_to_check, background_values, 
-                    background_uncertainties, background_elab,
-                    nmin, nmax, inner_radius,
-                    outer_radius, niterations, nminprof, dzmin, 
-                    values_mina, values_maxa, values_minv, values_maxv,
-                    tpos * np.ones(len(Is)), tneg * np.ones(len(Is)),
-                    debug, basic)
-
-            sct = np.array(sct)
-            self.add_labels(Is, self.data['values'][Is], values_to_test_Is, sct, xx_Is, yy_Is, elevs_Is)
-
-        #----------------------------------------------------------------------
-        elif self.ui_type == "isolation":
-            flags = titanlib.isolation_check(points, int(self.ui["num"].value), float(self.ui["radius"].value * 1000))
-            self.add_labels(Is, self.data['values'][Is], [], [], xx_Is, yy_Is, elevs_Is)
-
-        #----------------------------------------------------------------------
-        elif self.ui_type == "buddy":
-            if "BoxCoxPower" in self.ui and self.ui["BoxCoxPower"].value >= 0:
-                values_to_test_Is = apply_PowerTransform(values_to_test_Is, self.ui["BoxCoxPower"].value, self.ui["BoxCoxScaling"].value)
-            flags = titanlib.buddy_check(points, values_to_test_Is,
-                    [self.ui["distance"].value], [self.ui["num"].value],
-                    self.ui["threshold"].value, self.ui["elev_range"].value,
-                    self.ui["elev_gradient"].value / 1000, self.ui["min_std"].value,
-                    self.ui["num_iterations"].value)
-            self.add_labels(Is, self.data['values'][Is], values_to_test_Is, [], xx_Is, yy_Is, elevs_Is)
-
-        #----------------------------------------------------------------------
-        elif self.ui_type == "buddy_event":
-            if "BoxCoxPower" in self.ui and self.ui["BoxCoxPower"].value >= 0:
-                values_to_test_Is = apply_PowerTransform(values_to_test_Is, self.ui["BoxCoxPower"].value, self.ui["BoxCoxScaling"].value)
-            flags = titanlib.buddy_event_check(points, values_to_test_Is,
-                    [self.ui["distance"].value], [self.ui["num"].value],
-                    self.ui["event_threshold"].value,
-                    self.ui["threshold"].value, self.ui["elev_range"].value,
-                    self.ui["elev_gradient"].value / 1000,
-                    self.ui["num_iterations"].value)
-            self.add_labels(Is, self.data['values'][Is], values_to_test_Is, [], xx_Is, yy_Is, elevs_Is)
-        #----------------------------------------------------------------------
-        elif self.ui_type is None:
-            flags = np.zeros(len(Is))
+        Itested = job.Itested
+        flags = result.flags
+        values_to_test_Is = result.values
+        sct = [] if result.sct is None else result.sct
+        self.add_labels(Is, Itested, values_to_test_Is, sct)
 
         e_time = time.time()
-        self.ui["time"].value = "%f" % (e_time- s_time)
-        flags = np.array(flags)
-
-        for t in range(len(flags)):
-          if flags[t] != 0 and flags[t] != 1:
-              flags[t] = 0
+        self.ui["time"].value = "%f" % (e_time - job.start_time)
+        if job.cached:
+            self.ui["time"].value += " (cached)"
 
         I0 = np.where(flags == 0)[0]
         I1 = np.where(flags == 1)[0]
 
-        #y0, x0 = np.histogram(self.values[Is[I0]], bins=self.edges)
-        if self.combine_test !="chain" and self.old_flags is not None and (flags.shape != self.old_flags.shape):
-            print(f"CAUTION here is old flag reinitialized to None, flags and old flags don't have the same size")
-            if self.old_flags is not None:
-                print(flags.shape, self.old_flags.shape)
-            self.old_flags = None
-        if self.old_flags is None or self.combine_test =="chain":
-            if(self.old_flags is None):
-                self.ui["stations"].value = "%d | %d (%.2f %%) | NA | NA" % (len(Is), len(I1), 100.0 * len(I1) / len(Is))
-            elif self.combine_test =="chain":
-                # CAUTION: at this stage test_code is not yet updated with the last new values
-                Iflagged_all_tests = np.where(self.data['test_code'] != -99)[0]
-                self.ui["stations"].value = "%d | %d (%.2f %%) | %d | 0" % (len(Iall_tests), len(Iflagged_all_tests) + len(I1),
-                                                                             100.0 * (len(Iflagged_all_tests) + len(I1)) / len(Is), (len(I1)))
-            self.data['flagged_new'][I1] = np.full(len(I1), True)
+        name = self.flag_columns.add(job.test, flags == 1, Is)
+        print(f"Flags of the test are in column {name}")
+        self.ui["expression"].title = self.get_expression_title()
+        if self.combine_test == "expression":
+            # The stations are flagged by the first test that flags them, as in a chain of tests
+            Inew = Is[I1][self.data['test_code'][Is[I1]] == -99]
+            self.data['test_code'][Inew] = self.number_tests
+            self.data['flagged_least1'][Is[I1]] = True
+            self.show_expression()
         else:
-            # flag = 1 -> not OK
-            # flag = 0 -> OK or unconclusive test
-            if self.combine_test == "combineOK_if_1_OK":
-               # keep data if it passes one of the tests 
-               # OK1 or OK2 -> OK
-               flags = (~((flags==0) | (self.old_flags==0))).astype(int)
-            elif self.combine_test == "combineOK_if_both_OK": 
-                # keep data only if none of the tests flag it 
-                # (OK1 and OK2) -> OK
-                flags = (~((flags==0) & (self.old_flags==0))).astype(int)
-            elif self.combine_test == "combineBad_if_1_Bad": 
-               # reject data if flagged by one of the tests, keep the others 
-               # (BAD1 or BAD2) -> BAD
-                print("2nd combined test has flagged ", len(np.where(flags==1)))
-                print("previous test had flagged ", len(np.where(flags==1)))
-                flags = ((flags==1) | (self.old_flags==1)).astype(int)
-                print("After combination, test has flagged: ", len(np.where(flags==1)))
-
-            elif self.combine_test == "combineBad_if_both_Bad":
-                # reject data only if it passes none of the tests
-                # (BAD1 and BAD2) -> BAD
-                flags = ((flags==1) & (self.old_flags==1)).astype(int)
-            I0change = np.where((flags == 0) & (self.old_flags == 1))[0]
-            I1change = np.where((flags == 1) & (self.old_flags == 0))[0]
-            self.data['flagged_new'][Is[I1change]] = np.full(len(I1change), True)
-            self.data['unflagged_new'][Is[I0change]] = np.full(len(I0change), True)
-            I0 = np.where(flags == 0)[0]
-            I1 = np.where(flags == 1)[0]
-            self.ui["stations"].value = "%d | %d (%.2f %%) | %d | %d" % (len(Is), len(I1), 100.0 * len(I1) / len(Is), len(I1change), len(I0change))
+            #y0, x0 = np.histogram(self.values[Is[I0]], bins=self.edges)
+            if self.combine_test !="chain" and self.old_flags is not None and (flags.shape != self.old_flags.shape):
+                print(f"CAUTION here is old flag reinitialized to None, flags and old flags don't have the same size")
+                if self.old_flags is not None:
+                    print(flags.shape, self.old_flags.shape)
+                self.old_flags = None
+            if self.old_flags is None or self.combine_test =="chain":
+                if(self.old_flags is None):
+                    self.ui["stations"].value = "%d | %d (%.2f %%) | NA | NA" % (len(Is), len(I1), 100.0 * len(I1) / len(Is))
+                elif self.combine_test =="chain":
+                    # CAUTION: at this stage test_code is not yet updated with the last new values
+                    Iflagged_all_tests = np.where(self.data['test_code'] != -99)[0]
+                    self.ui["stations"].value = "%d | %d (%.2f %%) | %d | 0" % (len(Iall_tests), len(Iflagged_all_tests) + len(I1),
+                                                                                 100.0 * (len(Iflagged_all_tests) + len(I1)) / len(Is), (len(I1)))
+                self.data['flagged_new'][I1] = np.full(len(I1), True)
+            else:
+                # flag = 1 -> not OK
+                # flag = 0 -> OK or unconclusive test
+                if self.combine_test == "combineOK_if_1_OK":
+                   # keep data if it passes one of the tests 
+                   # OK1 or OK2 -> OK
+                   flags = (~((flags==0) | (self.old_flags==0))).astype(int)
+                elif self.combine_test == "combineOK_if_both_OK": 
+                    # keep data only if none of the tests flag it 
+                    # (OK1 and OK2) -> OK
+                    flags = (~((flags==0) & (self.old_flags==0))).astype(int)
+                elif self.combine_test == "combineBad_if_1_Bad": 
+                   # reject data if flagged by one of the tests, keep the others 
+                   # (BAD1 or BAD2) -> BAD
+                    print("2nd combined test has flagged ", len(np.where(flags==1)))
+                    print("previous test had flagged ", len(np.where(flags==1)))
+                    flags = ((flags==1) | (self.old_flags==1)).astype(int)
+                    print("After combination, test has flagged: ", len(np.where(flags==1)))
+
+                elif self.combine_test == "combineBad_if_both_Bad":
+                    # reject data only if it passes none of the tests
+                    # (BAD1 and BAD2) -> BAD
+                    flags = ((flags==1) & (self.old_flags==1)).astype(int)
+                I0change = np.where((flags == 0) & (self.old_flags == 1))[0]
+                I1change = np.where((flags == 1) & (self.old_flags == 0))[0]
+                self.data['flagged_new'][Is[I1change]] = np.full(len(I1change), True)
+                self.data['unflagged_new'][Is[I0change]] = np.full(len(I0change), True)
+                I0 = np.where(flags == 0)[0]
+                I1 = np.where(flags == 1)[0]
+                self.ui["stations"].value = "%d | %d (%.2f %%) | %d | %d" % (len(Is), len(I1), 100.0 * len(I1) / len(Is), len(I1change), len(I0change))
         
-        Iflagged_all_tests = np.where(self.data['test_code'] != -99)[0]
-        self.data['test_code'][Is[I1]] = np.full(len(I1), self.number_tests)
-        print("Code assigned for the test: ", self.number_tests)
-        Iflagged_all_tests = np.where(self.data['test_code'] != -99)[0]
+            Iflagged_all_tests = np.where(self.data['test_code'] != -99)[0]
+            self.data['test_code'][Is[I1]] = np.full(len(I1), self.number_tests)
+            print("Code assigned for the test: ", self.number_tests)
+            Iflagged_all_tests = np.where(self.data['test_code'] != -99)[0]
 
-        self.data['flagged_least1'][Is[I1]] = np.full(len(I1), True)
-        self.plot_config(plot_orange_if_possible=True, first_map=False)
-        self.set_root(self.p)
-        if len(I0):
-            self.ui["mean"].value = "%.1f" % (np.nanmean(values_to_test_Is[I0]))
-        else:
-            self.ui["mean"].value = "No valid value left"
+            self.data['flagged_least1'][Is[I1]] = np.full(len(I1), True)
+            self.plot_config(plot_orange_if_possible=True, first_map=False)
+            self.set_root(self.p)
+            if len(I0):
+                self.ui["mean"].value = "%.1f" % (np.nanmean(values_to_test_Is[I0]))
+            else:
+                self.ui["mean"].value = "No valid value left"
 
 
         # self.dh.data = {'y': yy_Is, 'x': xx_Is
@@ -950,14 +1432,34 @@ class App():
         self.old_flags = copy.deepcopy(flags)
         self.old_Is = Is
         self.number_tests = self.number_tests + 1
+        if job.live:
+            turnaround = time.time() - job.event_time
+            self.ui["live"].label = "Live update (%.2f s)" % turnaround
+            print(f"Live update shown {turnaround:.2f} s after the parameters changed")
+        self.report_timings(job)
+
+    def report_timings(self, job: TestJob):
+        """Shows, logs and records the time spent in each stage of a test"""
+        elapsed = time.time() - job.start_time
+        # E.g. combining the flags
+        job.timings.add({"other": max(0, elapsed - job.timings.total)})
+        request = "live" if job.live else "apply"
+        titantuner.metrics.registry.record(request, elapsed, job.timings.stages)
+        titantuner.metrics.registry.increment("tests_cached" if job.cached else "tests_run")
+        self.ui["timings"].text = "\n".join("%-10s %8.3f s" % (name, seconds) for name, seconds in job.timings.stages.items())
+        print(f"Timings of {job.test} ({request}, {elapsed:.3f} s): {job.timings}")
         
     def set_dataset(self, index: int, datetime: int):
+        # The result of a running test would not match the new dataset
+        self.cancel_test()
+        self.cancel_sweep()
         unixtime = titantuner.date_to_unixtime(datetime // 100) + datetime % 100 * 3600
         if not len(self.source.keys)>index:
             raise ValueError(f"Cannot set the dataset, source {self.source.keys} does not contain index {index}")
         keys = [self.source.keys[index]]
         index = int(index)
         self.dataset_index = index
+        self.dataset_key = keys[0]
         if self.source.requires_time:
             keys += [unixtime]
 
@@ -966,17 +1468,28 @@ class App():
         Here we just create an empty dataset. Another option would be to remove the dataset from the
         list of available datasets.
         """
+        timings = titantuner.metrics.Timings()
         try:
-            self.dataset = self.source.load(*keys)
+            with timings.stage("source"):
+                self.dataset = self.source.load(*keys)
         except titantuner.InvalidDatasetException as e:
             self.dataset = titantuner.dataset.Dataset("Invalid", [], [], [], [], 0, "")
             print(e)
+        if self.prefetcher is not None:
+            self.prefetcher.prefetch(index, unixtime)
 
         self.old_flags = None
         self.lats = self.dataset.lats
         self.lons = self.dataset.lons
         self.elevs = self.dataset.elevs
         self.values = self.dataset.values
+        # The projection is computed once per dataset, and the selections once per dataset and session
+        with timings.stage("projection"):
+            self.xx = self.dataset.x
+            self.yy = self.dataset.y
+        titantuner.metrics.registry.record("load", timings.total, timings.stages)
+        print(f"Timings of loading {self.dataset_key}: {timings}")
+        self.selections = titantuner.cache.MemoryCache(16, lambda selection: 1)
         self.variable = self.dataset.variable
         if self.variable == "ta":
             self.units = "C"
@@ -996,20 +1509,13 @@ class App():
         if found is not None:
             self.p.renderers[found] = TileRenderer(tile_source=tile_provider)
 
-    def lat2y(self, a):
-        RADIUS = 6378137.0 # in meters on the equator
-        return np.log(np.tan(math.pi / 4 + np.radians(a) / 2)) * RADIUS
-
-    def lon2x(self, a):
-        RADIUS = 6378137.0 # in meters on the equator
-        return np.radians(a) * RADIUS
-    
 dico_combine_test_code2ui = {"single": "Apply test (no combination / first test)",
                                 "chain": "Combine test: further test only unflagged values",
                                 "combineOK_if_1_OK": "Combine: pass if pass this test or previous, reject others", # softer test
                                 "combineOK_if_both_OK": "Combine: pass if pass both this test and previous, reject others", # harder test
                                 "combineBad_if_1_Bad": "Combine: reject if flagged by this test or previous, keep others", # harder test
                                 "combineBad_if_both_Bad": "Combine: reject if flagged both by this test and previous, keep others", # softer test
+                                "expression": "Combine: reject if the flag expression is true",
                             }
 dico_combine_test_ui2code =  {v: k for k, v in dico_combine_test_code2ui.items()}
 
@@ -0,0 +1,176 @@
+"""This module contains caches shared by the data sources and the app"""
+
+import collections
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+
+
+def get_default_cache_dir() -> str:
+    """Returns the directory where titantuner stores cached files by default"""
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "titantuner")
+
+
+class DiskCache:
+    """A directory of cached files, with least-recently-used eviction when the total size exceeds a limit
+
+    Files are named after a hash of their key. The modification time of a file is updated each time it
+    is read, so that the oldest files are the least recently used ones.
+    """
+    def __init__(self, directory: str, max_size: int, suffix: str = ""):
+        """
+        Arguments:
+            directory (str): Where to store the files. Created if it does not exist.
+            max_size (int): Maximum total size of the files [bytes]
+            suffix (str): Filename suffix, e.g. ".npy"
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.suffix = suffix
+        os.makedirs(directory, exist_ok=True)
+
+    def get_filename(self, key) -> str:
+        """Returns the name of the file storing key, whether it exists or not"""
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest + self.suffix)
+
+    def lookup(self, key):
+        """Returns the filename for key if it is in the cache, otherwise None"""
+        filename = self.get_filename(key)
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            return None
+        return filename
+
+    def store(self, key, write) -> str:
+        """Stores an entry in the cache
+
+        Arguments:
+            key: Any key with a stable repr
+            write (callable): Function that writes the entry into the open (binary) file object it is passed
+
+        Returns:
+            str: The filename of the entry
+        """
+        filename = self.get_filename(key)
+        # Write to a temporary file first, so that other processes never read a partial file
+        fd, tempname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                write(file)
+            os.replace(tempname, filename)
+        except BaseException:
+            os.remove(tempname)
+            raise
+        self.evict()
+        return filename
+
+    @property
+    def size(self) -> int:
+        """Total size of the files in the cache [bytes]"""
+        return sum(size for _, size, _ in self._list())
+
+    def evict(self):
+        """Removes the least recently used files until the cache is within its size limit"""
+        entries = self._list()
+        total = sum(size for _, size, _ in entries)
+        for filename, size, _ in sorted(entries, key=lambda e: e[2]):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _list(self) -> list:
+        """Returns (filename, size, mtime) for each file in the cache"""
+        entries = list()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(self.suffix) and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries += [(entry.path, stat.st_size, stat.st_mtime_ns)]
+        return entries
+
+
+class MemoryCache:
+    """An in-memory least-recently-used cache with a limit on the total size of its values
+
+    The cache is thread-safe, and counts hits and misses.
+    """
+    def __init__(self, max_size: int, sizeof=sys.getsizeof):
+        """
+        Arguments:
+            max_size (int): Maximum total size of the values [bytes]
+            sizeof (callable): Function returning the size of a value [bytes]
+        """
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value for key, or default if key is not in the cache"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        """Adds a value to the cache, evicting the least recently used values if needed
+
+        Values larger than the size limit of the cache are not stored.
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def update_size(self, key):
+        """Measures the size of the value of key again (e.g. after it grew), evicting values if needed"""
+        with self._lock:
+            if key not in self._entries:
+                return
+            value, size = self._entries[key]
+            new_size = self.sizeof(value)
+            self._entries[key] = (value, new_size)
+            self.size += new_size - size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups that were hits, or nan if there have been no lookups"""
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else float("nan")
@@ -1,17 +1,224 @@
+import hashlib
 import os
 import sys
 import numpy as np
 
 
+# Radius of the earth used by the web mercator projection of the map [m]
+RADIUS = 6378137.0
+
+def lon2x(lons) -> np.ndarray:
+    """Returns the x coordinates of longitudes in the web mercator projection [m]"""
+    return np.radians(lons) * RADIUS
+
+def lat2y(lats) -> np.ndarray:
+    """Returns the y coordinates of latitudes in the web mercator projection [m]"""
+    return np.log(np.tan(np.pi / 4 + np.radians(lats) / 2)) * RADIUS
+
+
 class Dataset:
-    def __init__(self, name: str, lats: list, lons: list, elevs: list, values: list, unixtime: int, variable: str):
+    """Observations for one variable
+
+    The lats, lons, elevs, and values are stored as the rows of one (4, N) buffer, and the properties
+    return views into it. Subsets therefore only need one gather of the buffer, and a dataset can wrap
+    an existing buffer (e.g. a memory-mapped cache file) without copying it.
+
+    Values derived from the observations, such as their projection, are computed when they are first
+    needed and kept with the dataset (see derived), so that they are shared by all its users.
+    """
+    __slots__ = ["name", "unixtime", "variable", "times", "buffer", "index", "_derived", "_derived_buffer", "_derived_nbytes", "_derived_callback"]
+
+    def __init__(self, name: str, lats: list, lons: list, elevs: list, values: list, unixtime: int, variable: str, times: list = None, dtype=np.float64):
+        """
+        Arguments:
+            dtype: Data type of the buffer. float32 halves the memory use, and is the precision used by
+                titanlib anyway.
+        """
+        buffer = np.empty((4, len(lats)), dtype)
+        buffer[0] = lats
+        buffer[1] = lons
+        buffer[2] = elevs
+        buffer[3] = values
+        self._set(name, buffer, unixtime, variable, times)
+
+    @staticmethod
+    def from_buffer(name: str, buffer: np.ndarray, unixtime: int, variable: str, times: list = None, index: np.ndarray = None):
+        """Creates a dataset using buffer directly (without a copy)
+
+        Arguments:
+            buffer (np.array): Array with shape (4, N) with lats, lons, elevs, and values as rows
+            index (np.array): Indices into the dataset this is a subset of, if any
+        """
+        if buffer.ndim != 2 or buffer.shape[0] != 4:
+            raise ValueError(f"buffer must have shape (4, N), not {buffer.shape}")
+        dataset = Dataset.__new__(Dataset)
+        dataset._set(name, buffer, unixtime, variable, times, index)
+        return dataset
+
+    def _set(self, name, buffer, unixtime, variable, times, index=None):
         self.name = name
-        self.lats = np.array(lats)
-        self.lons = np.array(lons)
-        self.elevs = np.array(elevs)
-        self.values = np.array(values)
+        self.buffer = buffer
         self.unixtime = unixtime
         self.variable = variable
+        # Unixtime of each observation, if known
+        self.times = None if times is None else np.asarray(times)
+        self.index = index
+        self._derived_callback = None
+        self.clear_derived()
+
+    @property
+    def lats(self) -> np.ndarray:
+        return self.buffer[0]
+
+    @property
+    def lons(self) -> np.ndarray:
+        return self.buffer[1]
+
+    @property
+    def elevs(self) -> np.ndarray:
+        return self.buffer[2]
+
+    @property
+    def values(self) -> np.ndarray:
+        return self.buffer[3]
+
+    def __len__(self):
+        return self.buffer.shape[1]
+
+    def subset(self, index) -> "Dataset":
+        """Returns a dataset with a subset of the observations
+
+        Arguments:
+            index: A slice (returns a view), an array of indices, or a boolean mask
+
+        Returns:
+            Dataset: The subset. Its index attribute contains the indices into this dataset.
+        """
+        if isinstance(index, slice):
+            buffer = self.buffer[:, index]
+            index = np.arange(len(self))[index]
+        else:
+            index = np.asarray(index)
+            if index.dtype == bool:
+                index = np.flatnonzero(index)
+            buffer = np.take(self.buffer, index, axis=1)
+        times = None if self.times is None else self.times[index]
+        return Dataset.from_buffer(self.name, buffer, self.unixtime, self.variable, times, index)
+
+    def astype(self, dtype) -> "Dataset":
+        """Returns the dataset with the buffer converted to dtype (without a copy if it already has it)"""
+        if self.buffer.dtype == dtype:
+            return self
+        return Dataset.from_buffer(self.name, self.buffer.astype(dtype), self.unixtime, self.variable, self.times, self.index)
+
+    def derived(self, key, compute):
+        """Returns a value derived from the observations, computed with compute(dataset) the first time
+
+        Values are kept until the buffer is replaced, or clear_derived is called after modifying it in
+        place. Arrays are made read-only, since they are shared by all users of the dataset.
+
+        Arguments:
+            key: Identifies the value, e.g. "x"
+            compute (callable): Function computing the value from the dataset
+        """
+        if self._derived_buffer is not self.buffer:
+            self.clear_derived()
+        if key not in self._derived:
+            value = compute(self)
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            self._derived[key] = value
+            self._derived_nbytes += get_nbytes(value)
+            if self._derived_callback is not None:
+                self._derived_callback()
+        return self._derived[key]
+
+    def on_derived(self, callback):
+        """Calls callback() each time a derived value is added, e.g. to update the size of a cache entry"""
+        self._derived_callback = callback
+
+    def clear_derived(self):
+        """Discards the derived values, e.g. after the buffer was modified in place"""
+        self._derived = dict()
+        self._derived_buffer = self.buffer
+        self._derived_nbytes = 0
+
+    def __getstate__(self):
+        # Of the derived values, only the fingerprint is pickled (e.g. when sent to a worker), since the
+        # others are large and can be computed again
+        state = {name: getattr(self, name) for name in self.__slots__ if not name.startswith("_derived")}
+        state["_derived_callback"] = None
+        state["fingerprint"] = self._derived.get("fingerprint") if self._derived_buffer is self.buffer else None
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        fingerprint = state.pop("fingerprint")
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.clear_derived()
+        if fingerprint is not None:
+            self._derived["fingerprint"] = fingerprint
+            self._derived_nbytes += get_nbytes(fingerprint)
+
+    @property
+    def fingerprint(self) -> str:
+        """A hash of the observations, which identifies the dataset wherever it was loaded from"""
+        return self.derived("fingerprint", get_fingerprint)
+
+    @property
+    def x(self) -> np.ndarray:
+        """X coordinates of the observations in the web mercator projection [m]"""
+        return self.derived("x", lambda dataset: lon2x(dataset.lons))
+
+    @property
+    def y(self) -> np.ndarray:
+        """Y coordinates of the observations in the web mercator projection [m]"""
+        return self.derived("y", lambda dataset: lat2y(dataset.lats))
+
+    @property
+    def bounds(self) -> tuple:
+        """Returns (min lat, max lat), (min lon, max lon) of the observations, or None if there are none"""
+        return self.derived("bounds", get_bounds)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays of the dataset, including the derived values [bytes]"""
+        derived = self._derived_nbytes if self._derived_buffer is self.buffer else 0
+        return sum(array.nbytes for array in self.arrays) + derived
+
+    def set_readonly(self):
+        """Prevents the arrays from being modified, so that the dataset can be shared"""
+        for array in self.arrays:
+            array.flags.writeable = False
+
+    @property
+    def arrays(self) -> list:
+        """All arrays with one element per observation"""
+        arrays = [self.buffer]
+        if self.times is not None:
+            arrays += [self.times]
+        return arrays
+
+
+def get_fingerprint(dataset: Dataset) -> str:
+    digest = hashlib.sha1(str(dataset.buffer.dtype).encode())
+    digest.update(np.ascontiguousarray(dataset.buffer).data)
+    return digest.hexdigest()
+
 
+def get_nbytes(value) -> int:
+    """Returns the memory used by a derived value [bytes], including the strings of object arrays"""
+    if not isinstance(value, np.ndarray):
+        return sys.getsizeof(value)
+    if value.dtype != object:
+        return value.nbytes
+    # Elements are often the same object (e.g. equal labels), which only uses memory once
+    objects = {id(element): element for element in value.ravel()}
+    return value.nbytes + sum(sys.getsizeof(element) for element in objects.values())
 
 
+def get_bounds(dataset: Dataset) -> tuple:
+    if len(dataset) == 0:
+        return None
+    return (np.min(dataset.lats), np.max(dataset.lats)), (np.min(dataset.lons), np.max(dataset.lons))
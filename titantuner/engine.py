@@ -0,0 +1,532 @@
+"""This module runs titanlib tests on datasets, independently of the user interface
+
+Each test is an adapter registered with @register(name). An adapter takes a titanlib.Points, the
+values of the observations, and a dict of parameters (named as the widgets in the app), and returns a
+Result. Use run() to run a test on a dataset.
+"""
+
+import concurrent.futures
+import copy
+import hashlib
+import multiprocessing
+import threading
+import time
+import numpy as np
+import titanlib
+
+import titantuner
+
+
+# Increase when the results of a test change for the same dataset and parameters, so that results
+# cached on disk by an earlier version are not reused
+CACHE_VERSION = 1
+
+tests = dict()
+
+def register(name: str):
+    """Decorator registering a function as the adapter for a test"""
+    def decorator(function):
+        tests[name] = function
+        return function
+    return decorator
+
+
+class Result:
+    """The output of a test
+
+    Attributes:
+        flags (np.array): 1 for flagged observations, otherwise 0
+        values (np.array): The values the test was run on (after the Box-Cox transformation, if any)
+        sct (np.array): SCT score of each observation, or None if the test does not compute it
+        time (float): Time spent in titanlib [s]
+        timings (dict): Time spent in each stage of the run [s] (see titantuner.metrics.Timings)
+    """
+    def __init__(self, flags, values, sct=None):
+        self.flags = np.asarray(flags)
+        self.values = values
+        self.sct = None if sct is None else np.asarray(sct)
+        self.time = None
+        self.timings = dict()
+
+    @property
+    def arrays(self) -> dict:
+        arrays = {"flags": self.flags, "values": self.values}
+        if self.sct is not None:
+            arrays["sct"] = self.sct
+        return arrays
+
+    @property
+    def nbytes(self) -> int:
+        return sum(np.asarray(array).nbytes for array in self.arrays.values())
+
+
+class ResultCache:
+    """Keeps the results of recent runs in memory, and optionally on disk
+
+    Results are shared between all callers, and their arrays are therefore made read-only.
+    """
+    def __init__(self, max_size: int, disk_cache: titantuner.cache.DiskCache = None):
+        """
+        Arguments:
+            max_size (int): Maximum memory used by cached results [bytes]
+            disk_cache (titantuner.cache.DiskCache): Where to store results so that they survive a restart.
+                If None, results are only kept in memory.
+        """
+        self.memory = titantuner.cache.MemoryCache(max_size, lambda result: result.nbytes)
+        self.disk_cache = disk_cache
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(name: str, dataset, params: dict, index=None, num_tiles: int = 1) -> tuple:
+        """Returns the key of a run of test name on dataset (see run and run_tiled)"""
+        if index is None:
+            index = np.arange(len(dataset))
+        index_digest = hashlib.sha1(np.ascontiguousarray(index, dtype=np.int64).data).hexdigest()
+        key = (CACHE_VERSION, titanlib.__version__, dataset.fingerprint, name, tuple(sorted(params.items())),
+               index_digest)
+        if num_tiles > 1:
+            # Tiled runs can differ slightly from untiled ones
+            key += (num_tiles,)
+        return key
+
+    def get(self, key) -> Result:
+        """Returns the cached result for key, or None"""
+        result = self.memory.get(key)
+        if result is None and self.disk_cache is not None:
+            filename = self.disk_cache.lookup(key)
+            if filename is not None:
+                result = self._load(filename)
+                self.memory.put(key, result)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def put(self, key, result: Result):
+        self._make_read_only(result)
+        self.memory.put(key, result)
+        if self.disk_cache is not None:
+            self.disk_cache.store(key, lambda file: np.savez(file, time=result.time, **result.arrays))
+
+    @staticmethod
+    def _load(filename: str) -> Result:
+        with np.load(filename) as arrays:
+            result = Result(arrays["flags"], arrays["values"], arrays["sct"] if "sct" in arrays else None)
+            result.time = float(arrays["time"])
+        ResultCache._make_read_only(result)
+        return result
+
+    @staticmethod
+    def _make_read_only(result: Result):
+        for array in result.arrays.values():
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups that were hits, or nan if there have been no lookups"""
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else float("nan")
+
+
+def run(name: str, dataset, params: dict, index=None) -> Result:
+    """Runs a test on a dataset
+
+    Arguments:
+        name (str): Name of a registered test, e.g. "sct"
+        dataset (titantuner.dataset.Dataset): The observations
+        params (dict): Parameters of the test
+        index: If not None, only test these observations (see Dataset.subset)
+
+    Returns:
+        Result: With one element for each tested observation
+    """
+    if name not in tests:
+        raise ValueError(f"Unknown test {name}. Available tests: {list(tests.keys())}")
+    with titantuner.metrics.Timings() as timings:
+        if index is not None:
+            with titantuner.metrics.stage("subset"):
+                dataset = dataset.subset(index)
+        with titantuner.metrics.stage("points"):
+            points = get_points(dataset)
+
+        s_time = time.time()
+        with titantuner.metrics.stage("titanlib"):
+            result = tests[name](points, dataset.values, params)
+        result.time = time.time() - s_time
+    result.timings = timings.stages
+
+    # Treat any other flag value (e.g. missing) as not flagged
+    flags = result.flags
+    flags[(flags != 0) & (flags != 1)] = 0
+    return result
+
+
+# Recently used points, in this process. Building the points is expensive for large datasets (it
+# builds a KD-tree), and most runs only change the parameters of the test.
+points_cache = titantuner.cache.MemoryCache(4, lambda points: 1)
+
+def get_points(dataset) -> titanlib.Points:
+    """Returns titanlib.Points for the observations in dataset, reusing them if they were built recently"""
+    points = points_cache.get(dataset.fingerprint)
+    if points is None:
+        points = titanlib.Points(dataset.lats, dataset.lons, dataset.elevs)
+        points_cache.put(dataset.fingerprint, points)
+    return points
+
+
+# Tests whose result for an observation only depends on observations within outer_radius, which can
+# therefore be run tile by tile
+tiled_tests = ["sct", "sctres", "sctdual", "fgt"]
+
+def get_tiles(dataset, num_tiles: int, halo: float) -> list:
+    """Splits the area covered by dataset into num_tiles x num_tiles tiles
+
+    Arguments:
+        dataset (titantuner.dataset.Dataset): The observations
+        num_tiles (int): Number of tiles in each direction
+        halo (float): Width of the border around each tile with observations that are needed to test
+            the observations within it [m]
+
+    Returns:
+        list: (Itile, interior) for each tile with observations, where Itile are the indices of the
+            observations in the tile and its border, and interior is True for those in the tile itself
+    """
+    tiles = list()
+    if len(dataset) == 0:
+        return tiles
+    # Distances in an equirectangular projection scaled at the latitude furthest from the equator (plus
+    # the halo), so that distances along x are never longer than on the ground, and the border includes
+    # every observation within halo of the tile
+    RADIUS = 6378137.0
+    lat_max = min(np.max(np.abs(np.radians(dataset.lats))) + halo / RADIUS, np.pi / 2)
+    x = np.radians(dataset.lons) * RADIUS * np.cos(lat_max)
+    y = np.radians(dataset.lats) * RADIUS
+
+    x_edges = np.linspace(np.min(x), np.max(x), num_tiles + 1)
+    y_edges = np.linspace(np.min(y), np.max(y), num_tiles + 1)
+    ix = np.clip(np.searchsorted(x_edges, x, side="right") - 1, 0, num_tiles - 1)
+    iy = np.clip(np.searchsorted(y_edges, y, side="right") - 1, 0, num_tiles - 1)
+    for i in range(num_tiles):
+        for j in range(num_tiles):
+            in_halo = (x >= x_edges[i] - halo) & (x <= x_edges[i + 1] + halo) & \
+                      (y >= y_edges[j] - halo) & (y <= y_edges[j + 1] + halo)
+            Itile = np.flatnonzero(in_halo)
+            interior = (ix[Itile] == i) & (iy[Itile] == j)
+            if np.any(interior):
+                tiles += [(Itile, interior)]
+    return tiles
+
+
+def submit_tiled(executor: concurrent.futures.Executor, name: str, dataset, params: dict, num_tiles: int) -> concurrent.futures.Future:
+    """Runs a test in tiles (see get_tiles) on executor
+
+    Each tile includes a border as wide as the outer radius of the test, and the flags and sct scores
+    of each observation are taken from the tile it lies in. The result can therefore differ slightly
+    from a run on the whole dataset, e.g. when the test iterates.
+
+    Returns:
+        concurrent.futures.Future: The stitched Result. Cancelling it cancels the tiles that have not
+            started yet.
+    """
+    if name not in tiled_tests:
+        raise ValueError(f"Test {name} cannot be run in tiles")
+    s_time = time.time()
+    tiles = get_tiles(dataset, num_tiles, params["outer_radius"])
+    futures = [executor.submit(run, name, dataset.subset(Itile), params) for Itile, _ in tiles]
+    future = concurrent.futures.Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def stitch():
+        flags = np.zeros(len(dataset), int)
+        values = np.zeros(len(dataset))
+        sct = None
+        for (Itile, interior), tile_future in zip(tiles, futures):
+            result = tile_future.result()
+            flags[Itile[interior]] = result.flags[interior]
+            values[Itile[interior]] = np.asarray(result.values)[interior]
+            if result.sct is not None:
+                if sct is None:
+                    sct = np.full(len(dataset), np.nan)
+                sct[Itile[interior]] = result.sct[interior]
+        result = Result(flags, values, sct)
+        result.time = time.time() - s_time
+        return result
+
+    def on_tile_done(tile_future):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0 or future.cancelled():
+                return
+        try:
+            future.set_result(stitch())
+        except concurrent.futures.InvalidStateError:
+            # Cancelled while stitching
+            pass
+        except BaseException as e:
+            future.set_exception(e)
+
+    def on_cancel(future):
+        if future.cancelled():
+            for tile_future in futures:
+                tile_future.cancel()
+
+    future.add_done_callback(on_cancel)
+    if len(futures) == 0:
+        future.set_result(stitch())
+    for tile_future in futures:
+        tile_future.add_done_callback(on_tile_done)
+    return future
+
+
+def run_tiled(name: str, dataset, params: dict, executor: concurrent.futures.Executor, num_tiles: int, index=None) -> Result:
+    """Same as run, but runs the test in tiles on executor (see submit_tiled)"""
+    if index is not None:
+        dataset = dataset.subset(index)
+    return submit_tiled(executor, name, dataset, params, num_tiles).result()
+
+
+def get_sweep_values(start: float, end: float, step: float, max_values: int = 50) -> list:
+    """Returns the values from start to end (included) in steps of step
+
+    The values are ints if start and step are, since some parameters (e.g. nmin) must be integers.
+
+    Raises:
+        ValueError: if the range is empty, or has more than max_values values
+    """
+    if step <= 0:
+        raise ValueError("The step must be positive")
+    if end < start:
+        raise ValueError("The end must not be less than the start")
+    num = int(np.floor((end - start) / step + 1e-9)) + 1
+    if num > max_values:
+        raise ValueError(f"The sweep has {num} values, but at most {max_values} are allowed")
+    values = start + step * np.arange(num)
+    if float(start).is_integer() and float(step).is_integer():
+        return [int(value) for value in values]
+    # Avoid values such as 0.30000000000000004 in the parameters, and thus in the result cache keys
+    return [round(float(value), 10) for value in values]
+
+
+def submit_sweep(executor: concurrent.futures.Executor, name: str, dataset, params: dict, key: str, values: list, num_tiles: int = 1) -> list:
+    """Runs a test once for each value of parameter key, in parallel on executor
+
+    Arguments:
+        num_tiles (int): If more than 1, each run is split into tiles (see submit_tiled)
+
+    Returns:
+        list: The parameters and the concurrent.futures.Future of the Result of each run
+    """
+    if key not in params:
+        raise ValueError(f"Test {name} has no parameter {key}")
+    runs = list()
+    for value in values:
+        run_params = dict(params)
+        run_params[key] = value
+        if num_tiles > 1:
+            future = submit_tiled(executor, name, dataset, run_params, num_tiles)
+        else:
+            future = executor.submit(run, name, dataset, run_params)
+        runs += [(run_params, future)]
+    return runs
+
+
+def summarize(result: Result) -> tuple:
+    """Returns the flagged fraction [%] and the mean of the values that were not flagged (nan if none)"""
+    num = len(result.flags)
+    if num == 0:
+        return float("nan"), float("nan")
+    retained = np.asarray(result.values)[result.flags == 0]
+    mean = float(np.nanmean(retained)) if len(retained) > 0 else float("nan")
+    return 100.0 * np.sum(result.flags == 1) / num, mean
+
+
+def create_executor(max_workers: int) -> concurrent.futures.Executor:
+    """Creates a pool of processes for running tests with run()
+
+    Titanlib does not release the GIL, so tests running in threads would still block the server.
+    """
+    # Forking a process with running threads (e.g. the server's) is not safe
+    return concurrent.futures.ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def apply_BoxCox(values, power):
+    values = np.array(values)
+    values_to_test = copy.deepcopy(values)
+    if power == 0:
+        ix_0 = np.where(values_to_test == 0)[0]
+        values_to_test[ix_0] = 0.0001
+        if len(ix_0)>0:
+            print(f"Warning 0 values replaced by 0.0001.")
+        ix_pos = np.where(values_to_test >= 0)[0]
+        values_to_test[ix_pos] = np.log(values_to_test[ix_pos])
+        if len(ix_pos) != len(values):
+            print(f"Warning, values < 0 not transformed with a box cox transformation. {len(values)-len(ix_pos)} untransformed value(s)")
+    elif power > 0:
+        ix_pos = np.where(values_to_test >= 0)[0]
+        values_to_test[ix_pos] = (pow(values_to_test[ix_pos], power) - 1) / power
+        if len(ix_pos) != len(values):
+            print(f"Warning, negative values not transformed with a box cox transformation. {len(values)-len(ix_pos)} untransformed value(s)")
+    else:
+        raise ValueError(f"StartedBoxCox: Power must be >=0")
+    return values_to_test
+
+def apply_StartedBoxCox(values, power, scaling):
+    values = np.array(values)
+    values_to_test = copy.deepcopy(values)
+    if scaling<=0:
+        raise ValueError(f"StartedBoxCox: scaling must be >0. Is {scaling}")
+    if power == 0:
+        ix_above_thr = np.where(values_to_test>scaling)[0]
+        values_to_test[ix_above_thr] = scaling * (1 + np.log(values_to_test[ix_above_thr]/scaling))
+    elif(power>0):
+        ix0 = np.where(values_to_test == 0)[0]
+        values_to_test[ix0] = 0
+        ix_above_thr = np.where(values_to_test>scaling)[0]
+        values_to_test[ix_above_thr] = scaling * (1 + (((pow(values_to_test[ix_above_thr]/scaling, power)) - 1) / power));
+    else:
+        raise ValueError(f"StartedBoxCox: Power must be >=0")
+    return values_to_test
+
+def apply_PowerTransform(values, power, scaling):
+    if scaling <=0:
+        print(f"Apply box Cox transformation with power {power}")
+        values = apply_BoxCox(values, power)
+    else:
+        print(f"Apply Started box Cox transformation with power {power} and scaling {scaling}")
+        values = apply_StartedBoxCox(values, power, scaling)
+    return(values)
+
+
+def uses_BoxCox(params: dict) -> bool:
+    """Returns True if the parameters ask for a Box-Cox transformation of the values"""
+    return params.get("BoxCoxPower", -1) >= 0
+
+def transform(values, params: dict):
+    """Applies the Box-Cox transformation in params, if any"""
+    if uses_BoxCox(params):
+        with titantuner.metrics.stage("boxcox"):
+            return apply_PowerTransform(values, params["BoxCoxPower"], params["BoxCoxScaling"])
+    return values
+
+def get_value_range(values, params: dict, delta_key: str, fact_key: str):
+    """Returns the range of allowed (a_delta, a_fact) or valid (v_delta, v_fact) values used by
+    sct_resistant and fgt, in the same units as the transformed values"""
+    values_min = values - params[delta_key]
+    values_max = values + params[delta_key]
+    if not uses_BoxCox(params):
+        return values_min, values_max
+
+    values_min[values_min < 0] = 0
+    values_min_alt = values - params[fact_key] * values
+    values_min_alt[values_min_alt < 0] = 0
+    values_min = np.minimum(values_min, values_min_alt)
+
+    values_max[values_max < 0] = 0
+    values_max_alt = values + params[fact_key] * values
+    values_max_alt[values_max_alt < 0] = 0
+    values_max = np.maximum(values_max, values_max_alt)
+
+    values_min = apply_PowerTransform(values_min, params["BoxCoxPower"], params["BoxCoxScaling"])
+    values_max = apply_PowerTransform(values_max, params["BoxCoxPower"], params["BoxCoxScaling"])
+    return values_min, values_max
+
+
+# Options of the "background_elab" and "t_condition" radio buttons
+background_elabs = [titanlib.VerticalProfile, titanlib.VerticalProfileTheilSen, titanlib.MeanOuterCircle,
+                    titanlib.MedianOuterCircle, titanlib.External]
+conditions = [titanlib.Eq, titanlib.Gt, titanlib.Geq, titanlib.Lt, titanlib.Leq]
+
+
+@register("sct")
+def sct(points, values, params):
+    n = len(values)
+    values = transform(values, params)
+    flags, sct, rep = titanlib.sct(points, values, params["nmin"], params["nmax"], params["inner_radius"],
+            params["outer_radius"], params["niterations"], params["nminprof"],
+            params["dzmin"], params["dhmin"], params["dz"], params["t2pos"] * np.ones(n), params["t2neg"] * np.ones(n),
+            params["eps2"] * np.ones(n))
+    return Result(flags, values, sct)
+
+
+@register("sctres")
+def sct_resistant(points, values, params):
+    n = len(values)
+    values_mina, values_maxa = get_value_range(values, params, "a_delta", "a_fact")
+    values_minv, values_maxv = get_value_range(values, params, "v_delta", "v_fact")
+    values = transform(values, params)
+    flags, sct = titanlib.sct_resistant(points, values,
+            np.ones(n), np.ones(n), background_elabs[params["background_elab"]],
+            params["nmin"], params["nmax"], params["inner_radius"],
+            params["outer_radius"], params["niterations"], params["nminprof"],
+            params["dzmin"], params["dhmin"], params["dhmax"], params["kth"], params["dz"],
+            values_mina, values_maxa, values_minv, values_maxv,
+            params["eps2"] * np.ones(n),
+            params["t2pos"] * np.ones(n), params["t2neg"] * np.ones(n),
+            False, params["basic"] == 0)
+    return Result(flags, values, sct)
+
+
+@register("sctdual")
+def sct_dual(points, values, params):
+    n = len(values)
+    values = transform(values, params)
+    flags = titanlib.sct_dual(points, values,
+            np.ones(n), params["t_event"] * np.ones(n), conditions[params["t_condition"]],
+            params["nmin"], params["nmax"], params["inner_radius"],
+            params["outer_radius"], params["niterations"],
+            params["dhmin"], params["dhmax"], params["kth"], params["dz"],
+            params["t_test"] * np.ones(n),
+            False)
+    return Result(flags, values)
+
+
+@register("fgt")
+def fgt(points, values, params):
+    n = len(values)
+    values_mina, values_maxa = get_value_range(values, params, "a_delta", "a_fact")
+    values_minv, values_maxv = get_value_range(values, params, "v_delta", "v_fact")
+    values = transform(values, params)
+    flags, sct = titanlib.fgt(points, values,
+            np.ones(n), np.ones(n),
+            np.ones(n), background_elabs[params["background_elab"]],
+            params["nmin"], params["nmax"], params["inner_radius"],
+            params["outer_radius"], params["niterations"], params["nminprof"], params["dzmin"],
+            values_mina, values_maxa, values_minv, values_maxv,
+            params["tpos"] * np.ones(n), params["tneg"] * np.ones(n),
+            False, params["basic"] == 0)
+    return Result(flags, values, sct)
+
+
+@register("isolation")
+def isolation(points, values, params):
+    flags = titanlib.isolation_check(points, int(params["num"]), float(params["radius"] * 1000))
+    return Result(flags, values)
+
+
+@register("buddy")
+def buddy(points, values, params):
+    values = transform(values, params)
+    flags = titanlib.buddy_check(points, values,
+            [params["distance"]], [params["num"]],
+            params["threshold"], params["elev_range"],
+            params["elev_gradient"] / 1000, params["min_std"],
+            params["num_iterations"])
+    return Result(flags, values)
+
+
+@register("buddy_event")
+def buddy_event(points, values, params):
+    values = transform(values, params)
+    flags = titanlib.buddy_event_check(points, values,
+            [params["distance"]], [params["num"]],
+            params["event_threshold"],
+            params["threshold"], params["elev_range"],
+            params["elev_gradient"] / 1000,
+            params["num_iterations"])
+    return Result(flags, values)
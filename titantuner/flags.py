@@ -0,0 +1,155 @@
+"""This module keeps the flags of each test run in a session, and combines them with boolean expressions"""
+
+import re
+import numpy as np
+
+
+class FlagTable:
+    """One boolean flag column for each test run on a selection of observations
+
+    Columns are named after their test. When a test is run several times, the later columns are named
+    <test>_2, <test>_3, etc.
+    """
+    def __init__(self, size: int, index=None):
+        """
+        Arguments:
+            size (int): Number of observations in the selection
+            index (np.array): Indices of the selected observations in the dataset, if known
+        """
+        self.size = size
+        self.index = index
+        self.columns = dict()
+
+    def add(self, test: str, flags, index=None) -> str:
+        """Adds the flags of a test run
+
+        Arguments:
+            test (str): Name of the test
+            flags (np.array): True (or 1) for flagged observations
+            index (np.array): The observations that were tested, if not all. The others are not flagged.
+
+        Returns:
+            str: Name of the new column
+        """
+        name = test
+        count = 1
+        while name in self.columns:
+            count += 1
+            name = f"{test}_{count}"
+        column = np.zeros(self.size, bool)
+        if index is None:
+            column[:] = flags
+        else:
+            column[index] = flags
+        self.columns[name] = column
+        return name
+
+    @property
+    def names(self) -> list:
+        return list(self.columns.keys())
+
+    def evaluate(self, expression: str) -> np.ndarray:
+        """Evaluates a boolean expression over the columns (see evaluate)"""
+        return evaluate(expression, self.columns, self.size)
+
+    def copy(self) -> "FlagTable":
+        table = FlagTable(self.size, self.index)
+        table.columns = dict(self.columns)
+        return table
+
+    def has_selection(self, index) -> bool:
+        """Returns True if the table is for the observations with these indices in the dataset"""
+        return self.index is not None and np.array_equal(self.index, index)
+
+    def __len__(self):
+        return len(self.columns)
+
+
+def evaluate(expression: str, columns: dict, size: int = None) -> np.ndarray:
+    """Evaluates a boolean expression of flag columns, e.g. "(sct | buddy) & ~isolation"
+
+    The expression can contain column names, | (or), & (and), ~ (not), and parentheses, with the same
+    precedence as in Python. Nothing else is evaluated, so expressions from users are safe.
+
+    Arguments:
+        expression (str): The expression
+        columns (dict): Column name -> boolean np.array
+        size (int): Number of observations, only needed if columns is empty
+
+    Returns:
+        np.array: True where the expression is true
+
+    Raises:
+        ValueError: if the expression is invalid or uses an unknown column
+    """
+    tokens = tokenize(expression)
+    if size is None:
+        if len(columns) == 0:
+            raise ValueError("No flag columns to evaluate the expression on")
+        size = len(next(iter(columns.values())))
+    parser = _Parser(tokens, columns)
+    result = parser.parse_or()
+    if parser.position != len(tokens):
+        raise ValueError(f"Unexpected '{tokens[parser.position]}' in '{expression}'")
+    return np.broadcast_to(result, (size,)).copy()
+
+
+def tokenize(expression: str) -> list:
+    """Splits an expression into names, operators and parentheses"""
+    tokens = list()
+    position = 0
+    for match in re.finditer(r"\s*([A-Za-z_][A-Za-z0-9_]*|[|&~()])", expression):
+        if match.start() != position:
+            break
+        tokens += [match.group(1)]
+        position = match.end()
+    if expression[position:].strip() != "":
+        raise ValueError(f"Invalid character '{expression[position:].strip()[0]}' in '{expression}'")
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser that evaluates the expression while parsing it"""
+    def __init__(self, tokens: list, columns: dict):
+        self.tokens = tokens
+        self.columns = columns
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("Unexpected end of the expression")
+        self.position += 1
+        return token
+
+    def parse_or(self):
+        value = self.parse_and()
+        while self.peek() == "|":
+            self.next()
+            value = value | self.parse_and()
+        return value
+
+    def parse_and(self):
+        value = self.parse_not()
+        while self.peek() == "&":
+            self.next()
+            value = value & self.parse_not()
+        return value
+
+    def parse_not(self):
+        token = self.next()
+        if token == "~":
+            return ~self.parse_not()
+        if token == "(":
+            value = self.parse_or()
+            if self.next() != ")":
+                raise ValueError("Missing ')'")
+            return value
+        if token in "|&)":
+            raise ValueError(f"Unexpected '{token}'")
+        if token not in self.columns:
+            raise ValueError(f"Unknown flag column '{token}'. Available columns: {', '.join(self.columns)}")
+        return np.asarray(self.columns[token], bool)
@@ -0,0 +1,100 @@
+"""Level of detail for maps with many stations
+
+The stations within the view of a map are found with a GridIndex. When there are too many of them to be
+shown one by one, they are counted in the cells of a grid instead (see aggregate), so that the amount
+of data sent to the browser does not grow with the number of stations.
+"""
+
+import numpy as np
+
+
+class GridIndex:
+    """Finds the points within a rectangle, using a regular grid of cells covering the points
+
+    The points are sorted by cell, row by row, so that the points of consecutive cells in a row are
+    contiguous.
+    """
+    def __init__(self, x, y, num_cells: int = 256):
+        """
+        Arguments:
+            x (np.array): X coordinates of the points
+            y (np.array): Y coordinates of the points
+            num_cells (int): Number of cells in each direction
+        """
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.num_cells = num_cells
+        if len(self.x) > 0 and np.any(np.isfinite(self.x)) and np.any(np.isfinite(self.y)):
+            self.xrange = (np.nanmin(self.x), np.nanmax(self.x))
+            self.yrange = (np.nanmin(self.y), np.nanmax(self.y))
+        else:
+            self.xrange = (0.0, 0.0)
+            self.yrange = (0.0, 0.0)
+        self.width = max((self.xrange[1] - self.xrange[0]) / num_cells, 1e-9)
+        self.height = max((self.yrange[1] - self.yrange[0]) / num_cells, 1e-9)
+
+        cells = self.get_rows(self.y) * num_cells + self.get_columns(self.x)
+        self.order = np.argsort(cells, kind="stable")
+        # The points of cell i are order[offsets[i]:offsets[i + 1]]
+        self.offsets = np.searchsorted(cells[self.order], np.arange(num_cells * num_cells + 1))
+
+    def get_columns(self, x):
+        return self._get_cells(x, self.xrange[0], self.width)
+
+    def get_rows(self, y):
+        return self._get_cells(y, self.yrange[0], self.height)
+
+    def _get_cells(self, coords, start, size):
+        cells = np.nan_to_num(np.floor((np.asarray(coords, dtype=float) - start) / size), nan=0, posinf=self.num_cells, neginf=0)
+        return np.clip(cells, 0, self.num_cells - 1).astype(int)
+
+    def query(self, xrange: tuple, yrange: tuple) -> np.ndarray:
+        """Returns the sorted indices of the points within xrange and yrange (inclusive)"""
+        if xrange[0] <= self.xrange[0] and xrange[1] >= self.xrange[1] and \
+                yrange[0] <= self.yrange[0] and yrange[1] >= self.yrange[1]:
+            I = np.arange(len(self.x))
+        else:
+            column0, column1 = self.get_columns(xrange)
+            row0, row1 = self.get_rows(yrange)
+            n = self.num_cells
+            I = np.concatenate([self.order[self.offsets[row * n + column0]:self.offsets[row * n + column1 + 1]]
+                                for row in range(row0, row1 + 1)])
+            I.sort()
+        x = self.x[I]
+        y = self.y[I]
+        return I[(x >= xrange[0]) & (x <= xrange[1]) & (y >= yrange[0]) & (y <= yrange[1])]
+
+
+def aggregate(x, y, flagged, xrange: tuple, yrange: tuple, num_cells: int = 64) -> tuple:
+    """Counts the points, and the flagged points, in square cells covering xrange and yrange
+
+    The size of the cells is a power of 2, and the cells are aligned on multiples of it, so that they do
+    not move when the map is panned, and are split in four when zooming in.
+
+    Arguments:
+        x (np.array): X coordinates of the points, within xrange
+        y (np.array): Y coordinates of the points, within yrange
+        flagged (np.array): True for the flagged points
+        num_cells (int): Minimum number of cells along the longest range
+
+    Returns:
+        dict: Columns x and y (center), count, flagged and rate (fraction flagged) of the cells with points,
+            as float32 and int32 arrays
+        float: The size of the cells
+    """
+    size = 2.0 ** np.floor(np.log2(max(xrange[1] - xrange[0], yrange[1] - yrange[0], 1e-9) / num_cells))
+    x0 = np.floor(xrange[0] / size) * size
+    y0 = np.floor(yrange[0] / size) * size
+    num_columns = int(np.floor((xrange[1] - x0) / size)) + 1
+    num_rows = int(np.floor((yrange[1] - y0) / size)) + 1
+    columns = np.clip(np.floor((x - x0) / size), 0, num_columns - 1).astype(int)
+    rows = np.clip(np.floor((y - y0) / size), 0, num_rows - 1).astype(int)
+    cells = rows * num_columns + columns
+    count = np.bincount(cells, minlength=num_rows * num_columns)
+    flagged_count = np.bincount(cells, weights=np.asarray(flagged, dtype=float), minlength=num_rows * num_columns)
+    I = np.flatnonzero(count)
+    return {"x": (x0 + (I % num_columns + 0.5) * size).astype(np.float32),
+            "y": (y0 + (I // num_columns + 0.5) * size).astype(np.float32),
+            "count": count[I].astype(np.int32),
+            "flagged": flagged_count[I].astype(np.int32),
+            "rate": (flagged_count[I] / count[I]).astype(np.float32)}, size
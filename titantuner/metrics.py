@@ -0,0 +1,195 @@
+"""This module measures where the time goes when serving requests, and serves the measurements over http
+
+A request (e.g. applying a test) is timed with a Timings, which records the time spent in each of its
+stages. Code called during a request marks its stages with stage() or @timed, without needing access to
+the Timings. The totals are recorded in registry, which MetricsHandler serves.
+"""
+
+import collections
+import functools
+import threading
+import time
+import numpy as np
+import tornado.web
+
+
+_local = threading.local()
+
+
+class Timings:
+    """The time spent in each stage of one request
+
+    Stages can be nested, and the time of a stage does not include that of the stages within it, so that
+    the stages add up to the time of the request.
+    """
+    def __init__(self):
+        # Stage name -> time [s]
+        self.stages = dict()
+        # Time spent in the nested stages of each running stage
+        self._nested = [0.0]
+
+    def stage(self, name: str):
+        """Context manager timing a stage of the request"""
+        return _Stage(self, name)
+
+    def add(self, stages: dict):
+        """Adds the time of stages, e.g. those measured in a worker process"""
+        for name, seconds in stages.items():
+            self.stages[name] = self.stages.get(name, 0) + seconds
+
+    @property
+    def total(self) -> float:
+        return sum(self.stages.values())
+
+    def __enter__(self):
+        """Makes this the current Timings of the thread (see stage)"""
+        if not hasattr(_local, "stack"):
+            _local.stack = list()
+        _local.stack.append(self)
+        return self
+
+    def __exit__(self, *args):
+        _local.stack.pop()
+
+    def __str__(self):
+        return ", ".join("%s %.3f s" % (name, seconds) for name, seconds in self.stages.items())
+
+
+class _Stage:
+    def __init__(self, timings: Timings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.timings._nested.append(0.0)
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        nested = self.timings._nested.pop()
+        self.timings._nested[-1] += elapsed
+        self.timings.add({self.name: elapsed - nested})
+
+
+class _NoStage:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+def current() -> Timings:
+    """Returns the Timings of the request running in this thread, or None"""
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def stage(name: str):
+    """Context manager timing a stage of the current request, if any"""
+    timings = current()
+    if timings is None:
+        return _NoStage()
+    return timings.stage(name)
+
+
+def timed(name: str):
+    """Decorator timing each call of a function as a stage of the current request"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Histogram:
+    """The number and sum of observations, and the most recent ones for computing percentiles"""
+    def __init__(self, max_samples: int = 1000):
+        self.count = 0
+        self.sum = 0.0
+        self.samples = collections.deque(maxlen=max_samples)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def percentile(self, q: float) -> float:
+        """Returns the q-th percentile (0-100) of the recent observations, or nan if there are none"""
+        if len(self.samples) == 0:
+            return float("nan")
+        return float(np.percentile(self.samples, q))
+
+
+class Registry:
+    """Counters and histograms of a server, shared by all sessions"""
+    # Percentiles served by render()
+    quantiles = [0.5, 0.95, 0.99]
+
+    def __init__(self, max_samples: int = 1000):
+        """
+        Arguments:
+            max_samples (int): Number of recent observations each histogram uses for its percentiles
+        """
+        self.max_samples = max_samples
+        self.counters = collections.OrderedDict()
+        self.histograms = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(self.max_samples)
+            self.histograms[name].observe(seconds)
+
+    def record(self, request: str, seconds: float, stages: dict):
+        """Records the duration of a request, and of each of its stages (as <request>.<stage>)
+
+        Arguments:
+            request (str): Type of request, e.g. "apply"
+            seconds (float): Duration of the request
+            stages (dict): Stage name -> duration (see Timings.stages)
+        """
+        self.observe(request, seconds)
+        for name, stage_seconds in stages.items():
+            self.observe(f"{request}.{name}", stage_seconds)
+
+    def render(self) -> str:
+        """Returns the counters and histograms in the Prometheus text format"""
+        lines = list()
+        with self._lock:
+            for name, value in self.counters.items():
+                name = get_metric_name(name) + "_total"
+                lines += [f"# TYPE {name} counter", f"{name} {value:g}"]
+            for name, histogram in self.histograms.items():
+                name = get_metric_name(name) + "_seconds"
+                lines += [f"# TYPE {name} summary"]
+                for q in self.quantiles:
+                    lines += ['%s{quantile="%g"} %g' % (name, q, histogram.percentile(100 * q))]
+                lines += [f"{name}_sum {histogram.sum:g}", f"{name}_count {histogram.count}"]
+        return "\n".join(lines) + "\n"
+
+
+def get_metric_name(name: str) -> str:
+    """Returns a Prometheus metric name for a counter or histogram, e.g. apply.points -> titantuner_apply_points"""
+    return "titantuner_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+# The metrics of this process
+registry = Registry()
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Serves registry, e.g. on /metrics of the Bokeh server"""
+    def initialize(self, registry: Registry = registry):
+        self.registry = registry
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(self.registry.render())
@@ -1,10 +1,14 @@
 import os
 import pkgutil
+import numpy as np
 
 
 import titantuner
 
 class Source:
+    # Number of seconds a loaded dataset can be used for, or None if it stays valid (see get_version)
+    ttl = None
+
     @property
     def requires_time(self):
         return False
@@ -17,8 +21,90 @@ class Source:
     def key_label(self) -> str:
         raise NotImplementedError()
 
+    @property
+    def keys_version(self) -> int:
+        """Changes each time the list of keys changes"""
+        return 0
+
+    def watch(self, interval: float):
+        """Starts updating the list of keys every interval seconds, for sources where it can change"""
+        pass
+
+    def get_version(self, *keys, **kwargs):
+        """Returns a value that changes when the data loaded for keys changes (e.g. the modification time
+        of a file), or None if it is not known"""
+        return None
+
     def load_index(self, index: int) -> titantuner.dataset.Dataset:
         raise NotImplementedError()
 
+    def prefetcher(self):
+        """Returns a Prefetcher for loading datasets in the background, or None if the source does not
+        support it"""
+        return None
+
+class Predicate:
+    """Selects which rows of a data file to load
+
+    Each criterion is optional. A row is kept if it satisfies all criteria that are set.
+
+    Rows are dropped after the file is parsed, so the criteria reduce the memory used by the datasets,
+    not the time spent parsing. With a column cache, each file is only parsed once for all predicates.
+    """
+    def __init__(self, latrange: list = None, lonrange: list = None, providers: list = None, dqcs: list = None):
+        """
+        Arguments:
+            latrange (list): Minimum and maximum latitude (inclusive)
+            lonrange (list): Minimum and maximum longitude (inclusive)
+            providers (list): Allowed provider IDs (prid)
+            dqcs (list): Allowed quality control flags (dqc)
+        """
+        self.latrange = None if latrange is None else (float(latrange[0]), float(latrange[1]))
+        self.lonrange = None if lonrange is None else (float(lonrange[0]), float(lonrange[1]))
+        self.providers = None if providers is None else tuple(sorted(set(providers)))
+        self.dqcs = None if dqcs is None else tuple(sorted(set(dqcs)))
+
+    def mask(self, columns: dict) -> np.ndarray:
+        """Returns True for each row that satisfies the predicate
+
+        Arguments:
+            columns (dict): column name -> np.array. The providers and dqcs criteria are ignored for data
+                without a prid or dqc column.
+        """
+        mask = np.ones(len(columns['lat']), bool)
+        if self.latrange is not None:
+            mask &= (columns['lat'] >= self.latrange[0]) & (columns['lat'] <= self.latrange[1])
+        if self.lonrange is not None:
+            mask &= (columns['lon'] >= self.lonrange[0]) & (columns['lon'] <= self.lonrange[1])
+        if self.providers is not None and 'prid' in columns:
+            mask &= np.isin(columns['prid'], self.providers)
+        if self.dqcs is not None and 'dqc' in columns:
+            mask &= np.isin(columns['dqc'], self.dqcs)
+        return mask
+
+    def get_missing_columns(self, names: list) -> list:
+        """Returns the columns that the criteria that are set need, but are not in names"""
+        needed = list()
+        if self.providers is not None:
+            needed += ['prid']
+        if self.dqcs is not None:
+            needed += ['dqc']
+        return [name for name in needed if name not in names]
+
+    def _key(self):
+        return (self.latrange, self.lonrange, self.providers, self.dqcs)
+
+    def __eq__(self, other):
+        return isinstance(other, Predicate) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "Predicate(latrange=%s, lonrange=%s, providers=%s, dqcs=%s)" % self._key()
+
+from .index import *
 from .titan import *
 from .frost import *
+from .prefetch import *
+from .cached import *
@@ -0,0 +1,113 @@
+"""This module shares loaded datasets between all sessions of a server"""
+
+import concurrent.futures
+import threading
+import time
+
+import titantuner
+from . import Source
+from .prefetch import Prefetcher
+
+
+class CachedSource(Source):
+    """Wraps a source and keeps recently loaded datasets in memory
+
+    Datasets returned by load are shared between all callers, and their arrays are therefore made
+    read-only. Loads can happen in several threads at once (see Prefetcher); a dataset that is already
+    being loaded is not loaded a second time.
+
+    A cached dataset is loaded again when the source reports a new version of it (e.g. a file was
+    rewritten), or when it is older than the ttl of the source (e.g. recent hours from frost).
+    """
+    def __init__(self, source: Source, max_size: int, num_prefetch: int = 0, dtype=None):
+        """
+        Arguments:
+            source (Source): The source to load datasets from
+            max_size (int): Maximum memory used by cached datasets [bytes]
+            num_prefetch (int): Number of datasets on each side of the selected one that sessions load
+                in the background
+            dtype: If not None, convert datasets to this data type (e.g. np.float32 to halve the memory
+                used) before caching them
+        """
+        self.source = source
+        # Entries are (dataset, version, load time)
+        self.cache = titantuner.cache.MemoryCache(max_size, lambda entry: entry[0].nbytes)
+        self.num_prefetch = num_prefetch
+        self.dtype = dtype
+        self.executor = None
+        self._loading = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def requires_time(self):
+        return self.source.requires_time
+
+    @property
+    def keys(self) -> list:
+        return self.source.keys
+
+    @property
+    def key_label(self) -> str:
+        return self.source.key_label
+
+    @property
+    def keys_version(self) -> int:
+        return self.source.keys_version
+
+    def watch(self, interval: float):
+        self.source.watch(interval)
+
+    def is_valid(self, entry: tuple, version) -> bool:
+        """Returns True if a cache entry holds the current version of its dataset, and has not expired"""
+        dataset, entry_version, load_time = entry
+        if entry_version != version:
+            return False
+        return self.source.ttl is None or time.time() - load_time < self.source.ttl
+
+    def load(self, *keys, **kwargs) -> titantuner.dataset.Dataset:
+        cache_key = keys + tuple(sorted(kwargs.items()))
+        version = self.source.get_version(*keys, **kwargs)
+        entry = self.cache.get(cache_key)
+        if entry is not None and self.is_valid(entry, version):
+            dataset = entry[0]
+        else:
+            with self._lock:
+                loading = self._loading.get(cache_key)
+                if loading is None:
+                    loading = self._loading[cache_key] = concurrent.futures.Future()
+                    is_loader = True
+                else:
+                    is_loader = False
+            if not is_loader:
+                # Another thread is loading this dataset already
+                return loading.result()
+            try:
+                load_time = time.time()
+                dataset = self.source.load(*keys, **kwargs)
+                if self.dtype is not None:
+                    dataset = dataset.astype(self.dtype)
+                dataset.set_readonly()
+                self.cache.put(cache_key, (dataset, version, load_time))
+                # Derived values (e.g. the projection) are added later, and count towards the size
+                dataset.on_derived(lambda: self.cache.update_size(cache_key))
+                loading.set_result(dataset)
+            except BaseException as e:
+                loading.set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    self._loading.pop(cache_key)
+        print(f"Dataset cache: {self.cache.hits} hits, {self.cache.misses} misses, {self.cache.size / 1024**2:.1f} MB used")
+        return dataset
+
+    def is_cached(self, *keys, **kwargs) -> bool:
+        """Returns True if the dataset is in the cache (possibly out of date) or is being loaded"""
+        cache_key = keys + tuple(sorted(kwargs.items()))
+        return cache_key in self.cache or cache_key in self._loading
+
+    def prefetcher(self):
+        if self.num_prefetch <= 0:
+            return None
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+        return Prefetcher(self, self.executor, self.num_prefetch)
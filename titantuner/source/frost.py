@@ -1,5 +1,10 @@
+import asyncio
+import concurrent.futures
+import json
+import time
 import numpy as np
 import requests
+import requests.adapters
 
 
 import titantuner
@@ -9,14 +14,35 @@ from . import Source
 """This module reads observations from frost"""
 
 class FrostSource(Source):
-    def __init__(self, frost_client_id: str):
+    def __init__(self, frost_client_id: str, url: str = None, cache: titantuner.cache.DiskCache = None, ttl: float = 3600):
+        """
+        Arguments:
+            frost_client_id (str): Client ID used to authenticate with frost
+            url (str): Endpoint to fetch observations from. Defaults to the frost filter endpoint.
+            cache (titantuner.cache.DiskCache): Where to cache responses. If None, responses are not cached.
+            ttl (float): Number of seconds that a cached response is used for
+        """
         self.frost_client_id = frost_client_id
+        self.url = url if url is not None else self.DEFAULT_URL
+        self.cache = cache
+        self.ttl = ttl
         self.variables = [
                 "air_temperature",
                 "max(wind_speed PT1H)",
                 "max(wind_speed_of_gust PT1H)",
                 "sum(precipitation_amount PT1H)"
             ]
+        # Reuse connections between requests, instead of a new TCP/TLS handshake for each request
+        self.session = requests.Session()
+        self.session.auth = (frost_client_id, "")
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.MAX_CONNECTIONS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    DEFAULT_URL = "https://frost-beta.met.no/api/v1/obs/met.no/filter/get"
+
+    # Maximum number of simultaneous connections to frost
+    MAX_CONNECTIONS = 8
 
     @property
     def keys(self) -> list:
@@ -33,8 +59,14 @@ class FrostSource(Source):
     def load(self, key: int, unixtime: int) -> titantuner.dataset.Dataset:
         """Returns a dataset with observations for the given variable and time"""
         variable = key
-        host = "frost-beta.met.no"
-        endpoint = "https://%s/api/v1/obs/met.no/filter/get?" % host
+        data = self.fetch(self.get_parameters(variable, unixtime))
+        values, lats, lons, elevs, units, times = self.parse(data)
+        name = "frost"
+        dataset = titantuner.dataset.Dataset(name, lats, lons, elevs, values, unixtime, variable, times)
+        return dataset
+
+    def get_parameters(self, variable: str, unixtime: int) -> dict:
+        """Returns the request parameters for one hour of observations of variable"""
         start = self.unixtime_to_reference_time(unixtime)
         end = self.unixtime_to_reference_time(unixtime + 3600)
         parameters = dict()
@@ -44,19 +76,88 @@ class FrostSource(Source):
         parameters["time"] = "%s/%s" % (start, end)
         parameters["timeresolutions"] = "PT1H"
         parameters["incobs"] = "true"
+        return parameters
+
+    def fetch(self, parameters: dict) -> dict:
+        """Returns the json response from frost for the request parameters, using the cache if possible"""
+        key = (self.url, sorted(parameters.items()))
+        if self.cache is not None:
+            filename = self.cache.lookup(key)
+            if filename is not None:
+                with open(filename, "r") as file:
+                    cached = json.load(file)
+                if time.time() - cached["time"] < self.ttl:
+                    return cached["data"]
+
         timeout = 30
+        r = self.session.get(self.url, params=parameters, timeout=timeout)
+        r.raise_for_status()
+        data = r.json()
 
-        r = requests.get(
-            endpoint,
-            parameters,
-            auth=(self.frost_client_id, ""),
-            timeout=timeout,
-        )
+        if self.cache is not None:
+            cached = {"time": time.time(), "data": data}
+            self.cache.store(key, lambda file: file.write(json.dumps(cached).encode()))
+        return data
 
-        values, lats, lons, elevs, units = self.parse(r.json())
-        name = "frost"
-        dataset = titantuner.dataset.Dataset(name, lats, lons, elevs, values, unixtime, variable)
-        return dataset
+    def load_batch(self, variables: list, unixtimes: list, max_concurrency: int = 4, retries: int = 3, backoff: float = 0.5) -> dict:
+        """Loads several variables and hours concurrently
+
+        Each (variable, hour) is fetched with a separate request, with at most max_concurrency requests
+        at a time. Use fetch_batch instead when already inside a running asyncio event loop.
+
+        Arguments:
+            variables (list): Variables to load
+            unixtimes (list): Start of each hour to load [s]
+            max_concurrency (int): Maximum number of simultaneous requests, at most MAX_CONNECTIONS
+            retries (int): Number of times a failed request is retried
+            backoff (float): Seconds to wait before the first retry, doubled for each following retry
+
+        Returns:
+            dict: variable -> Dataset with the observations of all hours stacked. Dataset.times contains
+                the time of each observation.
+        """
+        keys = [(variable, unixtime) for variable in variables for unixtime in unixtimes]
+        if len(keys) == 0:
+            return dict()
+        parameters = [self.get_parameters(variable, unixtime) for variable, unixtime in keys]
+        responses = asyncio.run(self.fetch_batch(parameters, max_concurrency, retries, backoff))
+
+        parsed = dict()
+        for (variable, unixtime), data in zip(keys, responses):
+            parsed.setdefault(variable, []).append(self.parse(data))
+
+        datasets = dict()
+        for variable, results in parsed.items():
+            values, lats, lons, elevs, units, times = zip(*results)
+            datasets[variable] = titantuner.dataset.Dataset("frost", np.concatenate(lats), np.concatenate(lons),
+                    np.concatenate(elevs), np.concatenate(values), min(unixtimes), variable, np.concatenate(times))
+        return datasets
+
+    async def fetch_batch(self, parameters: list, max_concurrency: int = 4, retries: int = 3, backoff: float = 0.5) -> list:
+        """Fetches the responses for a list of request parameters concurrently, see load_batch
+
+        Returns:
+            list: json response for each element in parameters
+        """
+        # More threads than connections in the pool of the session would only wait for a connection
+        max_concurrency = max(1, min(max_concurrency, self.MAX_CONNECTIONS))
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            async def fetch(p):
+                async with semaphore:
+                    for attempt in range(retries + 1):
+                        try:
+                            return await loop.run_in_executor(executor, self.fetch, p)
+                        except requests.RequestException as e:
+                            status = e.response.status_code if e.response is not None else None
+                            # Client errors other than "too many requests" will not go away by retrying
+                            if attempt == retries or (status is not None and 400 <= status < 500 and status != 429):
+                                raise
+                            delay = backoff * 2**attempt
+                            print(f"Request for {p['elementids']} {p['time']} failed ({e}), retrying in {delay} s")
+                            await asyncio.sleep(delay)
+            return await asyncio.gather(*[fetch(p) for p in parameters])
 
     @staticmethod
     def unixtime_to_reference_time(unixtime):
@@ -78,16 +179,26 @@ class FrostSource(Source):
 
     @staticmethod
     def parse(data):
-        """Parse json output from frost (oda)"""
-        values = list()
-        lats = list()
-        lons = list()
-        elevs = list()
+        """Parse json output from frost (oda)
+
+        The json is flattened into one list per field in a single pass, after which times are converted
+        and invalid observations removed with array operations.
+
+        Returns:
+            values, lats, lons, elevs (np.array): One element for each valid observation
+            units (str): Units of the values
+            times (np.array): Unixtime of each observation [s]
+        """
         units = None
         data = data["data"]["tseries"]
-        metadata = dict()
+        station_lats = list()
+        station_lons = list()
+        stations = list()
+        times = list()
+        values = list()
+        corrected = list()
+        checkfailed = list()
         for tseries in data:
-            id = "SN%d" % tseries["header"]["id"]["stationid"]
             units = tseries["header"]["extra"]["element"]["unit"]
 
             # Use this for kvkavka label, not for filter
@@ -96,57 +207,53 @@ class FrostSource(Source):
             #     print("Skipping station %s, wrong StationIDType=%s" % (id, typeid))
             #     continue
 
-            lat = float(tseries["header"]["extra"]["station"]["location"][0]["value"]["latitude"])
-            lon = float(tseries["header"]["extra"]["station"]["location"][0]["value"]["longitude"])
-            elev = 0
-
             # TODO: Check this output
             # https://frost-staging.met.no/api/v1/obs/met.no/kvkafka/get?stationids=18700&levels=0&sensors=0&elementids=air_temperature&time=latest&latestmaxage=PT1H&latestlimit=1&incobs=true
             # And parse the output properly
-
-            # TODO:
-            if len(tseries["observations"]) == 0:
+            observations = tseries["observations"]
+            if len(observations) == 0:
                 continue
 
-            observations = tseries["observations"]
+            location = tseries["header"]["extra"]["station"]["location"][0]["value"]
+            stations += [len(station_lats)] * len(observations)
+            station_lats += [location["latitude"]]
+            station_lons += [location["longitude"]]
             for observation in observations:
-                reference_time = observation["time"]
-                date = int(reference_time[0:4] + reference_time[5:7] + reference_time[8:10])
-                hour = int(reference_time[11:13])
-                minute = int(reference_time[14:16])
-                second = int(reference_time[17:19])
-                # if minute == 0 and second == 0:
-
-                value = observation["body"]["value"]
-
-                if "kvcorrqc1" in observation["body"]:
-                    # Try to use kvalobs-corrected values if they exist
-                    value = observation["body"]["kvcorrqc1"]
-                elif "kvcheckfailed" in observation["body"]:
-                    # Don't use this observation at all if the value is flagged
-                    continue
-
-                if value in ["-32766", "-32767"]:
-                    # These are special codes with bizare meaning. Ask Ketil Tunheim:
-                    # ... there's -32766 and -32767, I don't remember what difference they are meant to
-                    # signify; but kvalobs writes them for timeseries where people's old scripts require
-                    # and demand that there always is a timestep (and it's a way to definitely know if a
-                    # value was missing unintentionally as opposed to intentionally because that station
-                    # doesn't measure at that time)
-                    continue
-
-                unixtime = (
-                    titantuner.date_to_unixtime(date) + hour * 3600 + minute * 60 + second
-                )
-                if value == "":
-                    value = np.nan
-                value = float(value)
-
-                # TODO: Deal with special values, as with KDVH
-
-                if not np.isnan(value):
-                    values += [value]
-                    lats += [lat]
-                    lons += [lon]
-                    elevs += [elev]
-        return values, lats, lons, elevs, units
+                body = observation["body"]
+                # Drop the timezone designator ("Z"), which numpy does not parse
+                times += [observation["time"][0:19]]
+                # Try to use kvalobs-corrected values if they exist
+                values += [str(body.get("kvcorrqc1", body["value"]))]
+                corrected += ["kvcorrqc1" in body]
+                checkfailed += ["kvcheckfailed" in body]
+
+        if len(times) == 0:
+            empty = np.zeros(0)
+            return empty, empty, empty, empty, units, np.zeros(0, int)
+
+        stations = np.array(stations)
+        times = np.array(times, dtype="datetime64[s]").astype(int)
+
+        # Don't use the observation at all if the value is flagged and there is no corrected value
+        values = np.array(values)
+        valid = np.array(corrected) | ~np.array(checkfailed)
+
+        # These are special codes with bizare meaning. Ask Ketil Tunheim:
+        # ... there's -32766 and -32767, I don't remember what difference they are meant to
+        # signify; but kvalobs writes them for timeseries where people's old scripts require
+        # and demand that there always is a timestep (and it's a way to definitely know if a
+        # value was missing unintentionally as opposed to intentionally because that station
+        # doesn't measure at that time)
+        valid &= (values != "-32766") & (values != "-32767")
+
+        values[values == ""] = "nan"
+        values = values.astype(float)
+        # TODO: Deal with special values, as with KDVH
+        valid &= ~np.isnan(values)
+
+        Ivalid = np.where(valid)[0]
+        stations = stations[Ivalid]
+        lats = np.array(station_lats, float)[stations]
+        lons = np.array(station_lons, float)[stations]
+        elevs = np.zeros(len(Ivalid))
+        return values[Ivalid], lats, lons, elevs, units, times[Ivalid]
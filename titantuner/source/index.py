@@ -0,0 +1,95 @@
+"""This module keeps track of the files in a set of directories and file patterns"""
+
+import glob
+import os
+import threading
+import time
+
+
+class FileIndex:
+    """Maps file basenames to paths, for all files in a list of directories or file patterns
+
+    The index is refreshed incrementally: a directory is only listed again when its modification time
+    has changed, which is the case when files are added to it or removed from it.
+    """
+    def __init__(self, directories_or_patterns: list):
+        if not isinstance(directories_or_patterns, list):
+            raise ValueError("directories_or_patterns must be a list")
+        self.directories_or_patterns = directories_or_patterns
+        # Increased each time the set of files changes
+        self.version = 0
+        self.names = dict()
+        self._filenames = [list() for _ in directories_or_patterns]
+        self._mtimes = [None for _ in directories_or_patterns]
+        self._lock = threading.Lock()
+        self._thread = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Updates the index with files that have been added or removed
+
+        Returns:
+            bool: True if the index changed
+        """
+        with self._lock:
+            changed = False
+            for i, directory in enumerate(self.directories_or_patterns):
+                mtime = self._get_mtime(directory)
+                if mtime is not None and mtime == self._mtimes[i]:
+                    continue
+                self._mtimes[i] = mtime
+                filenames = self._list(directory)
+                if filenames != self._filenames[i]:
+                    self._filenames[i] = filenames
+                    changed = True
+
+            if changed:
+                filenames = sorted(f for filenames in self._filenames for f in filenames)
+                # Replace the dict rather than modifying it, so that readers in other threads always
+                # see a complete index
+                self.names = {os.path.basename(filename): filename for filename in filenames}
+                self.version += 1
+            return changed
+
+    def watch(self, interval: float):
+        """Refreshes the index every interval seconds in a background thread"""
+        if self._thread is not None:
+            return
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    if self.refresh():
+                        print(f"Data files changed, {len(self.names)} files available")
+                except Exception as e:
+                    print(f"Could not refresh the list of data files: {e}")
+        self._thread = threading.Thread(target=run, name="file-index", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _get_mtime(directory_or_pattern: str):
+        """Returns the modification time of the directory that must change when files are added or
+        removed, or None if there is no such directory (e.g. wildcards in the directory part of a pattern)"""
+        if os.path.isdir(directory_or_pattern):
+            directory = directory_or_pattern
+        else:
+            directory = os.path.dirname(directory_or_pattern) or "."
+            if glob.has_magic(directory):
+                return None
+        try:
+            return os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _list(directory_or_pattern: str) -> list:
+        """Returns the sorted names of all files (not directories) in a directory or file pattern"""
+        if os.path.isdir(directory_or_pattern):
+            directory = directory_or_pattern.rstrip('/')
+            with os.scandir(directory) as it:
+                # is_dir does not need a stat call on most file systems
+                filenames = [f"{directory}/{entry.name}" for entry in it if not entry.is_dir()]
+        else:
+            filenames = [filename for filename in glob.glob(directory_or_pattern) if not os.path.isdir(filename)]
+        filenames.sort()
+        return filenames
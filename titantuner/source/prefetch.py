@@ -0,0 +1,57 @@
+"""This module loads datasets in the background before they are selected"""
+
+import concurrent.futures
+
+
+class Prefetcher:
+    """Loads the datasets next to the selected one into a source's dataset cache
+
+    For sources that require a time, the neighbours are the previous and next hours of the same key.
+    Otherwise, they are the previous and next keys.
+    """
+    def __init__(self, source, executor: concurrent.futures.Executor, num_neighbours: int):
+        """
+        Arguments:
+            source (CachedSource): Source whose cache is filled
+            executor (concurrent.futures.Executor): Runs the loads
+            num_neighbours (int): Number of datasets to load on each side of the selected one
+        """
+        self.source = source
+        self.executor = executor
+        self.num_neighbours = num_neighbours
+        self.futures = dict()
+
+    def get_neighbours(self, index: int, unixtime: int = None) -> list:
+        """Returns the load arguments of the datasets around the one at index, closest first"""
+        keys = self.source.keys
+        neighbours = list()
+        for distance in range(1, self.num_neighbours + 1):
+            for sign in [1, -1]:
+                if self.source.requires_time:
+                    neighbours += [(keys[index], unixtime + sign * distance * 3600)]
+                elif 0 <= index + sign * distance < len(keys):
+                    neighbours += [(keys[index + sign * distance],)]
+        return neighbours
+
+    def prefetch(self, index: int, unixtime: int = None):
+        """Starts loading the neighbours of the dataset at index, and cancels the loads of datasets that
+        are no longer neighbours"""
+        neighbours = self.get_neighbours(index, unixtime)
+        for keys in list(self.futures):
+            if keys not in neighbours or self.futures[keys].done():
+                self.futures.pop(keys).cancel()
+        for keys in neighbours:
+            if keys not in self.futures and not self.source.is_cached(*keys):
+                self.futures[keys] = self.executor.submit(self._load, keys)
+
+    def cancel(self):
+        """Cancels all loads that have not started yet"""
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = dict()
+
+    def _load(self, keys):
+        try:
+            self.source.load(*keys)
+        except Exception as e:
+            print(f"Could not prefetch {keys}: {e}")
@@ -0,0 +1,120 @@
+"""This module serves recorded frost responses, so that FrostSource can be tested and benchmarked offline"""
+
+import argparse
+import http.server
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+
+class FrostStandIn:
+    """A local HTTP server that answers frost requests with recorded json files
+
+    A request for element E and time window T is answered with the file <E>_<T>.json if it exists, and
+    otherwise with <E>.json, where non-alphanumeric characters in E and T are replaced by "_". Requests
+    without a matching file get a 404 response.
+    """
+    def __init__(self, directory: str, port: int = 0, latency: float = 0, failures: int = 0):
+        """
+        Arguments:
+            directory (str): Directory with recorded responses
+            port (int): Port to listen on. If 0, a free port is chosen.
+            latency (float): Seconds to wait before answering each request, to mimic a remote server
+            failures (int): Number of requests to answer with "503 Service Unavailable" before serving
+                recorded responses, to test retries
+        """
+        self.directory = directory
+        self.latency = latency
+        self.failures = failures
+        self.num_requests = 0
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                standin._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("localhost", port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        """The url to pass to FrostSource"""
+        return f"http://localhost:{self.port}/api/v1/obs/met.no/filter/get"
+
+    def start(self):
+        """Starts serving requests in a background thread"""
+        self._thread = threading.Thread(target=self.server.serve_forever, name="frost-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @staticmethod
+    def get_filenames(element: str, time_window: str = None) -> list:
+        """Returns the names of the files that can answer a request, in order of preference"""
+        element = re.sub("[^A-Za-z0-9]+", "_", element)
+        filenames = [f"{element}.json"]
+        if time_window is not None:
+            filenames.insert(0, "%s_%s.json" % (element, re.sub("[^A-Za-z0-9]+", "_", time_window)))
+        return filenames
+
+    def _handle(self, request):
+        with self._lock:
+            self.num_requests += 1
+            fail = self.num_requests <= self.failures
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if fail:
+            request.send_error(503, "Stand-in failure")
+            return
+
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(request.path).query)
+        element = query.get("elementids", [""])[0]
+        time_window = query.get("time", [None])[0]
+        for filename in self.get_filenames(element, time_window):
+            filename = os.path.join(self.directory, filename)
+            if os.path.exists(filename):
+                with open(filename, "rb") as file:
+                    body = file.read()
+                request.send_response(200)
+                request.send_header("Content-Type", "application/json")
+                request.send_header("Content-Length", str(len(body)))
+                request.end_headers()
+                request.wfile.write(body)
+                return
+        request.send_error(404, f"No recorded response for {element} {time_window}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves recorded frost responses')
+    parser.add_argument('directory', help="Directory with recorded json responses")
+    parser.add_argument('-p', type=int, default=8082, dest="port")
+    parser.add_argument('--latency', type=float, default=0, help="Seconds to wait before answering each request")
+    args = parser.parse_args()
+
+    standin = FrostStandIn(args.directory, args.port, args.latency)
+    print(f"Serving recorded frost responses on {standin.url}")
+    standin.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
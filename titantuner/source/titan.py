@@ -1,26 +1,32 @@
+import glob
+import io
+import mmap
 import os
 import sys
+import warnings
 import numpy as np
-import glob
 
 import titantuner
-from . import Source
+from . import Source, Predicate
+from .index import FileIndex
 
 
 """This class load data from standardized Titan output files"""
 class TitanSource(Source):
-    def __init__(self, directories_or_patterns: list):
-        if not isinstance(directories_or_patterns, list):
-            raise ValueError("directories_or_patterns must be a list")
-        filenames = self.get_filenames(directories_or_patterns)
-
-        self.names = dict()
-        for filename in filenames:
-            if not os.path.isdir(filename):
-                name = os.path.basename(filename)
-                self.names[name] = filename
+    def __init__(self, directories_or_patterns: list, cache: titantuner.cache.DiskCache = None, predicate: Predicate = None):
+        """
+        Arguments:
+            directories_or_patterns (list): Directories or file patterns containing data
+            cache (titantuner.cache.DiskCache): Where to cache parsed files. If None, files are parsed
+                each time they are loaded.
+            predicate (Predicate): Only load rows satisfying this predicate, unless another one is
+                passed to load
+        """
+        self.index = FileIndex(directories_or_patterns)
         if len(self.names)==0:
             raise ValueError(f"No files to read in {directories_or_patterns} or no file following the pattern {directories_or_patterns}.")
+        self.cache = cache
+        self.predicate = predicate
 
     @staticmethod
     def get_filenames(directories_or_patterns: list):
@@ -39,18 +45,40 @@ class TitanSource(Source):
             filenames.sort()
         return filenames
 
+    @property
+    def names(self) -> dict:
+        """Dataset name -> filename"""
+        return self.index.names
+
     @property
     def keys(self) -> list:
         return list(self.names.keys())
 
+    @property
+    def keys_version(self) -> int:
+        return self.index.version
+
+    def watch(self, interval: float):
+        self.index.watch(interval)
+
     @property
     def key_label(self) -> str:
         return "Dataset"
 
-    def load(self, key: str) -> titantuner.dataset.Dataset:
+    def get_version(self, key: str, predicate: Predicate = None):
+        """Returns the modification time and size of the file of key, or None if it does not exist"""
+        try:
+            stat = os.stat(self.names[key])
+        except (KeyError, OSError):
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self, key: str, predicate: Predicate = None) -> titantuner.dataset.Dataset:
         filename = self.names[key]
+        if predicate is None:
+            predicate = self.predicate
         try:
-            lats, lons, elevs, values = self.parse_titan_file(filename)
+            names, table = self.read_table(filename, predicate)
         except Exception as e:
             # TODO: I wanted to remove  the invalid keys from the list but somehow if I do
             # self.names.pop(key)
@@ -64,53 +92,199 @@ class TitanSource(Source):
             variable = 'rr'
         print(f"Opening {filename}. Variable {variable}.")
         name = os.path.basename(filename)
-        dataset = titantuner.dataset.Dataset(name, lats, lons, elevs, values, None, variable)
+        # The first four rows of the table are lat, lon, elev, and value
+        buffer = table[:4]
+        if len(table) > 4 and not self._is_memory_mapped(table):
+            # Copy them, so that the dataset does not keep the other rows (e.g. prid) in memory. Only the
+            # pages of a memory map that are used are read, so those are not copied.
+            buffer = buffer.copy()
+        dataset = titantuner.dataset.Dataset.from_buffer(name, buffer, None, variable)
         return dataset
 
+    @staticmethod
+    def _is_memory_mapped(array: np.ndarray) -> bool:
+        while array is not None:
+            if isinstance(array, (np.memmap, mmap.mmap)):
+                return True
+            array = getattr(array, "base", None)
+        return False
+
+    def read_columns(self, filename: str, predicate: Predicate = None) -> dict:
+        """Returns the columns of a titan file, using the column cache if there is one
+
+        Arguments:
+            filename (str): The file to read
+            predicate (Predicate): If not None, only return rows satisfying this predicate
+        """
+        names, table = self.read_table(filename, predicate)
+        return dict(zip(names, table))
+
+    def read_table(self, filename: str, predicate: Predicate = None):
+        """Same as read_columns, but returns the columns as the rows of one 2D array
+
+        If the file is in the column cache and no predicate is given, the array is a read-only memory
+        map of the cache file, so that nothing is copied until the rows are used.
+
+        Returns:
+            names (list): Name of each row
+            table (np.array): Array with shape (len(names), N)
+        """
+        if self.cache is None:
+            columns = self.parse_titan_columns(filename, predicate=predicate)
+            self._check_predicate(filename, list(columns), predicate)
+            return list(columns), np.stack(list(columns.values()))
+
+        # The cache stores all rows, so that it can be used for any predicate
+        stat = os.stat(filename)
+        key = (self.CACHE_VERSION, os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            names, table = self._load_columns(cached)
+        else:
+            columns = self.parse_titan_columns(filename)
+            self._store_columns(key, columns)
+            names, table = list(columns), np.stack(list(columns.values()))
+        self._check_predicate(filename, names, predicate)
+        if predicate is not None:
+            # One gather for all columns
+            Ikeep = np.flatnonzero(predicate.mask(dict(zip(names, table))))
+            table = np.take(table, Ikeep, axis=1)
+        return names, table
+
+    @staticmethod
+    def _check_predicate(filename: str, names: list, predicate: Predicate):
+        """Warns if some criteria of predicate can not be applied to the columns of the file"""
+        if predicate is None:
+            return
+        for name in predicate.get_missing_columns(names):
+            warnings.warn(f"{filename} has no {name} column, so its rows are not filtered by {name}")
+
+    @staticmethod
+    def _load_columns(filename: str):
+        structured = np.load(filename, mmap_mode='r')
+        names = list(structured.dtype.names)
+        fields = [structured.dtype.fields[name][0] for name in names]
+        if all(field.base == np.float64 for field in fields) and structured.dtype.itemsize > 0:
+            # The columns are stored one after the other, so the file can be viewed as a 2D array
+            table = structured.reshape(1).view(np.float64).reshape(len(names), -1)
+            return names, np.asarray(table)
+        return names, np.stack([structured[name] for name in names])
+
+    def _store_columns(self, key, columns: dict):
+        num = len(columns['lat'])
+        table = np.zeros((), dtype=[(name, columns[name].dtype, (num,)) for name in columns])
+        for name in columns:
+            table[name] = columns[name]
+        self.cache.store(key, lambda file: np.save(file, table))
+
+    # Increase when the content of the column cache changes
+    CACHE_VERSION = 1
+
+    # Columns in titan files that are read, in addition to lat, lon, elev, and value
+    OPTIONAL_COLUMNS = ['prid', 'dqc']
+
     @staticmethod
     def parse_titan_file(filename, latrange=None, lonrange=None):
-        """ Parses files produced by titan.R """
-        data = dict()
-        lats = list()
-        lons = list()
-        elevs = list()
-        values = list()
+        """ Parses files produced by titan.R
+
+        Returns:
+            lats, lons, elevs, values (np.array): One element for each valid row
+        """
+        columns = TitanSource.parse_titan_columns(filename, latrange, lonrange)
+        return columns['lat'], columns['lon'], columns['elev'], columns['value']
+
+    @staticmethod
+    def parse_titan_columns(filename, latrange=None, lonrange=None, predicate: Predicate = None) -> dict:
+        """ Parses files produced by titan.R into columns
+
+        The whole file is parsed in one pass. Rows with an invalid value are skipped and missing
+        elevations ("NA") are set to -999. Rows outside latrange/lonrange or not satisfying the
+        predicate are dropped after parsing, before the columns are copied out of the parsed table.
+        Most of the time of np.loadtxt is spent splitting the lines, so parsing the columns of the
+        criteria first and the other columns only for the kept rows would not be faster.
+
+        Returns:
+            dict: column name -> np.array. Always contains lat, lon, elev, and value, and in addition
+                prid and dqc if the file has them.
+        """
         with open(filename, 'r') as file:
             header = file.readline().strip().split(';')
-            Ilat = header.index('lat')
-            Ilon = header.index('lon')
-            Ielev = header.index('elev')
-            if 'prid' in header:
-                Iprovider = header.index('prid')
-            else:
-                Iprovider = None
-            Ivalue = header.index('value')
-            for line in file:
-                words = line.strip().split(';')
-                lat = float(words[Ilat])
-                if latrange is not None and (lat < latrange[0] or lat > latrange[1]):
-                    continue
-                lon = float(words[Ilon])
-                if lonrange is not None and (lon < lonrange[0] or lon > lonrange[1]):
-                    continue
-                elev = -999
-                if words[Ielev] != "NA":
-                    elev = float(words[Ielev])
-                try:
-                    value = float(words[Ivalue])
-                    """
-                    if Iprovider is not None:
-                        provider = int(words[Iprovider])
-                        if provider > 20:
-                            continue
-                    """
-                    lats += [lat]
-                    lons += [lon]
-                    elevs += [elev]
-                    values += [value]
-                except Exception as e:
-                    print(e)
-        return np.array(lats), np.array(lons), np.array(elevs), np.array(values)
+            body = file.read()
+        names = ['lat', 'lon', 'elev', 'value'] + [name for name in TitanSource.OPTIONAL_COLUMNS if name in header]
+        usecols = [header.index(name) for name in names]
+        Ivalue = names.index('value')
+
+        try:
+            table = TitanSource._read_table(body, usecols)
+            valid = np.ones(table.shape[0], bool)
+        except ValueError:
+            # Some cells cannot be parsed as numbers, parse the columns one by one instead
+            table, valid = TitanSource._read_table_slow(body, usecols, Ivalue)
+
+        columns = dict(zip(names, table.T))
+        if np.any(columns['lat'] == TitanSource.NA_SENTINEL) or np.any(columns['lon'] == TitanSource.NA_SENTINEL):
+            raise ValueError(f"Missing latitude or longitude in {filename}")
+        columns['elev'][columns['elev'] == TitanSource.NA_SENTINEL] = -999
+        invalid = (columns['value'] == TitanSource.NA_SENTINEL) | ~valid
+        if latrange is not None or lonrange is not None:
+            invalid |= ~Predicate(latrange, lonrange).mask(columns)
+        if predicate is not None:
+            invalid |= ~predicate.mask(columns)
+        if np.any(invalid):
+            Ikeep = np.where(~invalid)[0]
+            columns = {name: column[Ikeep] for name, column in columns.items()}
+        return {name: np.ascontiguousarray(column) for name, column in columns.items()}
+
+    # Placeholder for "NA" cells, which numpy cannot parse. No observation can have this value.
+    NA_SENTINEL = -np.inf
+
+    @staticmethod
+    def _read_table(body: str, usecols: list) -> np.ndarray:
+        """Parses the columns usecols of a ';' separated text into a float array with one row per line
+
+        Raises:
+            ValueError: if any of the cells (other than "NA") is not a number
+        """
+        if 'NA' in body:
+            # Pad with newlines so that cells at the start and end of the text are also replaced. The
+            # replacement is done twice since two adjacent NA cells share a separator.
+            body = '\n' + body + '\n'
+            for old, new in ((';NA;', ';-inf;'), (';NA;', ';-inf;'), ('\nNA;', '\n-inf;'), (';NA\n', ';-inf\n')):
+                body = body.replace(old, new)
+        with warnings.catch_warnings():
+            # Ignore warnings about files without any observations
+            warnings.simplefilter("ignore")
+            return np.loadtxt(io.StringIO(body), delimiter=';', usecols=usecols, comments=None, ndmin=2)
+
+    @staticmethod
+    def _read_table_slow(body: str, usecols: list, Ioptional: int):
+        """Same as _read_table, but allows column Ioptional to contain cells that are not numbers
+
+        Returns:
+            table (np.array): Parsed table, with invalid cells set to nan
+            valid (np.array): True for rows where column Ioptional is valid
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            words = np.loadtxt(io.StringIO(body), delimiter=';', usecols=usecols, comments=None, ndmin=2, dtype=str)
+        table = np.full(words.shape, np.nan)
+        valid = np.ones(words.shape[0], bool)
+        for c in range(words.shape[1]):
+            column = words[:, c]
+            Ina = np.where(column == "NA")[0]
+            column[Ina] = "-inf"
+            try:
+                table[:, c] = column.astype(float)
+            except ValueError:
+                if c != Ioptional:
+                    raise
+                for i, word in enumerate(column):
+                    try:
+                        table[i, c] = float(word)
+                    except ValueError as e:
+                        valid[i] = False
+                        print(e)
+        return table, valid
 
     @staticmethod
     def get_default_data_dir() -> str: